@@ -0,0 +1,104 @@
+"""
+Benchmark of the POST / latency with the artifacts loaded once against
+loading them on every request.
+
+Uses the artifacts in model/ or, when they are not pulled from dvc, fits a
+random forest, encoder and label binarizer on data/census_cleaned.csv in a
+temporary directory. The p50 and p99 latency of the prediction requests
+are printed for both modes.
+
+    python benchmark_api.py
+    python benchmark_api.py --requests 200
+"""
+import os
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from joblib import dump
+from fastapi.testclient import TestClient
+
+import main
+from model.artifacts import ArtifactStore, ARTIFACT_PATHS
+from model.data import process_data
+from model.model_functions import train_model
+
+USER = {
+    "age": 60,
+    "workclass": "Private",
+    "education": "Doctorate",
+    "maritalStatus": "Divorced",
+    "occupation": "Transport-moving",
+    "relationship": "Not-in-family",
+    "race": "White",
+    "sex": "Male",
+    "hoursPerWeek": 76,
+    "nativeCountry": "United-States",
+}
+
+
+def train_artifacts(directory, data_path="data/census_cleaned.csv"):
+    """ Fit and dump the artifacts on the census data. """
+    df = pd.read_csv(data_path, index_col=[0])
+    for column in main.cat_features + ["salary"]:
+        df[column] = df[column].str.strip()
+    X, y, encoder, lb = process_data(
+        df, categorical_features=main.cat_features, label="salary",
+        training=True)
+    paths = {name: os.path.join(directory, os.path.basename(path))
+             for name, path in ARTIFACT_PATHS.items()}
+    dump(train_model(X, y), paths["model"])
+    dump(encoder, paths["encoder"])
+    dump(lb, paths["lb"])
+    return paths
+
+
+def percentiles(latencies):
+    latencies = np.array(latencies) * 1000
+    return np.percentile(latencies, 50), np.percentile(latencies, 99)
+
+
+def run(client, requests, reload_each):
+    """ Latency of `requests` predictions, with a full artifact load
+    before each one when reload_each is True, as the handler did. """
+    latencies = []
+    for _ in range(requests):
+        start = time.perf_counter()
+        if reload_each:
+            main.artifacts.load()
+        response = client.post("/", json=USER)
+        latencies.append(time.perf_counter() - start)
+        assert response.status_code == 200
+    return latencies
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--requests', type=int, default=100)
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as directory:
+        if all(os.path.exists(path) for path in ARTIFACT_PATHS.values()):
+            paths = ARTIFACT_PATHS
+        else:
+            print('Artifacts not found, fitting them on the census data')
+            paths = train_artifacts(directory)
+        main.artifacts = ArtifactStore(paths, prepare=main.compile_encoder)
+        client = TestClient(main.app)
+        run(client, 5, False)
+        results = {}
+        for mode, reload_each in [('load per request', True),
+                                  ('loaded once', False)]:
+            requests = max(args.requests // 10, 5) if reload_each \
+                else args.requests
+            results[mode] = percentiles(run(client, requests, reload_each))
+            print('%-17s p50 %9.2f ms  p99 %9.2f ms' % (
+                mode, *results[mode]))
+    print('p50 speedup x%.1f' % (
+        results['load per request'][0] / results['loaded once'][0]))
+
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -0,0 +1,103 @@
+"""
+Benchmark of the /batch endpoint against one POST / per user.
+
+For each batch size the users are sent as one JSON list to /batch, as
+NDJSON to /batch and one by one to POST /, and the users predicted per
+second are printed. The single calls are timed on at most
+`--max-single` users and reported per user. The users are drawn from
+data/census_cleaned.csv, the artifacts are the ones benchmark_api.py
+uses.
+
+    python benchmark_batch.py
+    python benchmark_batch.py --sizes 1 100 10000
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import pandas as pd
+from fastapi.testclient import TestClient
+from pydantic import ValidationError
+
+import main
+from benchmark_api import train_artifacts
+from model.artifacts import ArtifactStore, ARTIFACT_PATHS
+
+
+def sample_users(size, data_path="data/census_cleaned.csv"):
+    """ `size` users of the census data as /batch items, skipping the
+    rows with values the API does not accept (ie. '?'). """
+    df = pd.read_csv(data_path, index_col=[0])
+    users = []
+    for row in df.to_dict("records"):
+        user = {}
+        for field, column in main.USER_COLUMNS.items():
+            value = row[column]
+            user[field] = value.strip() if isinstance(value, str) \
+                else int(value)
+        try:
+            main.User(**user)
+        except ValidationError:
+            continue
+        users.append(user)
+    return [users[i % len(users)] for i in range(size)]
+
+
+def timed(func, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--sizes', type=int, nargs='+',
+                        default=[1, 100, 10_000])
+    parser.add_argument('--max-single', type=int, default=200)
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    with tempfile.TemporaryDirectory() as directory:
+        if all(os.path.exists(path) for path in ARTIFACT_PATHS.values()):
+            paths = ARTIFACT_PATHS
+        else:
+            print('Artifacts not found, fitting them on the census data')
+            paths = train_artifacts(directory)
+        main.artifacts = ArtifactStore(paths, prepare=main.compile_encoder)
+        client = TestClient(main.app)
+        client.post("/", json=sample_users(1)[0])
+
+        for size in args.sizes:
+            users = sample_users(size)
+            ndjson = "\n".join(json.dumps(user) for user in users)
+            single = users[:args.max_single]
+
+            def post_batch():
+                response = client.post("/batch", json=users)
+                assert response.status_code == 200, response.text
+
+            def post_ndjson():
+                response = client.post(
+                    "/batch", data=ndjson,
+                    headers={"content-type": "application/x-ndjson"})
+                assert response.status_code == 200, response.text
+
+            def post_single():
+                for user in single:
+                    assert client.post("/", json=user).status_code == 200
+
+            batch_rate = size / timed(post_batch)
+            ndjson_rate = size / timed(post_ndjson)
+            single_rate = len(single) / timed(post_single, 1)
+            print('%6d users  /batch %9.0f users/s  ndjson %9.0f users/s  '
+                  'single POST / %7.0f users/s  x%.1f' % (
+                      size, batch_rate, ndjson_rate, single_rate,
+                      batch_rate / single_rate))
+
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -0,0 +1,86 @@
+"""
+Benchmark of the compiled encoder against process_data.
+
+The encoder is fitted on the training split of data/census_cleaned.csv,
+then the test split is encoded one row at a time, as POST / does, and as
+one frame, as /batch does. Both outputs are checked against process_data
+and the time per row of each path is printed.
+
+    python benchmark_encoder.py
+    python benchmark_encoder.py --rows 500
+"""
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from pandas.core.frame import DataFrame
+from sklearn.model_selection import train_test_split
+
+from main import cat_features, CONTINUOUS_FEATURES
+from model.data import process_data, CompiledEncoder
+
+
+def timed(func, repeat=3):
+    best = float("inf")
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        best = min(best, time.perf_counter() - start)
+    return best
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=1000,
+                        help='rows encoded one at a time')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    df = pd.read_csv("data/census_cleaned.csv", index_col=[0])
+    train, test = train_test_split(df, test_size=0.20, random_state=0)
+    test = test.drop(columns=["salary"])
+    _, _, encoder, lb = process_data(
+        train, categorical_features=cat_features, label="salary",
+        training=True)
+    compiled = CompiledEncoder(encoder, cat_features, CONTINUOUS_FEATURES)
+    records = test.to_dict("records")[:args.rows]
+
+    X_test, _, _, _ = process_data(
+        test, categorical_features=cat_features, training=False,
+        encoder=encoder)
+    assert np.array_equal(compiled.transform(test), X_test)
+
+    def rows_process_data():
+        # one single row frame per request, as the handler built it
+        for row in records:
+            process_data(
+                DataFrame([row], columns=test.columns),
+                categorical_features=cat_features, training=False,
+                encoder=encoder)
+
+    def rows_compiled():
+        for row in records:
+            compiled.transform_row(
+                [row[name] for name in CONTINUOUS_FEATURES],
+                [row[name] for name in cat_features])
+
+    def frame_process_data():
+        process_data(test, categorical_features=cat_features,
+                     training=False, encoder=encoder)
+
+    results = [
+        ('row  process_data', timed(rows_process_data, 1) / len(records)),
+        ('row  compiled', timed(rows_compiled) / len(records)),
+        ('frame process_data', timed(frame_process_data) / len(test)),
+        ('frame compiled', timed(lambda: compiled.transform(test))
+         / len(test)),
+    ]
+    for name, seconds in results:
+        print('%-19s %10.2f us/row' % (name, seconds * 1e6))
+    print('per row speedup x%.0f, per frame speedup x%.1f' % (
+        results[0][1] / results[1][1], results[2][1] / results[3][1]))
+
+
+if __name__ == '__main__':
+    main_benchmark()
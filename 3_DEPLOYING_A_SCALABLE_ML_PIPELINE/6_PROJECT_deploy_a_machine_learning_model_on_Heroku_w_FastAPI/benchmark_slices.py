@@ -0,0 +1,83 @@
+"""
+Benchmark of the slice metrics engine against the per slice loop.
+
+A forest is fitted on the training split of data/census_cleaned.csv,
+then the metrics of every (feature, value) slice of the test split are
+computed by filtering, encoding and predicting each slice, as
+model_slicing did, and by model/slices.py from one prediction of the test
+set. Both results are compared and timed, and the engine is also timed
+with the continuous features as slices too (a few hundred slices).
+
+    python benchmark_slices.py
+"""
+import os
+import time
+import argparse
+import numpy as np
+import pandas as pd
+from sklearn.model_selection import train_test_split
+
+from main import cat_features, CONTINUOUS_FEATURES
+from model.data import process_data
+from model.model_functions import train_model, compute_model_metrics
+from model.slices import slice_counts, slice_metrics
+
+
+def loop_slicing(test, model, encoder, lb):
+    """ The former model_slicing, one encoding and prediction per slice. """
+    results = []
+    for cat in cat_features:
+        for cls in test[cat].unique():
+            df_temp = test[test[cat] == cls]
+            X_test_temp, y_test_temp, _, _ = process_data(
+                df_temp, categorical_features=cat_features,
+                label="salary", encoder=encoder, lb=lb, training=False)
+            y_preds = model.predict(X_test_temp)
+            results.append(compute_model_metrics(y_test_temp, y_preds))
+    return np.array(results)
+
+
+def engine_slicing(test, model, encoder, lb, features=cat_features):
+    X_test, y_test, _, _ = process_data(
+        test, categorical_features=cat_features, label="salary",
+        encoder=encoder, lb=lb, training=False)
+    predictions = model.predict(X_test)
+    start = time.perf_counter()
+    slices = slice_metrics(
+        slice_counts(test, features, y_test, predictions))
+    return slices, time.perf_counter() - start
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--n-estimators', type=int, default=100)
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    df = pd.read_csv("data/census_cleaned.csv", index_col=[0])
+    train, test = train_test_split(df, test_size=0.20, random_state=0)
+    X_train, y_train, encoder, lb = process_data(
+        train, categorical_features=cat_features, label="salary",
+        training=True)
+    model = train_model(X_train, y_train, n_estimators=args.n_estimators)
+
+    start = time.perf_counter()
+    expected = loop_slicing(test, model, encoder, lb)
+    loop_seconds = time.perf_counter() - start
+    start = time.perf_counter()
+    slices, count_seconds = engine_slicing(test, model, encoder, lb)
+    engine_seconds = time.perf_counter() - start
+    assert np.allclose(
+        slices[["precision", "recall", "fbeta"]].to_numpy(), expected)
+
+    features = cat_features + CONTINUOUS_FEATURES
+    many, many_seconds = engine_slicing(test, model, encoder, lb, features)
+    print('%d slices  loop %8.3fs  engine %8.3fs (metrics %.2f ms)  x%.0f'
+          % (len(slices), loop_seconds, engine_seconds,
+             count_seconds * 1000, loop_seconds / engine_seconds))
+    print('%d slices  engine metrics %.2f ms' % (
+        len(many), many_seconds * 1000))
+
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -0,0 +1,98 @@
+"""
+Benchmark of the dense and sparse training pipelines.
+
+The census data is replicated `--replicate` times, then encoded with
+process_data and fitted with train_model (SMOTE and the random forest) in
+the dense and in the sparse mode. Each mode runs in its own process, so
+the reported peak memory (max resident set size) is that mode's alone.
+
+    python benchmark_sparse.py
+    python benchmark_sparse.py --replicate 10 --n-estimators 10
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import resource
+import subprocess
+import pandas as pd
+
+from main import cat_features
+from model.data import process_data
+from model.model_functions import train_model
+
+
+def peak_mb():
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def run_mode(sparse, replicate, n_estimators,
+             data_path="data/census_cleaned.csv"):
+    """ Encode and fit the replicated data in one mode. """
+    df = pd.read_csv(data_path, index_col=[0])
+    # categories keep the replicated frame small, the strings would not
+    for column in cat_features + ["salary"]:
+        df[column] = df[column].astype("category")
+    df = pd.concat([df] * replicate, ignore_index=True)
+    loaded_mb = peak_mb()
+
+    start = time.perf_counter()
+    X, y, _, _ = process_data(
+        df, categorical_features=cat_features, label="salary",
+        training=True, sparse=sparse)
+    encode_seconds = time.perf_counter() - start
+    del df
+    X_mb = (X.data.nbytes + X.indices.nbytes + X.indptr.nbytes) / 2**20 \
+        if sparse else X.nbytes / 2**20
+
+    start = time.perf_counter()
+    model = train_model(X, y, n_estimators=n_estimators)
+    fit_seconds = time.perf_counter() - start
+    assert model is not None, "train_model failed, see the log"
+    return {
+        "mode": "sparse" if sparse else "dense",
+        "rows": X.shape[0],
+        "X_mb": X_mb,
+        "encode_s": encode_seconds,
+        "fit_s": fit_seconds,
+        "data_peak_mb": loaded_mb,
+        "peak_mb": peak_mb(),
+    }
+
+
+def main_benchmark():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--replicate', type=int, default=100)
+    parser.add_argument('--n-estimators', type=int, default=100)
+    parser.add_argument('--mode', choices=['dense', 'sparse'],
+                        help='run a single mode in this process')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    if args.mode:
+        print(json.dumps(run_mode(
+            args.mode == 'sparse', args.replicate, args.n_estimators)))
+        return
+
+    print('census x%d, %d trees' % (args.replicate, args.n_estimators))
+    for mode in ['dense', 'sparse']:
+        result = subprocess.run(
+            [sys.executable, __file__, '--mode', mode,
+             '--replicate', str(args.replicate),
+             '--n-estimators', str(args.n_estimators)],
+            capture_output=True, text=True)
+        if result.returncode != 0:
+            print('%-6s failed (exit %d), ie. out of memory' % (
+                mode, result.returncode))
+            continue
+        r = json.loads(result.stdout.strip().splitlines()[-1])
+        print('%-6s %9d rows  X %8.1f MB  encode %6.2fs  fit %8.2fs  '
+              'peak %8.1f MB (data loaded %.1f MB)' % (
+                  r['mode'], r['rows'], r['X_mb'], r['encode_s'],
+                  r['fit_s'], r['peak_mb'], r['data_peak_mb']))
+
+
+if __name__ == '__main__':
+    main_benchmark()
@@ -3,15 +3,18 @@ author:
 Date:10/03/2022
 """
 
+import json
 from typing import Literal
-from fastapi import FastAPI
-from pydantic import BaseModel
-from joblib import load
+from fastapi import FastAPI, Request
+from fastapi.concurrency import run_in_threadpool
+from fastapi.responses import JSONResponse
+from pydantic import BaseModel, ValidationError
 
 from pandas.core.frame import DataFrame
-import numpy as np
 from model import model_functions
 from model import data
+from model.artifacts import ArtifactStore
+import logging
 import os
 
 if "DYNO" in os.environ and os.path.isdir(".dvc"):
@@ -31,6 +34,23 @@ cat_features = [
     "native-country",
     ]
 
+# User fields to the columns of the census data
+USER_COLUMNS = {
+    "age": "age",
+    "workclass": "workclass",
+    "education": "education",
+    "maritalStatus": "marital-status",
+    "occupation": "occupation",
+    "relationship": "relationship",
+    "race": "race",
+    "sex": "sex",
+    "hoursPerWeek": "hours-per-week",
+    "nativeCountry": "native-country",
+    }
+CONTINUOUS_FEATURES = ["age", "hours-per-week"]
+# largest number of users in one /batch request
+MAX_BATCH = 10_000
+
 
 class User(BaseModel):
     age: int
@@ -75,46 +95,139 @@ class User(BaseModel):
 app = FastAPI()
 
 
+def compile_encoder(state):
+    """ Lookup tables of the fitted encoder for the request handlers. """
+    state["fast_encoder"] = data.CompiledEncoder(
+        state["encoder"], cat_features, CONTINUOUS_FEATURES)
+
+
+# model, encoder and label binarizer, loaded at startup and reloaded when
+# the files change
+artifacts = ArtifactStore(prepare=compile_encoder)
+
+
+# loading or reloading the artifacts unpickles the forest, so the handlers
+# that use them run in the threadpool, not on the event loop
+@app.on_event("startup")
+async def load_artifacts():
+    try:
+        await run_in_threadpool(artifacts.load)
+    except Exception as e:
+        # /ready reports it, the next request tries again
+        artifacts.error = repr(e)
+        logging.info('ERROR: Artifacts not loaded: %s', e)
+
+
+@app.get("/health")
+async def health():
+    return {
+        "status": "ok",
+        "ready": artifacts.ready,
+        "versions": artifacts.versions,
+        }
+
+
+@app.get("/ready")
+def ready():
+    try:
+        state = artifacts.get()
+    except Exception as e:
+        artifacts.error = repr(e)
+        return JSONResponse(
+            status_code=503,
+            content={"status": "not ready", "error": artifacts.error})
+    return {
+        "status": "ready",
+        "versions": state["versions"],
+        "loaded_at": state["loaded_at"],
+        "loads": artifacts.loads,
+        }
+
+
 @app.get("/")
 async def get_items():
     return {"message": "Hello, welcome to our app!"}
 
 
 @app.post("/")
-async def inferences(user_data: User):
-    model_object = load("model/model.joblib")
-    encoder = load("model/encoder.joblib")
-    lb = load("model/lb.joblib")
-
-    array = np.array([[
-                     user_data.age,
-                     user_data.workclass,
-                     user_data.education,
-                     user_data.maritalStatus,
-                     user_data.occupation,
-                     user_data.relationship,
-                     user_data.race,
-                     user_data.sex,
-                     user_data.hoursPerWeek,
-                     user_data.nativeCountry
-                     ]])
-
-    df_temp = DataFrame(data=array, columns=[
-        "age",
-        "workclass",
-        "education",
-        "marital-status",
-        "occupation",
-        "relationship",
-        "race",
-        "sex",
-        "hours-per-week",
-        "native-country",
-    ])
-    X, _, _, _ = data.process_data(
-        df_temp,
-        categorical_features=cat_features,
-        encoder=encoder, lb=lb, training=False)
+def inferences(user_data: User):
+    state = artifacts.get()
+    model_object = state["model"]
+    lb = state["lb"]
+
+    # the same features as process_data, from the compiled lookups
+    X = state["fast_encoder"].transform_row(
+        [user_data.age, user_data.hoursPerWeek],
+        [user_data.workclass,
+         user_data.education,
+         user_data.maritalStatus,
+         user_data.occupation,
+         user_data.relationship,
+         user_data.race,
+         user_data.sex,
+         user_data.nativeCountry])
     pred = model_functions.inference(model_object, X)
     y = lb.inverse_transform(pred)[0]
     return {"prediction": y}
+
+
+def users_frame(users):
+    """ One DataFrame of validated users, built column by column. """
+    return DataFrame({
+        column: [getattr(user, field) for user in users]
+        for field, column in USER_COLUMNS.items()})
+
+
+async def read_users(request):
+    """ The users of a /batch body: a JSON list, or one JSON object per
+    line when the content type is application/x-ndjson, parsed as the
+    body streams in. """
+    if "ndjson" in request.headers.get("content-type", ""):
+        items = []
+        buffer = b""
+        async for chunk in request.stream():
+            lines = (buffer + chunk).split(b"\n")
+            buffer = lines.pop()
+            items.extend(json.loads(line) for line in lines if line.strip())
+            if len(items) > MAX_BATCH:
+                break
+        if buffer.strip():
+            items.append(json.loads(buffer))
+    else:
+        items = await request.json()
+        if not isinstance(items, list):
+            raise ValueError("expected a JSON list of users")
+    return items
+
+
+@app.post("/batch")
+async def batch_inferences(request: Request):
+    try:
+        items = await read_users(request)
+    except ValueError as e:
+        return JSONResponse(status_code=400, content={"detail": str(e)})
+    if len(items) > MAX_BATCH:
+        return JSONResponse(
+            status_code=413,
+            content={"detail": "at most %d users per batch" % MAX_BATCH})
+    if not items:
+        return {"predictions": []}
+    return await run_in_threadpool(predict_users, items)
+
+
+def predict_users(items):
+    """ Validate the users of a batch, then one encoding and one predict
+    call for the whole batch. Run in the threadpool, validating 10000
+    users would hold the event loop. """
+    users = []
+    for index, item in enumerate(items):
+        try:
+            users.append(User(**item))
+        except (ValidationError, TypeError) as e:
+            return JSONResponse(
+                status_code=422,
+                content={"detail": "user %d: %s" % (index, e)})
+    state = artifacts.get()
+    X = state["fast_encoder"].transform(users_frame(users))
+    pred = model_functions.inference(state["model"], X)
+    return {"predictions": state["lb"].inverse_transform(pred).tolist()}
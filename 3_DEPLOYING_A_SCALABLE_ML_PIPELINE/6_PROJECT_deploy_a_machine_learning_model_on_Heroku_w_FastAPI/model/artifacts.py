@@ -0,0 +1,129 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from joblib import load
+
+
+ARTIFACT_PATHS = {
+    "model": "model/model.joblib",
+    "encoder": "model/encoder.joblib",
+    "lb": "model/lb.joblib",
+}
+
+
+def file_version(path):
+    """ Short sha256 digest of a file, read in chunks. """
+    digest = hashlib.sha256()
+    with open(path, "rb") as file:
+        for chunk in iter(lambda: file.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+class ArtifactStore:
+    """ Model, encoder and label binarizer loaded once and shared by
+    the requests. Loading blocks for the unpickling of the forest, so
+    call it from a thread, not from the event loop.
+
+    The files are checked at most every `check_interval` seconds and
+    reloaded when one of them changed (new size or modification time).
+    The new artifacts are swapped in together, so a request sees either
+    the old or the new set, and a failed reload keeps serving the old
+    set.
+
+    Inputs
+    ------
+    paths : dict
+        Artifact name to joblib file, ARTIFACT_PATHS by default.
+    check_interval : float
+        Seconds between checks of the files.
+    prepare : callable
+        Called with each newly loaded state to add derived objects to
+        it, ie. an encoder compiled from the fitted one.
+    """
+
+    def __init__(self, paths=None, check_interval=2.0, prepare=None):
+        self.paths = dict(paths or ARTIFACT_PATHS)
+        self.check_interval = check_interval
+        self.prepare = prepare
+        self.loads = 0
+        self.error = None
+        self._state = None
+        self._stamps = None
+        self._next_check = 0.0
+        self._lock = threading.Lock()
+
+    def _file_stamps(self):
+        stamps = {}
+        for name, path in self.paths.items():
+            stat = os.stat(path)
+            stamps[name] = (stat.st_size, stat.st_mtime_ns)
+        return stamps
+
+    def load(self):
+        """ Load all artifacts and swap them in.
+
+        Returns
+        -------
+        state : dict
+            The artifacts by name, their versions and the load time.
+        """
+        with self._lock:
+            start = time.perf_counter()
+            before = self._file_stamps()
+            state = {name: load(path) for name, path in self.paths.items()}
+            state["versions"] = {
+                name: file_version(path)
+                for name, path in self.paths.items()}
+            state["loaded_at"] = time.time()
+            if self.prepare is not None:
+                self.prepare(state)
+            # a file replaced while it was read may have been loaded old
+            # or new, keep the stamps from before so the next check
+            # reloads it
+            after = self._file_stamps()
+            self._state = state
+            self._stamps = after if after == before else before
+            self.loads += 1
+            self.error = None
+            self._next_check = time.monotonic() + self.check_interval
+            logging.info(
+                'SUCCESS: Artifacts %s loaded in %.3fs',
+                state["versions"], time.perf_counter() - start)
+            return state
+
+    @property
+    def ready(self):
+        """ True once the artifacts are loaded. """
+        return self._state is not None
+
+    @property
+    def versions(self):
+        """ Versions of the loaded artifacts, None before the first load. """
+        state = self._state
+        return None if state is None else state["versions"]
+
+    def get(self):
+        """ The loaded artifacts, loading or reloading them if needed.
+
+        Returns
+        -------
+        state : dict
+            model, encoder, lb, versions and loaded_at.
+        """
+        state = self._state
+        if state is None:
+            return self.load()
+        if time.monotonic() < self._next_check:
+            return state
+        self._next_check = time.monotonic() + self.check_interval
+        try:
+            if self._file_stamps() != self._stamps:
+                return self.load()
+        except Exception as e:
+            # a half written file, keep serving the loaded artifacts
+            self.error = repr(e)
+            logging.info('ERROR: Artifacts not reloaded: %s', e)
+        return state
@@ -1,10 +1,13 @@
+import threading
 import numpy as np
+import pandas as pd
+from scipy import sparse as sp
 from sklearn.preprocessing import LabelBinarizer, OneHotEncoder
 
 
 def process_data(
     X, categorical_features=[],
-        label=None, training=True, encoder=None, lb=None
+        label=None, training=True, encoder=None, lb=None, sparse=False
 ):
     """ Process the data used in the \
         machine learning pipeline.
@@ -41,10 +44,13 @@ def process_data(
     lb : sklearn.preprocessing._label.LabelBinarizer
         Trained sklearn LabelBinarizer, only\
              used if training=False.
+    sparse : bool
+        Return X as a float32 CSR matrix instead of a dense array, with
+        the one hot columns never densified (default=False).
 
     Returns
     -------
-    X : np.array
+    X : np.array or scipy.sparse.csr_matrix
         Processed data.
     y : np.array
         Processed labels if labeled=True, otherwise\
@@ -69,7 +75,12 @@ def process_data(
     X_continuous = X.drop(*[categorical_features], axis=1)
 
     if training is True:
-        encoder = OneHotEncoder(sparse=False, handle_unknown="ignore")
+        try:
+            encoder = OneHotEncoder(
+                sparse_output=sparse, handle_unknown="ignore")
+        except TypeError:
+            # scikit-learn < 1.2
+            encoder = OneHotEncoder(sparse=sparse, handle_unknown="ignore")
         lb = LabelBinarizer()
         X_categorical = encoder.fit_transform(X_categorical)
         y = lb.fit_transform(y.values).ravel()
@@ -81,5 +92,108 @@ def process_data(
         except AttributeError:
             pass
 
-    X = np.concatenate([X_continuous, X_categorical], axis=1)
+    # the encoder may have been fitted in the other mode
+    if sparse:
+        X = sp.hstack([sp.csr_matrix(X_continuous.values),
+                       sp.csr_matrix(X_categorical)],
+                      format="csr", dtype=np.float32)
+    else:
+        if sp.issparse(X_categorical):
+            X_categorical = X_categorical.toarray()
+        X = np.concatenate([X_continuous, X_categorical], axis=1)
     return X, y, encoder, lb
+
+
+class CompiledEncoder:
+    """ Inference-time encoder compiled from a fitted OneHotEncoder.
+
+    Each categorical value maps to its output column through a
+    dictionary, and a row is written into a preallocated float32 buffer:
+    the continuous values first, then a 1 in the column of each known
+    category. Unknown categories leave their columns at 0, like
+    handle_unknown="ignore". The output equals process_data with the same
+    encoder.
+
+    Inputs
+    ------
+    encoder : sklearn.preprocessing._encoders.OneHotEncoder
+        Trained OneHotEncoder, without drop or infrequent categories.
+    categorical_features: list[str]
+        The categorical features, in the order the encoder was fitted on.
+    continuous_features: list[str]
+        The other features, in the order of the data frame.
+    """
+
+    def __init__(self, encoder, categorical_features, continuous_features):
+        infrequent = getattr(encoder, "infrequent_categories_", None) or []
+        if getattr(encoder, "drop_idx_", None) is not None or any(
+                cats is not None for cats in infrequent):
+            raise ValueError(
+                "drop and infrequent categories are not supported")
+        self.categorical_features = list(categorical_features)
+        self.continuous_features = list(continuous_features)
+        self.categories = [list(cats) for cats in encoder.categories_]
+        offset = len(self.continuous_features)
+        self.offsets = []
+        self.lookups = []
+        for cats in self.categories:
+            self.offsets.append(offset)
+            self.lookups.append(
+                {value: offset + index for index, value in enumerate(cats)})
+            offset += len(cats)
+        self.n_features = offset
+        self._indexes = [pd.Index(cats) for cats in self.categories]
+        self._local = threading.local()
+
+    def transform_row(self, continuous, categorical):
+        """ Encode one row.
+
+        Inputs
+        ------
+        continuous : sequence
+            Values of the continuous features, in their order.
+        categorical : sequence
+            Values of the categorical features, in their order.
+        Returns
+        -------
+        X : np.array
+            (1, n_features) float32 view of this thread's buffer, valid
+            until the next call in the same thread.
+        """
+        buffer = getattr(self._local, "buffer", None)
+        if buffer is None:
+            buffer = self._local.buffer = np.zeros(
+                (1, self.n_features), dtype=np.float32)
+        row = buffer[0]
+        row.fill(0)
+        row[:len(continuous)] = continuous
+        for lookup, value in zip(self.lookups, categorical):
+            column = lookup.get(value)
+            if column is not None:
+                row[column] = 1
+        return buffer
+
+    def transform(self, X):
+        """ Encode the rows of a DataFrame with one vectorized pass per
+        feature.
+
+        Inputs
+        ------
+        X : pd.DataFrame
+            Dataframe with the continuous and categorical features.
+        Returns
+        -------
+        X : np.array
+            (n_rows, n_features) float32 array.
+        """
+        out = np.zeros((len(X), self.n_features), dtype=np.float32)
+        for index, name in enumerate(self.continuous_features):
+            out[:, index] = X[name].to_numpy()
+        rows = np.arange(len(X))
+        for name, index, offset in zip(self.categorical_features,
+                                       self._indexes, self.offsets):
+            # -1 for the unknown categories
+            codes = index.get_indexer(X[name])
+            known = codes >= 0
+            out[rows[known], offset + codes[known]] = 1
+        return out
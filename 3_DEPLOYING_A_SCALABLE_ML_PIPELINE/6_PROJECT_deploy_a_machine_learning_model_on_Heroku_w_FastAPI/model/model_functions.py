@@ -2,27 +2,44 @@ from sklearn.metrics import fbeta_score, precision_score, recall_score
 import logging
 from sklearn.ensemble import RandomForestClassifier
 from imblearn.over_sampling import SMOTE
+from scipy import sparse as sp
+try:
+    from .neighbors import DistinctNeighbors
+except ImportError:
+    # run as a script from model/, like train_model.py
+    from neighbors import DistinctNeighbors
 
 
 # Optional: implement hyperparameter tuning.
-def train_model(X_train, y_train):
+def train_model(X_train, y_train, n_estimators=100):
     """
     Trains a machine learning model and returns it.
 
+    A sparse X_train (process_data(..., sparse=True)) stays sparse through
+    SMOTE and the forest fit. SMOTE then searches the neighbors among the
+    distinct rows, as the sparse pairwise distances over all the rows are
+    much slower than the dense ones.
+
     Inputs
     ------
-    X_train : np.array
+    X_train : np.array or scipy.sparse.csr_matrix
         Training data.
     y_train : np.array
         Labels.
+    n_estimators : int
+        Number of trees of the forest.
     Returns
     -------
     model
         Trained machine learning model.
     """
     try:
-        model = RandomForestClassifier()
-        smote = SMOTE(random_state=0)
+        model = RandomForestClassifier(n_estimators=n_estimators)
+        if sp.issparse(X_train):
+            smote = SMOTE(random_state=0,
+                          k_neighbors=DistinctNeighbors(n_neighbors=6))
+        else:
+            smote = SMOTE(random_state=0)
         X_train, y_train = smote.fit_resample(X_train, y_train)
         model.fit(X_train, y_train)
         logging.info('SUCCESS!:Model trained and saved')
@@ -0,0 +1,103 @@
+"""
+Nearest neighbors over the distinct rows, for SMOTE on one hot census data
+"""
+import numpy as np
+import pandas as pd
+from scipy import sparse as sp
+from sklearn import config_context
+from sklearn.neighbors import NearestNeighbors
+
+# MB of pairwise distances computed at once, sklearn's default is 1024
+WORKING_MEMORY = 64
+
+
+def sorted_csr(X):
+    """ X as a CSR matrix with sorted indices, without changing X. """
+    if not sp.issparse(X):
+        return X
+    X = sp.csr_matrix(X)
+    if not X.has_sorted_indices:
+        X = X.copy()
+        X.sort_indices()
+    return X
+
+
+def row_codes(X):
+    """ Code of each row of X, equal for identical rows.
+
+    Inputs
+    ------
+    X : np.array or scipy.sparse.csr_matrix
+        Data, a CSR matrix with sorted indices.
+    Returns
+    -------
+    codes : np.array
+        Row code, in order of first appearance.
+    first : np.array
+        Index of the first row of each code.
+    """
+    if sp.issparse(X):
+        indptr, indices, data = X.indptr, X.indices, X.data
+        keys = [indices[start:end].tobytes() + data[start:end].tobytes()
+                for start, end in zip(indptr[:-1], indptr[1:])]
+    else:
+        keys = [row.tobytes() for row in np.ascontiguousarray(X)]
+    codes, _ = pd.factorize(pd.Series(keys, dtype=object))
+    first = np.full(codes.max() + 1, len(codes), dtype=np.int64)
+    np.minimum.at(first, codes, np.arange(len(codes)))
+    return codes, first
+
+
+class DistinctNeighbors(NearestNeighbors):
+    """ NearestNeighbors searching the distinct rows only.
+
+    The census rows repeat a lot (and replicated data only repeats), so
+    the neighbors are searched among the distinct rows and each one is
+    expanded into its copies, closest first. The result equals a search
+    over all the rows up to the order of tied neighbors, which SMOTE does
+    not depend on, and the pairwise distances cost distinct rows² instead
+    of rows². Pass it to SMOTE as `k_neighbors` with n_neighbors=k + 1.
+    """
+
+    def fit(self, X, y=None):
+        X = sorted_csr(X)
+        codes, first = row_codes(X)
+        super().fit(X[first])
+        # the rows of each distinct row, grouped by code
+        self.rows_ = np.argsort(codes, kind="stable")
+        self.counts_ = np.bincount(codes)
+        self.starts_ = np.cumsum(self.counts_) - self.counts_
+        self.n_rows_ = len(codes)
+        return self
+
+    def kneighbors(self, X=None, n_neighbors=None, return_distance=True):
+        if X is None:
+            raise ValueError("DistinctNeighbors needs the query rows")
+        n_neighbors = n_neighbors or self.n_neighbors
+        if n_neighbors > self.n_rows_:
+            raise ValueError(
+                "Expected n_neighbors <= n_samples_fit, but n_neighbors = "
+                "%d, n_samples_fit = %d" % (n_neighbors, self.n_rows_))
+        X = sorted_csr(X)
+        codes, first = row_codes(X)
+        # each distinct row has at least one copy, so n_neighbors distinct
+        # neighbors always hold n_neighbors rows
+        with config_context(working_memory=WORKING_MEMORY):
+            distances, distinct = super().kneighbors(
+                X[first], n_neighbors=min(n_neighbors, len(self.counts_)))
+
+        counts = self.counts_[distinct]
+        ends = np.cumsum(counts, axis=1)
+        queries = np.arange(len(distinct))
+        indices = np.empty((len(distinct), n_neighbors), dtype=np.int64)
+        dist = np.empty((len(distinct), n_neighbors))
+        for position in range(n_neighbors):
+            rank = (ends <= position).sum(axis=1)
+            offset = position - (ends[queries, rank] - counts[queries, rank])
+            neighbor = distinct[queries, rank]
+            indices[:, position] = self.rows_[
+                self.starts_[neighbor] + offset]
+            dist[:, position] = distances[queries, rank]
+        if return_distance:
+            return dist[codes], indices[codes]
+        return indices[codes]
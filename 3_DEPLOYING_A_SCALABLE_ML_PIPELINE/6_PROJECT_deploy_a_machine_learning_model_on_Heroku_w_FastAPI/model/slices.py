@@ -0,0 +1,99 @@
+"""
+Model performance on the slices of the categorical features
+
+The test set is encoded and predicted once. The true positives, false
+positives and false negatives of every (feature, value) slice are then
+counted together, with one np.bincount per count over the slice codes of
+all the features.
+"""
+import json
+import logging
+import numpy as np
+import pandas as pd
+
+
+def slice_counts(df, features, y, preds):
+    """ Confusion counts of every (feature, value) slice.
+
+    Inputs
+    ------
+    df : pd.DataFrame
+        Data with the `features` columns.
+    features : list[str]
+        Features to slice on.
+    y : np.array
+        Known labels, binarized.
+    preds : np.array
+        Predicted labels, binarized.
+    Returns
+    -------
+    slices : pd.DataFrame
+        feature, value, n, tp, fp and fn of each slice, the features in
+        their order and the values in order of first appearance.
+    """
+    y = np.asarray(y).astype(bool)
+    preds = np.asarray(preds).astype(bool)
+    codes = []
+    keys = []
+    for feature in features:
+        feature_codes, values = pd.factorize(
+            df[feature], use_na_sentinel=False)
+        codes.append(feature_codes + len(keys))
+        keys.extend((feature, value) for value in values)
+    # the slices of a row, feature after feature
+    codes = np.concatenate(codes)
+    y = np.tile(y, len(features))
+    preds = np.tile(preds, len(features))
+    size = len(keys)
+    slices = pd.DataFrame(keys, columns=["feature", "value"])
+    slices["n"] = np.bincount(codes, minlength=size)
+    slices["tp"] = np.bincount(codes, weights=y & preds, minlength=size)
+    slices["fp"] = np.bincount(codes, weights=~y & preds, minlength=size)
+    slices["fn"] = np.bincount(codes, weights=y & ~preds, minlength=size)
+    slices[["tp", "fp", "fn"]] = slices[["tp", "fp", "fn"]].astype(int)
+    return slices
+
+
+def slice_metrics(slices, beta=1):
+    """ Precision, recall and F-beta of each slice, as
+    compute_model_metrics computes them (1 when undefined).
+
+    Inputs
+    ------
+    slices : pd.DataFrame
+        Output of slice_counts.
+    beta : float
+        Weight of the recall in the F-beta score.
+    Returns
+    -------
+    slices : pd.DataFrame
+        The slices with precision, recall and fbeta columns.
+    """
+    slices = slices.copy()
+    tp, fp, fn = (slices[name].to_numpy(dtype=float)
+                  for name in ["tp", "fp", "fn"])
+    beta2 = beta ** 2
+    with np.errstate(divide="ignore", invalid="ignore"):
+        slices["precision"] = np.where(tp + fp > 0, tp / (tp + fp), 1.0)
+        slices["recall"] = np.where(tp + fn > 0, tp / (tp + fn), 1.0)
+        denominator = (1 + beta2) * tp + beta2 * fn + fp
+        slices["fbeta"] = np.where(
+            denominator > 0, (1 + beta2) * tp / denominator, 1.0)
+    return slices
+
+
+def write_slices(slices, txt_path="slice_model_output.txt",
+                 json_path="slice_model_output.json"):
+    """ Write the slice metrics as text lines and as JSON records. """
+    try:
+        with open(txt_path, "w") as out:
+            for row in slices.itertuples(index=False):
+                out.write("[%s->%s] Precision: %s Recall: %s FBeta: %s\n" % (
+                    row.feature, row.value, row.precision, row.recall,
+                    row.fbeta))
+        with open(json_path, "w") as out:
+            json.dump(slices.to_dict("records"), out, indent=2,
+                      default=lambda value: value.item())
+        logging.info('SUCCESS: Slice metrics written')
+    except BaseException:
+        logging.info('ERROR: Slice metrics not written')
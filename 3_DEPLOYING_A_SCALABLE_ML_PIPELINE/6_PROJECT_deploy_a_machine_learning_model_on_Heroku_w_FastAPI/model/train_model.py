@@ -1,11 +1,13 @@
 # Script to train machine learning model.
 
+import argparse
 from sklearn.model_selection import train_test_split
 import logging
 from data import process_data
 from clean_data import load_data, cleaned_data
 from model_functions import train_model, \
     compute_model_metrics, model_predictions
+from slices import slice_counts, slice_metrics, write_slices
 from joblib import dump
 
 logging.basicConfig(
@@ -35,49 +37,38 @@ cat_features = [
 ]
 
 
-def model_slicing(data):
+def model_slicing(test, y_test, predictions):
     """
-    Slice model for categorical features
+    Slice model for categorical features, from the predictions of the
+    whole test set
     """
-    slice_values = []
-
-    for cat in cat_features:
-        for cls in test[cat].unique():
-            df_temp = test[test[cat] == cls]
-            X_test_temp, y_test_temp, _, _ = process_data(
-                df_temp, categorical_features=cat_features,
-                label="salary", encoder=encoder, lb=lb, training=False)
-            y_preds = model.predict(X_test_temp)
-            precision_temp, recall_temp, fbeta_temp = compute_model_metrics(
-                y_test_temp, y_preds)
-            results = "[%s->%s] Precision: %s " \
-                "Recall: %s FBeta: %s" % (
-                    cat,
-                    cls,
-                    precision_temp,
-                    recall_temp,
-                    fbeta_temp)
-            slice_values.append(results)
-
-    with open('slice_model_output.txt', 'w') as out:
-        for slice_value in slice_values:
-            out.write(slice_value + '\n')
+    slices = slice_metrics(
+        slice_counts(test, cat_features, y_test, predictions))
+    write_slices(slices)
+    return slices
 
 
 if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Train the census model")
+    parser.add_argument(
+        "--sparse", action="store_true",
+        help="keep the one hot features sparse through SMOTE and the fit, "
+             "for data too large to densify")
+    args = parser.parse_args()
     df = load_data('./model/census_cleaned.csv')
     train, test = split_data(df)
     test.to_csv('testings.csv')
     X_train, y_train, encoder, lb = process_data(
         train, categorical_features=cat_features,
-        label="salary", training=True)
+        label="salary", training=True, sparse=args.sparse)
     X_test, y_test, encoder_t, lb_t = process_data(
         test, categorical_features=cat_features,
-        label="salary", training=False, encoder=encoder, lb=lb)
+        label="salary", training=False, encoder=encoder, lb=lb,
+        sparse=args.sparse)
     dump(encoder_t, 'encoder.joblib')
     dump(lb_t, 'lb.joblib')
     model = train_model(X_train, y_train)
     dump(model, 'model.joblib')
     predictions = model_predictions(X_test, model)
     precision, recall, fbeta = compute_model_metrics(y_test, predictions)
-    model_slicing(df)
+    model_slicing(test, y_test, predictions)
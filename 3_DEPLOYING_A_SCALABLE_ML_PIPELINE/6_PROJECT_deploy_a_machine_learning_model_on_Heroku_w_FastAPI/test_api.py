@@ -1,6 +1,7 @@
 """
 Api servermodule test
 """
+import json
 import pytest
 from fastapi.testclient import TestClient
 from main import app
@@ -26,6 +27,18 @@ def test_get_malformed(client):
     assert r.status_code != 200
 
 
+def test_health(client):
+    r = client.get("/health")
+    assert r.status_code == 200
+    assert r.json()["status"] == "ok"
+
+
+def test_ready(client):
+    r = client.get("/ready")
+    assert r.status_code == 200
+    assert set(r.json()["versions"]) == {"model", "encoder", "lb"}
+
+
 def test_post_above(client):
     r = client.post("/", json={
         "age": 60,
@@ -74,3 +87,36 @@ def test_post_malformed(client):
         "nativeCountry": "United-States"
     })
     assert r.status_code != 200
+
+
+USER = {
+    "age": 60,
+    "workclass": "Private",
+    "education": "Doctorate",
+    "maritalStatus": "Divorced",
+    "occupation": "Transport-moving",
+    "relationship": "Not-in-family",
+    "race": "White",
+    "sex": "Male",
+    "hoursPerWeek": 76,
+    "nativeCountry": "United-States"
+}
+
+
+def test_batch(client):
+    r = client.post("/batch", json=[USER] * 3)
+    assert r.status_code == 200
+    assert r.json() == {"predictions": ["<=50K"] * 3}
+
+
+def test_batch_ndjson(client):
+    body = "\n".join(json.dumps(USER) for _ in range(3)) + "\n"
+    r = client.post("/batch", data=body,
+                    headers={"content-type": "application/x-ndjson"})
+    assert r.status_code == 200
+    assert r.json() == {"predictions": ["<=50K"] * 3}
+
+
+def test_batch_malformed(client):
+    r = client.post("/batch", json=[USER, dict(USER, sex="ERROR")])
+    assert r.status_code == 422
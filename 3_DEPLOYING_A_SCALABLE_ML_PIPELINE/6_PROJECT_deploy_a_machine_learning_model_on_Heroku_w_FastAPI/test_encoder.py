@@ -0,0 +1,69 @@
+"""
+Compiled encoder test against process_data
+"""
+import numpy as np
+from scipy import sparse as sp
+import pandas as pd
+import pytest
+from sklearn.model_selection import train_test_split
+
+from main import cat_features, CONTINUOUS_FEATURES
+from model.data import process_data, CompiledEncoder
+
+
+@pytest.fixture(scope="module")
+def split():
+    """
+    Census data split as in model/train_model.py, with a fitted encoder
+    """
+    df = pd.read_csv("data/census_cleaned.csv", index_col=[0])
+    train, test = train_test_split(df, test_size=0.20, random_state=0)
+    _, _, encoder, lb = process_data(
+        train, categorical_features=cat_features, label="salary",
+        training=True)
+    X_test, _, _, _ = process_data(
+        test, categorical_features=cat_features, label="salary",
+        training=False, encoder=encoder, lb=lb)
+    compiled = CompiledEncoder(encoder, cat_features, CONTINUOUS_FEATURES)
+    return test, X_test, compiled, encoder
+
+
+def test_transform(split):
+    test, X_test, compiled, _ = split
+    assert np.array_equal(compiled.transform(test), X_test)
+
+
+def test_transform_row(split):
+    test, X_test, compiled, _ = split
+    for row, expected in zip(test.to_dict("records"), X_test):
+        X = compiled.transform_row(
+            [row[name] for name in CONTINUOUS_FEATURES],
+            [row[name] for name in cat_features])
+        assert np.array_equal(X[0], expected)
+
+
+def test_unknown_category(split):
+    test, _, compiled, encoder = split
+    rows = test.iloc[:5].drop(columns=["salary"])
+    rows["workclass"] = "unknown"
+    X, _, _, _ = process_data(
+        rows, categorical_features=cat_features, training=False,
+        encoder=encoder)
+    assert np.array_equal(compiled.transform(rows), X)
+
+
+def test_sparse_process_data(split):
+    test, X_test, _, encoder = split
+    X, _, _, _ = process_data(
+        test, categorical_features=cat_features, label="salary",
+        training=False, encoder=encoder, sparse=True)
+    assert sp.isspmatrix_csr(X)
+    assert np.array_equal(X.toarray(), X_test)
+
+    X, _, sparse_encoder, _ = process_data(
+        test, categorical_features=cat_features, label="salary",
+        training=True, sparse=True)
+    X_dense, _, _, _ = process_data(
+        test, categorical_features=cat_features, label="salary",
+        training=False, encoder=sparse_encoder, lb=None)
+    assert np.array_equal(X.toarray(), X_dense)
@@ -0,0 +1,41 @@
+"""
+Distinct rows neighbors test against a search over all the rows
+"""
+import numpy as np
+import pandas as pd
+import pytest
+from scipy import sparse as sp
+from sklearn.neighbors import NearestNeighbors
+
+from main import cat_features
+from model.data import process_data
+from model.neighbors import DistinctNeighbors
+
+
+@pytest.fixture(scope="module")
+def X():
+    """
+    Sparse encoded census rows, the first 300 repeated as in the
+    replicated data
+    """
+    df = pd.read_csv("data/census_cleaned.csv", index_col=[0])[:500]
+    X, _, _, _ = process_data(
+        df, categorical_features=cat_features, label="salary",
+        training=True, sparse=True)
+    return sp.vstack([X, X[:300]], format="csr")
+
+
+def test_distinct_neighbors(X):
+    distances, indices = DistinctNeighbors(n_neighbors=6).fit(X) \
+        .kneighbors(X)
+    expected, _ = NearestNeighbors(n_neighbors=6).fit(X.toarray()) \
+        .kneighbors(X.toarray())
+    assert np.allclose(distances, expected, atol=1e-4)
+    found = np.linalg.norm(
+        X.toarray()[:, None, :] - X.toarray()[indices], axis=2)
+    assert np.allclose(found, distances, atol=1e-4)
+
+
+def test_too_many_neighbors(X):
+    with pytest.raises(ValueError):
+        DistinctNeighbors(n_neighbors=6).fit(X[:3]).kneighbors(X[:3])
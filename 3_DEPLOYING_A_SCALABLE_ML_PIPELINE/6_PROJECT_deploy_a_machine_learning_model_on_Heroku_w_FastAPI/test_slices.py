@@ -0,0 +1,49 @@
+"""
+Slice metrics test against compute_model_metrics on each slice
+"""
+import json
+import numpy as np
+import pandas as pd
+import pytest
+
+from main import cat_features
+from model.model_functions import compute_model_metrics
+from model.slices import slice_counts, slice_metrics, write_slices
+
+
+@pytest.fixture(scope="module")
+def data():
+    """
+    Census data with random labels and predictions
+    """
+    df = pd.read_csv("data/census_cleaned.csv", index_col=[0])[:5000]
+    rng = np.random.default_rng(0)
+    y = rng.integers(0, 2, len(df))
+    preds = rng.integers(0, 2, len(df))
+    # a slice without positives, where the metrics are undefined
+    df.loc[df.index[:3], "workclass"] = "none"
+    y[:3] = preds[:3] = 0
+    return df, y, preds
+
+
+def test_slice_metrics(data):
+    df, y, preds = data
+    slices = slice_metrics(slice_counts(df, cat_features, y, preds))
+    assert len(slices) == sum(df[name].nunique() for name in cat_features)
+    for row in slices.itertuples(index=False):
+        mask = (df[row.feature] == row.value).to_numpy()
+        assert row.n == mask.sum()
+        expected = compute_model_metrics(y[mask], preds[mask])
+        assert np.allclose(
+            [row.precision, row.recall, row.fbeta], expected)
+
+
+def test_write_slices(data, tmp_path):
+    df, y, preds = data
+    slices = slice_metrics(slice_counts(df, cat_features, y, preds))
+    write_slices(slices, tmp_path / "slices.txt", tmp_path / "slices.json")
+    lines = (tmp_path / "slices.txt").read_text().splitlines()
+    records = json.loads((tmp_path / "slices.json").read_text())
+    assert len(lines) == len(records) == len(slices)
+    assert lines[0].startswith("[workclass->")
+    assert records[0]["feature"] == "workclass"
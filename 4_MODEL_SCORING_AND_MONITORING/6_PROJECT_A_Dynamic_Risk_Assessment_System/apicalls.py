@@ -3,8 +3,42 @@ Script to call the API endpoints of the model and store the responses
 """
 import os
 import json
+import time
 import requests
 
+# seconds to wait for the diagnostics job started through the API
+DIAGNOSTICS_TIMEOUT = 600
+
+
+def get_diagnostics(url: str, timeout: float = DIAGNOSTICS_TIMEOUT) -> dict:
+    """
+    Start or join the diagnostics job of the API and poll it until done
+
+    Parameters
+    ---
+    url: str
+        Base url of the API
+    timeout: float
+        Seconds to wait for the result
+
+    Returns
+    ---
+    dict
+        The diagnostics result
+    """
+    job = requests.post(url + "diagnostics", timeout=10).json()
+    deadline = time.monotonic() + timeout
+    while job['status'] in ('queued', 'running'):
+        if time.monotonic() > deadline:
+            raise TimeoutError(f"Diagnostics job {job['id']} not done")
+        time.sleep(1)
+        job = requests.get(url + "diagnostics/" + job['id'],
+                           timeout=10).json()
+    if job['status'] != 'done':
+        raise RuntimeError(
+            f"Diagnostics job {job['id']} failed: {job.get('error')}")
+    return job['result']
+
 
 def get_data(output_folder_path: str, url: str) -> None:
     """
@@ -25,7 +59,7 @@ def get_data(output_folder_path: str, url: str) -> None:
         timeout=10).json()
     response2 = requests.get(url + "scoring", timeout=10).content.decode()
     response3 = requests.get(url + "summarystats", timeout=10).json()
-    response4 = requests.get(url + "diagnostics", timeout=10).json()
+    response4 = get_diagnostics(url)
 
     apicalls = {'prediction': response1, 'F1_score': response2,
                 'data_summary': response3, 'diagnostics': response4}
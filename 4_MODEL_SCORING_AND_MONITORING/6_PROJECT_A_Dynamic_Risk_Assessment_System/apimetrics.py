@@ -0,0 +1,236 @@
+"""
+Request metrics of the Flask API in the Prometheus text format
+
+Every thread records into its own shard of counters, so the hot path is a
+few list increments without any lock: only the thread that owns a shard
+writes to it and the GIL keeps each increment consistent. The shards of
+finished threads (the threaded werkzeug server starts one per request) are
+folded into a single retired shard, so memory and the cost of a scrape
+follow the live threads. A scrape of /metrics sums the shards, which may
+miss requests finishing during the scrape, the usual trade-off of
+Prometheus counters.
+
+Metrics are per process. Under gunicorn each scrape is answered by one
+worker, so scrape the workers individually or run one worker per target.
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import time
+import bisect
+import threading
+from flask import Flask, g, request
+
+LATENCY_BUCKETS = [0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0,
+                   10.0]
+SIZE_BUCKETS = [100, 1_000, 10_000, 100_000, 1_000_000, 10_000_000]
+
+HISTOGRAMS = {
+    'api_request_duration_seconds': (
+        'Latency of the API requests', LATENCY_BUCKETS),
+    'api_request_size_bytes': (
+        'Size of the request bodies', SIZE_BUCKETS),
+    'api_response_size_bytes': (
+        'Size of the response bodies', SIZE_BUCKETS),
+}
+COUNTERS = {
+    'api_requests_total': 'Number of finished API requests',
+}
+GAUGES = {
+    'api_requests_in_flight': 'Number of API requests being processed',
+}
+
+
+class Metrics:
+    """
+    Counters, gauges and histograms sharded per thread
+    """
+
+    def __init__(self):
+        self._local = threading.local()
+        # (owning thread, shard) pairs
+        self._shards = []
+        self._retired = {}
+        self._shards_lock = threading.Lock()
+
+    def _shard(self) -> dict:
+        shard = getattr(self._local, 'shard', None)
+        if shard is None:
+            shard = self._local.shard = {}
+            # taken once per thread, not per request
+            with self._shards_lock:
+                self._fold_finished()
+                self._shards.append((threading.current_thread(), shard))
+        return shard
+
+    def _fold_finished(self) -> None:
+        """
+        Merge the shards of finished threads into the retired shard, with
+        the shards lock held. A finished thread no longer writes to its
+        shard.
+        """
+        live = []
+        for thread, shard in self._shards:
+            if thread.is_alive():
+                live.append((thread, shard))
+            else:
+                add_shard(self._retired, shard)
+        self._shards = live
+
+    def inc(self, name: str, labels: tuple, value: float = 1) -> None:
+        """
+        Add `value` to a counter or gauge. labels is a tuple of
+        (label, value) pairs.
+        """
+        shard = self._shard()
+        key = (name, labels)
+        shard[key] = shard.get(key, 0) + value
+
+    def observe(self, name: str, labels: tuple, value: float) -> None:
+        """
+        Record one observation in a histogram
+        """
+        shard = self._shard()
+        key = (name, labels)
+        state = shard.get(key)
+        if state is None:
+            # one count per bucket plus +Inf, then the sum
+            state = shard[key] = [0] * (len(HISTOGRAMS[name][1]) + 2)
+        state[bisect.bisect_left(HISTOGRAMS[name][1], value)] += 1
+        state[-1] += value
+
+    def collect(self) -> dict:
+        """
+        Sum of all shards
+
+        Returns
+        ---
+        dict
+            (name, labels) to a value, or to a list of bucket counts and the
+            sum for histograms
+        """
+        totals = {}
+        with self._shards_lock:
+            self._fold_finished()
+            shards = [shard for _, shard in self._shards]
+            add_shard(totals, self._retired)
+        for shard in shards:
+            add_shard(totals, shard)
+        return totals
+
+    def render(self, gauges: dict = None) -> str:
+        """
+        All metrics in the Prometheus text exposition format
+
+        Parameters
+        ---
+        gauges: dict
+            Extra unlabelled gauges as name to (help, value), ie. the model
+            load time
+
+        Returns
+        ---
+        str
+            The body of a /metrics response
+        """
+        totals = self.collect()
+        lines = []
+        for name, (help_text, buckets) in HISTOGRAMS.items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} histogram']
+            for (metric, labels), state in sorted(totals.items()):
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, count in zip(buckets + ['+Inf'], state[:-1]):
+                    cumulative += count
+                    lines.append(f'{name}_bucket'
+                                 f'{format_labels(labels + (("le", bound),))}'
+                                 f' {cumulative}')
+                lines.append(f'{name}_sum{format_labels(labels)} {state[-1]}')
+                lines.append(f'{name}_count{format_labels(labels)} '
+                             f'{cumulative}')
+        for kind, metrics in [('counter', COUNTERS), ('gauge', GAUGES)]:
+            for name, help_text in metrics.items():
+                lines += [f'# HELP {name} {help_text}',
+                          f'# TYPE {name} {kind}']
+                for (metric, labels), value in sorted(totals.items()):
+                    if metric == name:
+                        lines.append(f'{name}{format_labels(labels)} {value}')
+        for name, (help_text, value) in (gauges or {}).items():
+            lines += [f'# HELP {name} {help_text}', f'# TYPE {name} gauge',
+                      f'{name} {value}']
+        return '\n'.join(lines) + '\n'
+
+
+def add_shard(totals: dict, shard: dict) -> None:
+    """
+    Add the values of a shard to `totals` in place
+    """
+    # copy first, the owning thread may add keys while we iterate
+    for key, value in list(shard.items()):
+        if isinstance(value, list):
+            total = totals.setdefault(key, [0] * len(value))
+            for i, item in enumerate(value):
+                total[i] += item
+        else:
+            totals[key] = totals.get(key, 0) + value
+
+
+def format_labels(labels: tuple) -> str:
+    """
+    Format (label, value) pairs as {label="value",...}
+    """
+    if not labels:
+        return ''
+    return '{' + ','.join(
+        '{}="{}"'.format(key, str(value).replace('\\', '\\\\')
+                         .replace('"', '\\"').replace('\n', '\\n'))
+        for key, value in labels) + '}'
+
+
+def install(server: Flask, metrics: Metrics) -> None:
+    """
+    Record latency, in-flight requests and payload sizes of every request
+    served by the Flask server
+
+    Parameters
+    ---
+    server: Flask
+        The Flask app, ie. app.server of the Dash app
+    metrics: Metrics
+        Where the requests are recorded
+    """
+
+    @server.before_request
+    def start_request():
+        # the route pattern, not the path, keeps the label cardinality low
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        g.metrics_route = route
+        g.metrics_start = time.perf_counter()
+        metrics.inc('api_requests_in_flight', (('route', route),))
+
+    @server.after_request
+    def record_response(response):
+        g.metrics_status = response.status_code
+        # None for streamed responses, their size is unknown
+        g.metrics_response_size = response.content_length
+        return response
+
+    @server.teardown_request
+    def finish_request(exception=None):
+        route = g.pop('metrics_route', None)
+        if route is None:
+            return
+        seconds = time.perf_counter() - g.pop('metrics_start')
+        status = g.pop('metrics_status', 500)
+        labels = (('route', route),)
+        metrics.inc('api_requests_in_flight', labels, -1)
+        metrics.inc('api_requests_total',
+                    labels + (('method', request.method),
+                              ('status', status)))
+        metrics.observe('api_request_duration_seconds', labels, seconds)
+        metrics.observe('api_request_size_bytes', labels,
+                        request.content_length or 0)
+        response_size = g.pop('metrics_response_size', None)
+        if response_size is not None:
+            metrics.observe('api_response_size_bytes', labels, response_size)
@@ -4,75 +4,40 @@ Script to run the Flask app
 Author: Derrick Lewis
 Date: 2023-01-29
 """
+import io
 import json
 import os
 import pandas as pd
-from dash import Dash, html, dcc, dash_table
+from dash import Dash, html, dcc, dash_table, Input, Output, State, no_update
 import dash_bootstrap_components as dbc
-from flask import request
-import plotly.io as pio
-import pandas as pd
-from diagnostics import model_predictions, dataframe_summary
+from flask import request, Response, jsonify, abort
+from diagnostics import model_predictions
 from diagnostics import execution_time, missing_data, outdated_packages_list
+from dashboard_data import DashboardData
+from serving import ModelStore, PredictionCache
+from shadow import ShadowScorer
+from apimetrics import Metrics, install
+from diagnostics_jobs import DiagnosticsJobs
+from deployment import current_version
 import logging
 
-api_log = logging.basicConfig(
+logging.basicConfig(
     filename=os.path.join(os.getcwd() + "/logs/api.log"),
     level=logging.INFO,
     filemode='a',
     datefmt='%Y-%m-%d %H:%M:%S',
     format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
 )
+api_log = logging.getLogger(__name__)
 
 external_stylesheets = [dbc.themes.BOOTSTRAP]
 CELL_PADDING = 5
 DATA_PADDING = 5
 TABLE_PADDING = 1
 FONTSIZE = 12
-
-# ---------------------------------------------------------------------
-# read in the data from the json file
-try:
-    with open(f'models/apireturns.json', 'r') as outfile:
-        data_check = json.load(outfile)
-    dff = pd.DataFrame(data_check['data_summary'])
-except FileNotFoundError:
-    api_log.warning('No json diagnostics file found')
-    dff = pd.DataFrame()
-    data_check = {
-        'F1_score': {},
-        'diagnostics': {
-            'timings':{'ingestion_time': {},
-                       'training_time': {}
-            }
-        }
-    }
-# ---------------------------------------------------------------------
-# convert pip outdated stdout into a dataframe 
-try:
-    outdated = data_check['diagnostics']['outdated_pckgs']
-
-    column_widths = [len(dashes) for dashes in outdated.split("\n")[1].split()]
-    column_names = outdated.split("\n")[0].split()
-    data = {key: list() for key in column_names}
-    for line in outdated.split("\n")[2:]:
-        start = 0
-        end = 0
-        for column_name, column_width in zip(column_names, column_widths):
-            end += column_width + 1
-            data[column_name].append(line[start:end])
-            start = end
-        
-    outdated = pd.DataFrame(data)
-except KeyError:
-    outdated = pd.DataFrame()
-    api_log.warning('No json diagnostics for outdated PIP packages found')
-# ---------------------------------------------------------------------
-# Read in the confusion matrix and AUC plotly figures from json files
-with open(f'models/confusionmatrix.json', 'r') as outfile:
-    cm = pio.from_json(json.load(outfile))
-with open(f'models/auc.json', 'r') as outfile:
-    auc = pio.from_json(json.load(outfile))
+PAGE_SIZE = 10
+# how often the browser asks whether a new model or report was deployed
+REFRESH_INTERVAL_MS = 30 * 1000
 
 app = Dash(
     url_base_pathname="/dashboard/",
@@ -90,8 +55,31 @@ with open('config.json', 'r', encoding='utf8') as f:
 
 dataset_csv_path = os.path.join(config['output_folder_path'])
 model_path = os.path.join(config['prod_deployment_path'])
+output_model_path = os.path.join(config['output_model_path'])
+
+# ---------------------------------------------------------------------
+# Server-side cache of the API returns and the confusion matrix and AUC
+# figures, reloaded when the deployed model or the reports change
+dashboard_data = DashboardData(output_model_path, model_path)
+
+# Deployed model, latest score and data profile, preloaded in the gunicorn
+# master (see gunicorn.conf.py) or loaded on the first request
+model_store = ModelStore(model_path, dataset_csv_path)
 
-prediction_model = None
+# /prediction responses per input file content and model version
+prediction_cache = PredictionCache()
+
+# Candidate model scoring a sample of the predicted requests in the
+# background, off for a sample rate of 0
+shadow_scorer = ShadowScorer(
+    config.get('shadow_model_path',
+               os.path.join(output_model_path, 'trainedmodel.pkl')),
+    float(config.get('shadow_sample_rate', 0.0)))
+
+# Latency, in-flight and payload size metrics of every request, exposed in
+# the Prometheus text format at /metrics
+request_metrics = Metrics()
+install(server, request_metrics)
 
 
 @server.route("/prediction", methods=['GET', 'OPTIONS'])
@@ -101,18 +89,36 @@ def predict() -> str:
     under 'output_folder_path'
     """
     filepath = request.args.get('filepath')
-    dff = pd.read_csv(filepath)
-    preds = model_predictions(dff, model_path)
-    return str(list(preds))
+    state = model_store.get()
+    # a request sampled for the shadow candidate is predicted, not served
+    # from the cache, so that repeated inputs are shadow scored too
+    shadowed = shadow_scorer.sample()
+    response = None if shadowed else prediction_cache.get(
+        filepath, state['version'])
+    if response is None:
+        # parse the bytes that were hashed so the key matches the content
+        digest, data = prediction_cache.read(filepath)
+        dff = pd.read_csv(io.BytesIO(data))
+        preds = model_predictions(dff, model_path, state['model'])
+        if shadowed:
+            shadow_scorer.submit(dff, preds)
+        response = str(list(preds))
+        prediction_cache.put(digest, state['version'], response)
+    return response
+
+
+@server.route("/shadow", methods=['GET', 'OPTIONS'])
+def shadow():
+    """
+    Agreement rate and latency of the shadow candidate model
+    """
+    return jsonify(shadow_scorer.stats())
 
 
 @server.route("/scoring", methods=['GET', 'OPTIONS'])
 def score():
     """Check the score of the deployed model"""
-    with open(dataset_csv_path + '/latestscore.txt', 'r', encoding='utf8'
-              ) as f1:
-        latestscore = f1.read()
-    return latestscore
+    return model_store.get()['latestscore']
 
 
 @server.route("/summarystats", methods=['GET', 'OPTIONS'])
@@ -120,12 +126,11 @@ def summary():
     """
     Calls the summary function on the data in the config file
     """
-    sumamry_dict = dataframe_summary(dataset_csv_path)
+    sumamry_dict = model_store.get()['summary']
     return sumamry_dict
 
 
-@server.route("/diagnostics", methods=['GET', 'OPTIONS'])
-def diagnose():
+def run_diagnostics() -> dict:
     """
     Calls the remaingin diagnostics functions and returns the results
     """
@@ -138,8 +143,77 @@ def diagnose():
     return dianostics
 
 
+def diagnostics_version() -> str:
+    """
+    Deployed model and the size and modification time of the deployed
+    pickle and the ingested data, a handful of stat calls per request
+    """
+    parts = [current_version(model_path) or '']
+    for path in [os.path.join(model_path, 'trainedmodel.pkl'),
+                 os.path.join(dataset_csv_path, 'finaldata.csv')]:
+        try:
+            stat = os.stat(path)
+            parts.append(f'{stat.st_size}-{stat.st_mtime_ns}')
+        except FileNotFoundError:
+            parts.append('')
+    return ':'.join(parts)
+
+
+# One diagnostics run per data and model version, run in the background
+diagnostics_jobs = DiagnosticsJobs(
+    os.path.join(output_model_path, 'diagnostics_jobs'), run_diagnostics,
+    diagnostics_version)
+
+
+@server.route("/diagnostics", methods=['GET', 'POST', 'OPTIONS'])
+def diagnose():
+    """
+    Starts the diagnostics in the background, or joins the run of the
+    current data and model version, and returns the job to poll. The
+    result is included once the job is done.
+    """
+    job = diagnostics_jobs.submit()
+    response = jsonify(job)
+    response.status_code = 200 if job['status'] == 'done' else 202
+    response.headers['Location'] = f"/diagnostics/{job['id']}"
+    return response
+
+
+@server.route("/diagnostics/<job_id>", methods=['GET', 'OPTIONS'])
+def diagnose_status(job_id: str):
+    """
+    Status of a diagnostics job, with its result once done
+    """
+    job = diagnostics_jobs.get(job_id)
+    if job is None:
+        abort(404)
+    return jsonify(job)
+
+
+@server.route("/metrics", methods=['GET'])
+def metrics():
+    """
+    Request and model metrics of this process for Prometheus
+    """
+    gauges = {'model_load_count': ('Number of model loads in this process',
+                                   model_store.loads)}
+    for key, value in prediction_cache.stats().items():
+        gauges[f'prediction_cache_{key}'] = (
+            f'Prediction cache {key} in this process', value)
+    for key, value in shadow_scorer.stats().items():
+        if isinstance(value, (int, float)):
+            gauges[f'shadow_{key}'] = (f'Shadow candidate {key}', value)
+    if model_store.load_seconds is not None:
+        gauges['model_load_seconds'] = ('Duration of the last model load',
+                                        model_store.load_seconds)
+    return Response(request_metrics.render(gauges),
+                    mimetype='text/plain; version=0.0.4')
+
+
 app.layout = dbc.Container(
     [
+        dcc.Interval(id='refresh-interval', interval=REFRESH_INTERVAL_MS),
+        dcc.Store(id='data-version'),
         dbc.Row(
             dbc.Col(
                 [
@@ -163,14 +237,12 @@ app.layout = dbc.Container(
                         """),
                     html.Br(),
                     dash_table.DataTable(
-                        data=dff.reset_index().to_dict('records'),
-                        columns=[
-                            {"name": i, "id": i} for i in dff.reset_index().columns
-                            ],
                         id='datatable-main',
-                        virtualization=True,
-                        page_action='none',
-                        editable=True,
+                        page_action='custom',
+                        page_current=0,
+                        page_size=PAGE_SIZE,
+                        filter_action='custom',
+                        filter_query='',
                         style_cell={
                             'whiteSpace': 'normal',
                             'height': '50px',
@@ -215,23 +287,12 @@ app.layout = dbc.Container(
                     html.Br(),
                     dbc.Row([
                         dbc.Col(
-                            dcc.Markdown(
-                                f"""
-                                ##### F1 Score:
-                                    {data_check['F1_score']}
-                                """), width={"size": 3, "offset": 1}),
+                            dcc.Markdown(id='f1-score'),
+                            width={"size": 3, "offset": 1}),
                         dbc.Col(
-                            dcc.Markdown(
-                                f"""
-                                ##### Ingestion Time:
-                                    {data_check['diagnostics']['timings']['ingestion_time']}
-                                """), width=3),
+                            dcc.Markdown(id='ingestion-time'), width=3),
                         dbc.Col(
-                            dcc.Markdown(
-                                f"""
-                                ##### Training Time:
-                                    {data_check['diagnostics']['timings']['training_time']}
-                                """), width=3)
+                            dcc.Markdown(id='training-time'), width=3)
                     ]),
                     html.Hr(),
                     dbc.Row([
@@ -239,14 +300,12 @@ app.layout = dbc.Container(
                             html.H5("Confusion Matrix"),
                             dcc.Graph(
                                 id='example-graph',
-                                figure=cm
                                 ),
                             ], width=6),
                         dbc.Col([
                             html.H5("AUC"),
                             dcc.Graph(
                                 id='example-graph2',
-                                figure=auc
                                 )], width=6)
                         ]),
                     html.Br(),
@@ -261,14 +320,12 @@ app.layout = dbc.Container(
                     ),
                     html.Br(),
                     dash_table.DataTable(
-                        data=outdated.to_dict('records'),
-                        columns=[
-                            {"name": i, "id": i} for i in outdated.columns
-                            ],
                         id='datatable-pip',
-                        virtualization=True,
-                        page_action='none',
-                        editable=True,
+                        page_action='custom',
+                        page_current=0,
+                        page_size=PAGE_SIZE,
+                        filter_action='custom',
+                        filter_query='',
                         style_cell={
                             'whiteSpace': 'normal',
                             'height': '50px',
@@ -308,5 +365,83 @@ app.layout = dbc.Container(
     ],
 )
 
+
+@app.callback(
+    Output('data-version', 'data'),
+    Input('refresh-interval', 'n_intervals'),
+    State('data-version', 'data'))
+def refresh_version(_, known_version):
+    """
+    Publish the server-side data version, the dependent callbacks (and the
+    figure payloads) only run when it changes
+    """
+    version = dashboard_data.get()['version']
+    return no_update if version == known_version else version
+
+
+@app.callback(
+    [Output('f1-score', 'children'),
+     Output('ingestion-time', 'children'),
+     Output('training-time', 'children'),
+     Output('example-graph', 'figure'),
+     Output('example-graph2', 'figure')],
+    Input('data-version', 'data'),
+    prevent_initial_call=True)
+def update_performance(_):
+    """
+    Scores, timings and figures of the current version
+    """
+    data = dashboard_data.get()
+    return (
+        f"##### F1 Score:\n    {data['F1_score']}",
+        f"##### Ingestion Time:\n    {data['ingestion_time']}",
+        f"##### Training Time:\n    {data['training_time']}",
+        data['confusionmatrix'],
+        data['auc'])
+
+
+def table_page(table, page_current, page_size, filter_query):
+    """
+    Rows, columns and page count of one server-side page of a table
+    """
+    records, page_count = dashboard_data.page(
+        table, page_current or 0, page_size or PAGE_SIZE, filter_query)
+    columns = [{"name": i, "id": i}
+               for i in dashboard_data.get()[table].columns]
+    return records, columns, page_count
+
+
+@app.callback(
+    [Output('datatable-main', 'data'),
+     Output('datatable-main', 'columns'),
+     Output('datatable-main', 'page_count')],
+    [Input('datatable-main', 'page_current'),
+     Input('datatable-main', 'page_size'),
+     Input('datatable-main', 'filter_query'),
+     Input('data-version', 'data')],
+    prevent_initial_call=True)
+def update_summary_table(page_current, page_size, filter_query, _):
+    """
+    Server-side paging and filtering of the data summary
+    """
+    return table_page('data_summary', page_current, page_size, filter_query)
+
+
+@app.callback(
+    [Output('datatable-pip', 'data'),
+     Output('datatable-pip', 'columns'),
+     Output('datatable-pip', 'page_count')],
+    [Input('datatable-pip', 'page_current'),
+     Input('datatable-pip', 'page_size'),
+     Input('datatable-pip', 'filter_query'),
+     Input('data-version', 'data')],
+    prevent_initial_call=True)
+def update_pip_table(page_current, page_size, filter_query, _):
+    """
+    Server-side paging and filtering of the outdated packages
+    """
+    return table_page('outdated', page_current, page_size, filter_query)
+
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=8000, debug=True, threaded=True)
@@ -0,0 +1,108 @@
+"""
+Benchmark of the columnar diagnostics against pandas on wide datasets
+
+For each width a synthetic dataset with missing values is written as csv
+and its Parquet copy, then summarized with pd.read_csv followed by
+describe() and isna().sum() (the previous diagnostics) and with
+columnstats.summary_statistics and missing_counts. Both results are
+checked to be equal and the best of `--repeat` runs is reported.
+
+    python benchmark_diagnostics.py
+    python benchmark_diagnostics.py --rows 100000 --columns 100 2000
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from columnstats import summary_statistics, missing_counts, write_parquet
+
+
+def generate_file(path: str, rows: int, columns: int) -> pd.DataFrame:
+    """
+    Write a csv of integer and float columns, 1% of the values missing,
+    and its Parquet copy
+    """
+    rng = np.random.default_rng(0)
+    data = {}
+    for i in range(columns):
+        values = rng.normal(100, 30, rows)
+        if i % 2:
+            values = np.round(values)
+        values[rng.random(rows) < 0.01] = np.nan
+        data[f'feature_{i}'] = values
+    dff = pd.DataFrame(data)
+    dff.to_csv(path, index=False)
+    write_parquet(pd.read_csv(path), path)
+    return dff
+
+
+def best_time(func, repeat: int) -> tuple:
+    """
+    Best wall time of `repeat` calls and the last result
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def main() -> None:
+    """
+    Run the benchmark for every width
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=20_000)
+    parser.add_argument('--columns', type=int, nargs='+',
+                        default=[10, 500, 2000])
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='logs/benchmark_diagnostics.json')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    os.makedirs('logs', exist_ok=True)
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        for columns in args.columns:
+            path = os.path.join(directory, f'wide_{columns}.csv')
+            generate_file(path, args.rows, columns)
+
+            def with_pandas():
+                dff = pd.read_csv(path)
+                return dff.describe().to_dict(), dff.isna().sum().to_dict()
+
+            def with_columnstats():
+                return (summary_statistics(path, args.workers),
+                        missing_counts(path, args.workers))
+
+            pandas_seconds, expected = best_time(with_pandas, args.repeat)
+            columnar_seconds, actual = best_time(with_columnstats,
+                                                 args.repeat)
+            equal = actual[1] == expected[1] and all(
+                np.allclose(list(actual[0][name].values()),
+                            list(stats.values()), equal_nan=True)
+                for name, stats in expected[0].items())
+            result = {'rows': args.rows, 'columns': columns,
+                      'pandas_seconds': pandas_seconds,
+                      'columnstats_seconds': columnar_seconds,
+                      'speedup': pandas_seconds / columnar_seconds,
+                      'equal': bool(equal)}
+            results.append(result)
+            print('{columns:>6} columns  pandas {pandas_seconds:7.3f}s  '
+                  'columnstats {columnstats_seconds:7.3f}s  '
+                  'x{speedup:5.1f}  equal {equal}'.format(**result))
+
+    with open(args.output, 'w', encoding='utf8') as file:
+        json.dump(results, file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
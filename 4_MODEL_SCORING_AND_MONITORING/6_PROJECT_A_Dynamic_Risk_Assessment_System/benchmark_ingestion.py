@@ -0,0 +1,99 @@
+"""
+Benchmark of the schema validation at ingestion against the csv parse time
+
+For each size a synthetic file with the risk dataset columns is written,
+with a fraction of bad rows, then read with plain pd.read_csv (the
+previous ingestion) and with schema.read_validated, which parses with
+pyarrow and runs the vectorized checks. The best of `--repeat` runs is
+reported.
+
+    python benchmark_ingestion.py
+    python benchmark_ingestion.py --rows 100000 1000000 --bad-fraction 0.01
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import numpy as np
+import pandas as pd
+from pyarrow import csv
+from schema import read_validated
+
+
+def generate_file(path: str, rows: int, bad_fraction: float) -> None:
+    """
+    Write a csv with the risk dataset columns and some invalid values
+    """
+    rng = np.random.default_rng(0)
+    dff = pd.DataFrame({
+        'corporation': rng.choice(['abcd', 'asdf', 'xyzz', 'acme'], rows),
+        'lastmonth_activity': rng.integers(0, 2000, rows).astype(str),
+        'lastyear_activity': rng.integers(0, 5000, rows).astype(str),
+        'number_of_employees': rng.integers(1, 1000, rows),
+        'exited': rng.integers(0, 2, rows),
+    })
+    bad = rng.random(rows) < bad_fraction
+    dff.loc[bad, 'lastmonth_activity'] = 'n/a'
+    dff.loc[bad & (rng.random(rows) < 0.5), 'lastyear_activity'] = '-5'
+    dff.to_csv(path, index=False)
+
+
+def best_time(func, repeat: int) -> float:
+    """
+    Shortest wall time of `repeat` calls
+    """
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        func()
+        times.append(time.perf_counter() - start)
+    return min(times)
+
+
+def main() -> None:
+    """
+    Run the benchmark for every size
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[100_000, 1_000_000, 10_000_000])
+    parser.add_argument('--bad-fraction', type=float, default=0.001)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--output', default='logs/benchmark_ingestion.json')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    os.makedirs('logs', exist_ok=True)
+    results = []
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'data.csv')
+        for rows in args.rows:
+            generate_file(path, rows, args.bad_fraction)
+            result = {
+                'rows': rows,
+                'pandas_read_csv': best_time(
+                    lambda: pd.read_csv(path), args.repeat),
+                'arrow_parse': best_time(
+                    lambda: csv.read_csv(path), args.repeat),
+                'validated': best_time(
+                    lambda: read_validated(path), args.repeat),
+            }
+            result['overhead_vs_pandas'] = \
+                result['validated'] / result['pandas_read_csv'] - 1
+            results.append(result)
+            print('{rows:>11,}  pd.read_csv {pandas_read_csv:7.3f} s  '
+                  'arrow parse {arrow_parse:7.3f} s  '
+                  'validated {validated:7.3f} s  '
+                  '({overhead_vs_pandas:+.0%} vs pd.read_csv)'.format(
+                      **result))
+
+    with open(args.output, 'w', encoding='utf8') as file:
+        json.dump(results, file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
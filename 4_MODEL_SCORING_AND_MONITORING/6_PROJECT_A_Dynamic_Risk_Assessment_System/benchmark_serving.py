@@ -0,0 +1,148 @@
+"""
+Local load-generation benchmark of the gunicorn serving profile
+
+Starts gunicorn (gunicorn.conf.py) with 1, 4 and 8 workers on a local port,
+drives /prediction and /scoring with closed-loop clients running in separate
+processes (so the client is not limited by one GIL) and reports the
+requests/second and latency percentiles per worker count.
+
+    python benchmark_serving.py
+    python benchmark_serving.py --workers 1 4 8 --clients 16 --duration 10
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import os
+import sys
+import json
+import time
+import socket
+import argparse
+import subprocess
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import requests
+
+ENDPOINTS = {
+    'prediction': ('prediction', {'filepath': 'testdata/testdata.csv'}),
+    'scoring': ('scoring', {}),
+}
+
+
+def free_port() -> int:
+    """
+    A free local TCP port
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def start_server(port: int, workers: int, threads: int) -> subprocess.Popen:
+    """
+    Start gunicorn with the serving profile and wait until it answers
+    """
+    env = dict(os.environ, BIND=f'127.0.0.1:{port}', WORKERS=str(workers),
+               THREADS=str(threads))
+    process = subprocess.Popen(
+        [sys.executable, '-m', 'gunicorn', '--log-level', 'warning'],
+        env=env)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            requests.get(f'http://127.0.0.1:{port}/scoring', timeout=1)
+            return process
+        except requests.exceptions.RequestException:
+            # the master listens before the workers are booted
+            time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError('gunicorn did not start')
+
+
+def client(url: str, params: dict, duration: float) -> list:
+    """
+    Send requests back to back on one keep-alive connection for `duration`
+    seconds
+
+    Returns
+    ---
+    list
+        Latency of every request in seconds, None for errors
+    """
+    latencies = []
+    session = requests.Session()
+    deadline = time.monotonic() + duration
+    while time.monotonic() < deadline:
+        start = time.perf_counter()
+        try:
+            ok = session.get(url, params=params, timeout=10).ok
+        except requests.exceptions.RequestException:
+            ok = False
+        latencies.append(time.perf_counter() - start if ok else None)
+    return latencies
+
+
+def run_load(url: str, params: dict, clients: int, duration: float) -> dict:
+    """
+    Closed-loop load with `clients` concurrent client processes
+
+    Returns
+    ---
+    dict
+        requests, errors, rps and p50/p99 latency in milliseconds
+    """
+    with ProcessPoolExecutor(clients) as pool:
+        results = list(pool.map(client, [url] * clients, [params] * clients,
+                                [duration] * clients))
+    latencies = [lat for result in results for lat in result]
+    ok = np.array([lat for lat in latencies if lat is not None])
+    return {
+        'requests': len(latencies),
+        'errors': len(latencies) - len(ok),
+        'rps': len(ok) / duration,
+        'p50_ms': float(np.percentile(ok, 50) * 1000) if len(ok) else None,
+        'p99_ms': float(np.percentile(ok, 99) * 1000) if len(ok) else None,
+    }
+
+
+def main() -> None:
+    """
+    Run the benchmark for every worker count and endpoint
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 4, 8])
+    parser.add_argument('--threads', type=int, default=4)
+    parser.add_argument('--clients', type=int, default=16)
+    parser.add_argument('--duration', type=float, default=10.0)
+    parser.add_argument('--output', default='logs/benchmark_serving.json')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    os.makedirs('logs', exist_ok=True)
+    results = []
+    for workers in args.workers:
+        port = free_port()
+        server = start_server(port, workers, args.threads)
+        try:
+            for name, (path, params) in ENDPOINTS.items():
+                # warm up every worker before measuring
+                run_load(f'http://127.0.0.1:{port}/{path}', params,
+                         args.clients, 1.0)
+                result = run_load(f'http://127.0.0.1:{port}/{path}', params,
+                                  args.clients, args.duration)
+                result.update(workers=workers, threads=args.threads,
+                              clients=args.clients, endpoint=name)
+                results.append(result)
+                print('workers={workers:<2} {endpoint:<10} '
+                      '{rps:8.1f} req/s  p50 {p50_ms:7.2f} ms  '
+                      'p99 {p99_ms:7.2f} ms  errors {errors}'.format(**result))
+        finally:
+            server.terminate()
+            server.wait()
+
+    with open(args.output, 'w', encoding='utf8') as file:
+        json.dump(results, file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,129 @@
+"""
+Benchmark of the /prediction latency with and without shadow scoring
+
+Drives /prediction of app.py in process (Flask test client, one thread per
+client like the gthread workers) on a generated input file, with the
+prediction cache disabled so every request predicts, first with the shadow
+mode off and then with the candidate scoring every request. The primary
+latency percentiles of both runs, their ratio and the shadow statistics
+(agreement rate, candidate latency, dropped samples) are reported.
+
+    python benchmark_shadow.py
+    python benchmark_shadow.py --rows 10000 --clients 4 --requests 500
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import os
+import json
+import time
+import argparse
+import tempfile
+import threading
+import numpy as np
+import pandas as pd
+
+
+def make_input(rows: int, directory: str, seed: int = 0) -> str:
+    """
+    A /prediction input file of `rows` rows resampled from testdata.csv
+    """
+    dff = pd.read_csv(os.path.join('testdata', 'testdata.csv'))
+    dff = dff.sample(rows, replace=True, random_state=seed)
+    path = os.path.join(directory, 'shadow_benchmark.csv')
+    dff.to_csv(path, index=False)
+    return path
+
+
+def run_clients(server, filepath: str, clients: int, requests: int) -> dict:
+    """
+    Send `requests` /prediction requests from each of `clients` threads
+
+    Returns
+    ---
+    dict
+        requests, errors, p50/p90/p99 latency in milliseconds and rps
+    """
+    latencies = []
+    errors = []
+
+    def client():
+        test_client = server.test_client()
+        for _ in range(requests):
+            start = time.perf_counter()
+            response = test_client.get('/prediction',
+                                       query_string={'filepath': filepath})
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors.append(response.status_code)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    latencies = np.array(latencies) * 1000
+    result = {'requests': len(latencies), 'errors': len(errors),
+              'rps': len(latencies) / seconds}
+    for p in [50, 90, 99]:
+        result[f'p{p}_ms'] = float(np.percentile(latencies, p))
+    return result
+
+
+def main() -> None:
+    """
+    Run the benchmark with the shadow mode off and on
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, default=1000)
+    parser.add_argument('--clients', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=300)
+    parser.add_argument('--candidate', default=None,
+                        help='Candidate model pickle, the trained model by '
+                        'default')
+    parser.add_argument('--output', default='logs/benchmark_shadow.json')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    os.makedirs('logs', exist_ok=True)
+    import app
+    from serving import PredictionCache
+    # every request predicts, as for new input files
+    app.prediction_cache = PredictionCache(max_entries=0)
+    if args.candidate:
+        app.shadow_scorer.candidate_path = args.candidate
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        filepath = make_input(args.rows, directory)
+        # warm up the model, the candidate and the code paths
+        app.shadow_scorer.sample_rate = 1.0
+        run_clients(app.server, filepath, args.clients, 10)
+        app.shadow_scorer.join()
+        for mode, rate in [('off', 0.0), ('on', 1.0)]:
+            app.shadow_scorer.sample_rate = rate
+            result = run_clients(app.server, filepath, args.clients,
+                                 args.requests)
+            app.shadow_scorer.join()
+            result.update(shadow=mode, rows=args.rows, clients=args.clients)
+            results.append(result)
+            print('shadow {shadow:<3} {rps:8.1f} req/s  p50 {p50_ms:7.2f} ms'
+                  '  p90 {p90_ms:7.2f} ms  p99 {p99_ms:7.2f} ms'.format(
+                      **result))
+    stats = app.shadow_scorer.stats()
+    report = {'runs': results, 'shadow': stats,
+              'p50_ratio': results[1]['p50_ms'] / results[0]['p50_ms'],
+              'p99_ratio': results[1]['p99_ms'] / results[0]['p99_ms']}
+    print(f"p50 on/off {report['p50_ratio']:.3f}  p99 on/off "
+          f"{report['p99_ratio']:.3f}  agreement {stats['agreement_rate']}  "
+          f"candidate p50 {(stats['latency_p50'] or 0) * 1000:.2f} ms  "
+          f"dropped {stats['dropped']} of "
+          f"{stats['sampled'] + stats['dropped']}")
+    with open(args.output, 'w', encoding='utf8') as file:
+        json.dump(report, file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,140 @@
+"""
+Benchmark of liblinear against out-of-core SGD training
+
+Generates synthetic data with the schema of finaldata.csv at each size,
+then trains with training.train_model in both modes, each in a fresh
+process so that its peak memory (max RSS) is measured on its own, and
+scores the model on a held out file with the F1 score of scoring.py.
+Both modes validate finaldata.csv against schema.RISK_SCHEMA; the liblinear
+time also includes writing the feature cache of features.py, as in the
+first training on a new finaldata.csv.
+
+    python benchmark_training.py
+    python benchmark_training.py --rows 100000 10000000 \
+        --skip-liblinear-above 10000000
+
+The 100M row file takes about 4 GB of disk. liblinear needs the whole
+dataset in memory, use --skip-liblinear-above when it does not fit.
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import os
+import json
+import time
+import pickle
+import resource
+import argparse
+import tempfile
+import multiprocessing
+import numpy as np
+import pandas as pd
+from sklearn import metrics
+from training import train_model
+
+GENERATE_CHUNK = 1_000_000
+HOLDOUT_ROWS = 100_000
+
+
+def generate_data(path: str, rows: int, seed: int) -> None:
+    """
+    Write `rows` synthetic rows of the finaldata.csv schema to `path`, in
+    chunks so that generating does not need the whole dataset in memory
+    """
+    rng = np.random.default_rng(seed)
+    header = True
+    for start in range(0, rows, GENERATE_CHUNK):
+        size = min(GENERATE_CHUNK, rows - start)
+        lastmonth = rng.poisson(300, size) * rng.integers(0, 2, size)
+        lastyear = rng.poisson(1200, size)
+        employees = rng.integers(1, 1000, size)
+        logit = 1.5 - 0.004 * lastmonth - 0.0005 * lastyear \
+            - 0.001 * employees
+        exited = (rng.random(size) < 1 / (1 + np.exp(-logit))).astype(int)
+        pd.DataFrame({
+            'corporation': 'corp',
+            'lastmonth_activity': lastmonth,
+            'lastyear_activity': lastyear,
+            'number_of_employees': employees,
+            'exited': exited,
+        }).to_csv(path, mode='w' if header else 'a', header=header,
+                  index=False)
+        header = False
+
+
+def fit(data_dir: str, model_dir: str, out_of_core: bool,
+        chunksize: int, epochs: int) -> dict:
+    """
+    Train in the current (child) process and measure it
+    """
+    start = time.perf_counter()
+    train_model(data_dir, model_dir, out_of_core=out_of_core,
+                chunksize=chunksize, epochs=epochs)
+    seconds = time.perf_counter() - start
+    # ru_maxrss is in kilobytes on linux
+    peak_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    return {'fit_seconds': seconds, 'peak_rss_mb': peak_mb}
+
+
+def run_isolated(*args) -> dict:
+    """
+    Run `fit` in a fresh process so every measurement has its own max RSS
+    """
+    with multiprocessing.get_context('spawn').Pool(1) as pool:
+        return pool.apply(fit, args)
+
+
+def score(model_dir: str, holdout: pd.DataFrame) -> float:
+    """
+    F1 score of the trained model on the held out rows
+    """
+    with open(os.path.join(model_dir, 'trainedmodel.pkl'), 'rb') as file:
+        model = pickle.load(file)
+    y = holdout['exited']
+    X = holdout.drop(['corporation', 'exited'], axis=1)
+    return metrics.f1_score(y, model.predict(X))
+
+
+def main() -> None:
+    """
+    Run the benchmark for every size and training mode
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[100_000, 10_000_000, 100_000_000])
+    parser.add_argument('--chunksize', type=int, default=100_000)
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--skip-liblinear-above', type=int, default=None)
+    parser.add_argument('--tmpdir', default=None,
+                        help='Directory for the generated data')
+    parser.add_argument('--output', default='logs/benchmark_training.json')
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    os.makedirs('logs', exist_ok=True)
+    results = []
+    with tempfile.TemporaryDirectory(dir=args.tmpdir) as tmp:
+        holdout_path = os.path.join(tmp, 'holdout.csv')
+        generate_data(holdout_path, HOLDOUT_ROWS, seed=1)
+        holdout = pd.read_csv(holdout_path)
+        for rows in args.rows:
+            generate_data(os.path.join(tmp, 'finaldata.csv'), rows, seed=0)
+            for mode in ['liblinear', 'sgd']:
+                if mode == 'liblinear' and args.skip_liblinear_above \
+                        and rows > args.skip_liblinear_above:
+                    continue
+                result = run_isolated(tmp, tmp, mode == 'sgd',
+                                      args.chunksize, args.epochs)
+                result.update(rows=rows, mode=mode,
+                              f1=score(tmp, holdout))
+                results.append(result)
+                print('{rows:>11,} {mode:<9} {fit_seconds:8.2f} s  '
+                      'peak {peak_rss_mb:8.1f} MB  F1 {f1:.4f}'.format(
+                          **result))
+
+    with open(args.output, 'w', encoding='utf8') as file:
+        json.dump(results, file, indent=4)
+
+
+if __name__ == '__main__':
+    main()
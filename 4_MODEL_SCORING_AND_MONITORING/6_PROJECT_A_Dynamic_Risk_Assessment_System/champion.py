@@ -0,0 +1,276 @@
+"""
+Champion/challenger scoring of the registered candidate models
+
+The candidates are the deployed model (the champion), the freshly trained
+model, the previous deployed versions kept by deployment.py and any model
+listed under `candidate_models` in config.json. Each pickle is loaded once,
+models with identical bytes are scored once, and the test data is read and
+decoded once (a memory map of the feature cache) and shared by all
+candidates, which are evaluated in parallel threads. The single row latency
+is then measured one candidate at a time so that the timings do not compete
+for the cpu. The result is a table ranked by F1, then AUC, then latency,
+written to candidatescores.json. The ranking is informational:
+fullprocess.py deploys the retrained model whenever drift is detected,
+whichever candidate ranks first, and a failed ranking is only logged.
+
+    python champion.py
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import os
+import json
+import time
+import pickle
+import hashlib
+import logging
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+from sklearn import metrics
+from deployment import list_versions, current_version, VERSIONS_DIR
+from features import load_features, feature_frame, FEATURES_DIR
+from scoring import confusion_counts, f1_from_counts
+
+logger = logging.getLogger(__name__)
+
+CANDIDATE_SCORES = 'candidatescores.json'
+# previous deployed versions entered as challengers, the latest ones
+MAX_VERSIONS = 3
+# single row predictions timed per candidate
+LATENCY_ROWS = 200
+
+
+def registered_candidates(config: dict,
+                          max_versions: int = MAX_VERSIONS) -> dict:
+    """
+    Pickle paths of the candidate models that exist
+
+    Parameters
+    ---
+    config: dict
+        Config values as returned by fullprocess.load_config
+    max_versions: int
+        Number of previous deployed versions to include
+
+    Returns
+    ---
+    dict
+        Candidate name to pickle path, the champion first
+    """
+    deploy_path = config['prod_deployment_path']
+    candidates = {
+        'champion': os.path.join(deploy_path, 'trainedmodel.pkl'),
+        'challenger': os.path.join(config['output_model_path'],
+                                   'trainedmodel.pkl'),
+    }
+    current = current_version(deploy_path)
+    previous = [version for version in list_versions(deploy_path)
+                if version != current]
+    for version in previous[-max_versions:] if max_versions else []:
+        candidates[f'version-{version}'] = os.path.join(
+            deploy_path, VERSIONS_DIR, version, 'trainedmodel.pkl')
+    candidates.update(config.get('candidate_models', {}))
+    return {name: path for name, path in candidates.items()
+            if os.path.isfile(path)}
+
+
+def load_candidates(paths: dict) -> tuple:
+    """
+    Load each distinct candidate pickle once
+
+    Parameters
+    ---
+    paths: dict
+        Candidate name to pickle path
+
+    Returns
+    ---
+    tuple
+        (digest to model, candidate name to digest)
+    """
+    models = {}
+    digests = {}
+    for name, path in paths.items():
+        with open(path, 'rb') as file:
+            model_bytes = file.read()
+        digest = hashlib.sha256(model_bytes).hexdigest()[:12]
+        if digest not in models:
+            models[digest] = pickle.loads(model_bytes)
+        digests[name] = digest
+    return models, digests
+
+
+def evaluate_model(model, X: np.ndarray, y: np.ndarray) -> dict:
+    """
+    F1, AUC and scoring time of one model on the shared test data
+
+    Parameters
+    ---
+    model: sklearn estimator
+        Fitted classifier with predict_proba
+    X: np.ndarray
+        Features, shared between the candidates and not copied
+    y: np.ndarray
+        0/1 labels
+
+    Returns
+    ---
+    dict
+        f1, auc, confusion counts and batch_seconds for all rows
+    """
+    start = time.perf_counter()
+    scores = model.predict_proba(feature_frame(X))[:, 1]
+    batch_seconds = time.perf_counter() - start
+    # predict() of a binary classifier is predict_proba above 0.5
+    counts = confusion_counts(y, scores > 0.5)
+    try:
+        auc = float(metrics.roc_auc_score(y, scores))
+    except ValueError:
+        # a single class in the test data
+        auc = float('nan')
+    return {'f1': f1_from_counts(counts), 'auc': auc, 'counts': counts,
+            'batch_seconds': batch_seconds}
+
+
+def row_latency(model, X: np.ndarray, rows: int = LATENCY_ROWS) -> float:
+    """
+    Median seconds to score a single row, as the /prediction endpoint does
+    for small files
+    """
+    timings = []
+    for i in range(min(rows, len(X))):
+        row = feature_frame(X[i:i + 1])
+        start = time.perf_counter()
+        model.predict_proba(row)
+        timings.append(time.perf_counter() - start)
+    return float(np.median(timings)) if timings else float('nan')
+
+
+def rank_candidates(rows: list) -> list:
+    """
+    Sort candidate results by F1, then AUC (both descending), then single
+    row latency, and number them from 1
+    """
+    def key(row):
+        auc = row['auc'] if not np.isnan(row['auc']) else -1.0
+        return (-row['f1'], -auc, row['latency_ms'])
+
+    ranked = sorted(rows, key=key)
+    for rank, row in enumerate(ranked, 1):
+        row['rank'] = rank
+    return ranked
+
+
+def score_candidates(
+    paths: dict,
+    X: np.ndarray,
+    y: np.ndarray,
+    max_workers: int = None,
+    latency_rows: int = LATENCY_ROWS
+        ) -> list:
+    """
+    Evaluate all candidates on one copy of the test data
+
+    Parameters
+    ---
+    paths: dict
+        Candidate name to pickle path
+    X: np.ndarray
+        Features of the test data
+    y: np.ndarray
+        Labels of the test data
+    max_workers: int
+        Threads evaluating the candidates, one per distinct model by default
+    latency_rows: int
+        Single row predictions timed per candidate
+
+    Returns
+    ---
+    list
+        One dict per candidate, ranked by rank_candidates
+    """
+    models, digests = load_candidates(paths)
+    with ThreadPoolExecutor(max_workers or max(len(models), 1)) as pool:
+        futures = {digest: pool.submit(evaluate_model, model, X, y)
+                   for digest, model in models.items()}
+        results = {digest: future.result()
+                   for digest, future in futures.items()}
+    latencies = {digest: row_latency(model, X, latency_rows)
+                 for digest, model in models.items()}
+
+    rows = []
+    for name, digest in digests.items():
+        result = results[digest]
+        rows.append({
+            'model': name, 'path': paths[name], 'model_version': digest,
+            'f1': result['f1'], 'auc': result['auc'],
+            'latency_ms': latencies[digest] * 1000,
+            'batch_seconds': result['batch_seconds'],
+            'rows': int(len(y)), 'counts': result['counts']})
+    return rank_candidates(rows)
+
+
+def format_table(ranked: list) -> str:
+    """
+    Text table of the ranked candidates
+    """
+    lines = [f"{'rank':>4}  {'model':<24} {'f1':>7} {'auc':>7} "
+             f"{'latency ms':>11} {'batch s':>9}"]
+    for row in ranked:
+        lines.append(f"{row['rank']:>4}  {row['model']:<24} {row['f1']:7.4f} "
+                     f"{row['auc']:7.4f} {row['latency_ms']:11.3f} "
+                     f"{row['batch_seconds']:9.4f}")
+    return '\n'.join(lines)
+
+
+def compare_candidates(config: dict, max_workers: int = None) -> list:
+    """
+    Score the registered candidates on testdata.csv and write the ranked
+    table to candidatescores.json in the output folder
+
+    Parameters
+    ---
+    config: dict
+        Config values as returned by fullprocess.load_config
+    max_workers: int
+        Threads evaluating the candidates
+
+    Returns
+    ---
+    list
+        Ranked candidate results
+    """
+    paths = registered_candidates(config)
+    output_path = config['output_folder_path']
+    X, y = load_features(
+        os.path.join(config['test_data_path'], 'testdata.csv'),
+        os.path.join(output_path, FEATURES_DIR))
+    ranked = score_candidates(paths, X, y, max_workers)
+    with open(os.path.join(output_path, CANDIDATE_SCORES), 'w',
+              encoding='utf8') as file:
+        json.dump(ranked, file, indent=4)
+    if ranked:
+        logger.info("Candidate ranking:\n%s", format_table(ranked))
+        if ranked[0]['model'] != 'champion':
+            logger.info("%s outranks the champion", ranked[0]['model'])
+    return ranked
+
+
+def main() -> None:
+    """
+    Print the ranked table of the registered candidates
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    logging.basicConfig(level=logging.WARNING)
+    with open('config.json', 'r', encoding='utf8') as file:
+        config = json.load(file)
+    print(format_table(compare_candidates(config, args.workers)))
+
+
+if __name__ == '__main__':
+    main()
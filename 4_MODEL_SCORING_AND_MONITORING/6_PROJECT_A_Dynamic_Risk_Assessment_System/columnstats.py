@@ -0,0 +1,253 @@
+"""
+Columnar engine behind diagnostics.missing_data and dataframe_summary
+
+The dataset is kept as a Parquet copy next to finaldata.csv, written by
+ingestion. When the copy is missing or older than the csv, the csv is read
+and summarized in this process instead: the callers serve read-only API
+requests and never write the copy themselves. The columns of the copy are
+split into groups, each group is read on its own from the Parquet file
+and reduced with NumPy in a process pool, so a wide dataset is never loaded
+whole and the columns are summarized in parallel. Small datasets, one group
+of columns, are summarized in this process without starting a pool. The
+pool is started once with the spawn method and reused: the callers run in
+threads of a multi-threaded server, where forking could copy locks held by
+other threads.
+
+The results have the layout of pandas: `summary_statistics` returns
+DataFrame.describe().to_dict() (count, mean, std, min, 25%, 50%, 75% and
+max of the numeric columns) and `missing_counts` DataFrame.isna().sum()
+.to_dict().
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import os
+import logging
+import threading
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from pyarrow import csv
+
+logger = logging.getLogger(__name__)
+
+# columns read and reduced per task
+COLUMNS_PER_TASK = 64
+ROW_GROUP_SIZE = 1_000_000
+SOURCE_KEY = b'source_csv'
+STATISTICS = ['count', 'mean', 'std', 'min', '25%', '50%', '75%', 'max']
+
+_pool = None
+_pool_workers = None
+_pool_lock = threading.Lock()
+
+
+def _source_token(csv_path: str) -> bytes:
+    stat = os.stat(csv_path)
+    return f'{stat.st_size}:{stat.st_mtime_ns}'.encode()
+
+
+def parquet_path(csv_path: str) -> str:
+    """
+    Path of the Parquet copy of a csv file
+    """
+    return os.path.splitext(csv_path)[0] + '.parquet'
+
+
+def write_parquet(dff: pd.DataFrame, csv_path: str) -> str:
+    """
+    Write the Parquet copy of a frame that was just written to csv_path
+
+    Returns
+    ---
+    str
+        Path to the Parquet file
+    """
+    table = pa.Table.from_pandas(dff, preserve_index=False)
+    return _write_table(table, csv_path)
+
+
+def _write_table(table: pa.Table, csv_path: str) -> str:
+    path = parquet_path(csv_path)
+    # the csv it was made from, to detect a stale copy
+    table = table.replace_schema_metadata(
+        {**(table.schema.metadata or {}),
+         SOURCE_KEY: _source_token(csv_path)})
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    pq.write_table(table, tmp_path, row_group_size=ROW_GROUP_SIZE)
+    os.replace(tmp_path, path)
+    return path
+
+
+def current_parquet(csv_path: str) -> str:
+    """
+    Path to the Parquet copy of a csv file, None if the copy is missing or
+    older than the csv
+    """
+    path = parquet_path(csv_path)
+    try:
+        metadata = pq.read_schema(path).metadata or {}
+        if metadata.get(SOURCE_KEY) == _source_token(csv_path):
+            return path
+    except (FileNotFoundError, pa.ArrowInvalid):
+        pass
+    logger.info('No current Parquet copy of %s, reading the csv', csv_path)
+    return None
+
+
+def _column_groups(schema: pa.Schema, per_task: int) -> list:
+    names = schema.names
+    return [names[i:i + per_task] for i in range(0, len(names), per_task)]
+
+
+def _is_numeric(data_type: pa.DataType) -> bool:
+    # pandas describe() leaves booleans out of the numeric columns
+    return pa.types.is_integer(data_type) or pa.types.is_floating(data_type)
+
+
+def _as_float(column: pa.ChunkedArray) -> np.ndarray:
+    # nulls become NaN, like pandas reads missing values
+    return pc.cast(column, pa.float64()).to_numpy(zero_copy_only=False)
+
+
+def _missing_task(path: str, columns: list) -> dict:
+    return _missing(pq.read_table(path, columns=columns), columns)
+
+
+def _missing(table: pa.Table, columns: list) -> dict:
+    counts = {}
+    for name in columns:
+        column = table[name]
+        missing = column.null_count
+        if pa.types.is_floating(column.type):
+            missing += int(pc.sum(pc.is_nan(column)).as_py() or 0)
+        counts[name] = int(missing)
+    return counts
+
+
+def _summary_task(path: str, columns: list) -> dict:
+    return _summary(pq.read_table(path, columns=columns), columns)
+
+
+def _summary(table: pa.Table, columns: list) -> dict:
+    summary = {}
+    with np.errstate(invalid='ignore', divide='ignore'):
+        for name in columns:
+            values = _as_float(table[name])
+            values = values[~np.isnan(values)]
+            count = len(values)
+            if count == 0:
+                stats = [0.0] + [np.nan] * 7
+            else:
+                quartiles = np.percentile(values, [25, 50, 75])
+                stats = [float(count), values.mean(),
+                         values.std(ddof=1) if count > 1 else np.nan,
+                         values.min(), *quartiles, values.max()]
+            summary[name] = {key: float(value)
+                             for key, value in zip(STATISTICS, stats)}
+    return summary
+
+
+def _get_pool(max_workers: int, broken: ProcessPoolExecutor = None):
+    """
+    The shared spawn pool, started on first use and replaced when the
+    number of workers changes or `broken` is the current pool
+    """
+    global _pool, _pool_workers
+    with _pool_lock:
+        if _pool is None or _pool is broken or _pool_workers != max_workers:
+            if _pool is not None:
+                _pool.shutdown(wait=False)
+            _pool = ProcessPoolExecutor(
+                max_workers,
+                mp_context=multiprocessing.get_context('spawn'))
+            _pool_workers = max_workers
+        return _pool
+
+
+def _run(task, path: str, groups: list, max_workers: int) -> dict:
+    if len(groups) <= 1 or max_workers == 1:
+        results = [task(path, group) for group in groups]
+    else:
+        pool = _get_pool(max_workers)
+        try:
+            results = list(pool.map(task, [path] * len(groups), groups))
+        except BrokenProcessPool:
+            # a worker died, ie. killed for memory, retry on a new pool
+            pool = _get_pool(max_workers, broken=pool)
+            results = list(pool.map(task, [path] * len(groups), groups))
+    merged = {}
+    for result in results:
+        merged.update(result)
+    return merged
+
+
+def missing_counts(
+    csv_path: str,
+    max_workers: int = None,
+    columns_per_task: int = COLUMNS_PER_TASK
+        ) -> dict:
+    """
+    Number of missing values of every column of a csv dataset
+
+    Parameters
+    ---
+    csv_path: str
+        Path to the csv file, summarized through its Parquet copy if it is
+        current
+    max_workers: int
+        Processes reducing the column groups, os.cpu_count() if None
+    columns_per_task: int
+        Columns read and reduced per task
+
+    Returns
+    ---
+    dict
+        Column name to missing count, as DataFrame.isna().sum().to_dict()
+    """
+    path = current_parquet(csv_path)
+    if path is None:
+        table = csv.read_csv(csv_path)
+        return _missing(table, table.column_names)
+    groups = _column_groups(pq.read_schema(path), columns_per_task)
+    return _run(_missing_task, path, groups, max_workers)
+
+
+def summary_statistics(
+    csv_path: str,
+    max_workers: int = None,
+    columns_per_task: int = COLUMNS_PER_TASK
+        ) -> dict:
+    """
+    Summary statistics of the numeric columns of a csv dataset
+
+    Parameters
+    ---
+    csv_path: str
+        Path to the csv file, summarized through its Parquet copy if it is
+        current
+    max_workers: int
+        Processes reducing the column groups, os.cpu_count() if None
+    columns_per_task: int
+        Columns read and reduced per task
+
+    Returns
+    ---
+    dict
+        Column name to its statistics, as DataFrame.describe().to_dict()
+    """
+    path = current_parquet(csv_path)
+    if path is None:
+        table = csv.read_csv(csv_path)
+        return _summary(table, [field.name for field in table.schema
+                                if _is_numeric(field.type)])
+    schema = pq.read_schema(path)
+    numeric = pa.schema([field for field in schema
+                         if _is_numeric(field.type)])
+    return _run(_summary_task, path,
+                _column_groups(numeric, columns_per_task), max_workers)
@@ -0,0 +1,249 @@
+"""
+Server-side data layer for the dashboard in app.py
+
+The API returns, confusion matrix and AUC figures are read once per version
+and cached in the server process. The version is the deployed model version
+plus the modification times of the files the dashboard reads, so the cache
+is invalidated when a new model is deployed or the reports are rewritten.
+Tables are paged and filtered on the server so each page load only sends the
+rows that are displayed.
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import os
+import json
+import logging
+import threading
+import pandas as pd
+from deployment import current_version
+
+logger = logging.getLogger(__name__)
+
+# dash_table filter_query operators as (word, symbol) spellings
+FILTER_OPERATORS = [
+    ['ge ', '>='], ['le ', '<='], ['lt ', '<'], ['gt ', '>'], ['ne ', '!='],
+    ['eq ', '='], ['contains '], ['datestartswith ']]
+
+
+def parse_outdated(outdated: str) -> pd.DataFrame:
+    """
+    Convert the fixed width stdout of `pip list -o` into a dataframe
+
+    Parameters
+    ---
+    outdated: str
+        Output of `pip list -o`
+
+    Returns
+    ---
+    pd.DataFrame
+        One row per outdated package
+    """
+    lines = outdated.split("\n")
+    if len(lines) < 2:
+        return pd.DataFrame()
+    column_widths = [len(dashes) for dashes in lines[1].split()]
+    column_names = lines[0].split()
+    data = {key: list() for key in column_names}
+    for line in lines[2:]:
+        start = 0
+        end = 0
+        for column_name, column_width in zip(column_names, column_widths):
+            end += column_width + 1
+            data[column_name].append(line[start:end].strip())
+            start = end
+    return pd.DataFrame(data)
+
+
+def split_filter_part(filter_part: str) -> tuple:
+    """
+    Split one clause of a dash_table filter_query, ie. `{lastmonth} > 10`
+
+    Returns
+    ---
+    tuple
+        (column name, operator word, value), all None if it cannot be parsed
+    """
+    for operator_type in FILTER_OPERATORS:
+        for operator in operator_type:
+            if operator not in filter_part:
+                continue
+            name_part, value_part = filter_part.split(operator, 1)
+            name = name_part[name_part.find('{') + 1: name_part.rfind('}')]
+            value_part = value_part.strip()
+            if value_part and value_part[0] == value_part[-1] \
+                    and value_part[0] in "'\"`":
+                value = value_part[1:-1].replace('\\' + value_part[0],
+                                                 value_part[0])
+            else:
+                try:
+                    value = float(value_part)
+                except ValueError:
+                    value = value_part
+            return name, operator_type[0].strip(), value
+    return None, None, None
+
+
+def filter_frame(dff: pd.DataFrame, filter_query: str) -> pd.DataFrame:
+    """
+    Apply a dash_table filter_query with vectorized pandas comparisons
+
+    Parameters
+    ---
+    dff: pd.DataFrame
+        The full table
+    filter_query: str
+        Clauses joined by ' && ', as sent by a DataTable with
+        filter_action='custom'
+
+    Returns
+    ---
+    pd.DataFrame
+        The matching rows
+    """
+    if not filter_query:
+        return dff
+    for filter_part in filter_query.split(' && '):
+        name, operator, value = split_filter_part(filter_part)
+        if name not in dff.columns:
+            continue
+        column = dff[name]
+        if operator in ('ge', 'le', 'lt', 'gt', 'ne', 'eq'):
+            if not isinstance(value, str):
+                column = pd.to_numeric(column, errors='coerce')
+            mask = getattr(column, operator)(value)
+        elif operator == 'contains':
+            mask = column.astype(str).str.contains(str(value), regex=False)
+        else:
+            mask = column.astype(str).str.startswith(str(value))
+        dff = dff.loc[mask]
+    return dff
+
+
+class DashboardData:
+    """
+    Per process cache of everything the dashboard displays
+
+    Parameters
+    ---
+    output_model_path: str
+        Directory containing apireturns.json, confusionmatrix.json and
+        auc.json
+    prod_deployment_path: str
+        Path to the deployment directory, used for the model version
+    """
+
+    FILES = ['apireturns.json', 'confusionmatrix.json', 'auc.json']
+
+    def __init__(self, output_model_path: str, prod_deployment_path: str):
+        self.output_model_path = output_model_path
+        self.prod_deployment_path = prod_deployment_path
+        self._lock = threading.Lock()
+        self._version = None
+        self._data = {}
+
+    def version(self) -> str:
+        """
+        Cheap version token: the deployed model version and the file
+        modification times, a handful of stat calls
+        """
+        parts = [current_version(self.prod_deployment_path) or '']
+        for path in [os.path.join(self.prod_deployment_path,
+                                  'trainedmodel.pkl')] + [
+                os.path.join(self.output_model_path, name)
+                for name in self.FILES]:
+            try:
+                parts.append(str(os.stat(path).st_mtime_ns))
+            except FileNotFoundError:
+                parts.append('')
+        return ':'.join(parts)
+
+    def get(self) -> dict:
+        """
+        The cached dashboard data, reloaded when the version changes
+
+        Returns
+        ---
+        dict
+            version, F1_score, timings, data_summary and outdated dataframes
+            and the confusionmatrix and auc figures as plotly dicts
+        """
+        version = self.version()
+        with self._lock:
+            if version != self._version:
+                logger.info('Loading dashboard data for version %s', version)
+                self._data = self._load()
+                self._data['version'] = version
+                self._version = version
+            return self._data
+
+    def _load(self) -> dict:
+        try:
+            with open(os.path.join(self.output_model_path, 'apireturns.json'),
+                      'r', encoding='utf8') as file:
+                data_check = json.load(file)
+        except FileNotFoundError:
+            logger.warning('No json diagnostics file found')
+            data_check = {}
+        diagnostics = data_check.get('diagnostics', {})
+        try:
+            outdated = parse_outdated(diagnostics['outdated_pckgs'])
+        except KeyError:
+            logger.warning(
+                'No json diagnostics for outdated PIP packages found')
+            outdated = pd.DataFrame()
+
+        figures = {}
+        for name in ['confusionmatrix', 'auc']:
+            try:
+                with open(os.path.join(self.output_model_path, name + '.json'),
+                          'r', encoding='utf8') as file:
+                    # the reports are stored as a json encoded json string
+                    figures[name] = json.loads(json.load(file))
+            except FileNotFoundError:
+                logger.warning('No %s figure found', name)
+                figures[name] = {}
+
+        timings = diagnostics.get('timings', {})
+        return {
+            'F1_score': data_check.get('F1_score', ''),
+            'ingestion_time': timings.get('ingestion_time', ''),
+            'training_time': timings.get('training_time', ''),
+            'data_summary': pd.DataFrame(
+                data_check.get('data_summary', {})).reset_index(),
+            'outdated': outdated,
+            'confusionmatrix': figures['confusionmatrix'],
+            'auc': figures['auc'],
+        }
+
+    def page(
+        self,
+        table: str,
+        page_current: int,
+        page_size: int,
+        filter_query: str = ''
+            ) -> tuple:
+        """
+        One page of a table after server-side filtering
+
+        Parameters
+        ---
+        table: str
+            'data_summary' or 'outdated'
+        page_current: int
+            Zero based page index
+        page_size: int
+            Rows per page
+        filter_query: str
+            dash_table filter_query
+
+        Returns
+        ---
+        tuple
+            (records of the page, number of pages)
+        """
+        dff = filter_frame(self.get()[table], filter_query)
+        page_count = max(1, -(-len(dff) // page_size))
+        start = page_current * page_size
+        return dff.iloc[start:start + page_size].to_dict('records'), page_count
@@ -2,25 +2,302 @@
 This script copies the latest pickle file, the latestscore.txt value, and the
 ingestfiles.txt file into the deployment directory
 
+Every deployment is written to its own immutable version directory
+`<prod_deployment_path>/versions/<id>/` and production is switched by
+atomically replacing the `current` symlink. The files in the deployment
+directory itself are symlinks through `current`, so readers such as the
+Flask app never see a half-deployed state, and a rollback is a single
+symlink swap. Every activation is appended to
+`<prod_deployment_path>/activations.json`, and a rollback goes back along
+that history: to the version that was active before the current one, not
+to the version with the previous id.
+
 Author: Derrick Lewis
 Date: 2023-01-28
 """
 import os
+import time
 import json
+import shutil
+import hashlib
 import logging
+import argparse
 
 logger = logging.getLogger(__name__)
 
+ARTIFACTS = ['trainedmodel.pkl', 'latestscore.txt', 'ingestedfiles.json']
+VERSIONS_DIR = 'versions'
+CURRENT_LINK = 'current'
+MANIFEST = 'manifest.json'
+ACTIVATIONS = 'activations.json'
+
+
+def file_digest(path: str) -> str:
+    """
+    sha256 hex digest of a file, read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def atomic_symlink(target: str, link_path: str) -> None:
+    """
+    Point `link_path` at `target`, replacing whatever is there with a
+    single rename so that readers see either the old or the new target
+    """
+    tmp_link = link_path + '.tmp'
+    if os.path.lexists(tmp_link):
+        os.remove(tmp_link)
+    os.symlink(target, tmp_link)
+    os.replace(tmp_link, link_path)
+
+
+def current_version(prod_deployment_path: str) -> str:
+    """
+    Id of the version production currently points to, None before the
+    first versioned deployment
+    """
+    link = os.path.join(prod_deployment_path, CURRENT_LINK)
+    if not os.path.islink(link):
+        return None
+    return os.path.basename(os.readlink(link))
+
+
+def list_versions(prod_deployment_path: str) -> list:
+    """
+    Ids of all registered versions, oldest first
+    """
+    versions_path = os.path.join(prod_deployment_path, VERSIONS_DIR)
+    if not os.path.isdir(versions_path):
+        return []
+    return sorted(
+        name for name in os.listdir(versions_path)
+        if not name.startswith('.')
+        and os.path.isdir(os.path.join(versions_path, name)))
+
+
+def read_manifest(prod_deployment_path: str, version_id: str = None) -> dict:
+    """
+    Manifest (creation time and artifact digests) of a version, the current
+    one by default
+    """
+    version_id = version_id or current_version(prod_deployment_path)
+    if version_id is None:
+        return {}
+    with open(os.path.join(prod_deployment_path, VERSIONS_DIR, version_id,
+                           MANIFEST), 'r', encoding='utf8') as file:
+        return json.load(file)
+
+
+def read_activations(prod_deployment_path: str) -> list:
+    """
+    Activation history of the deployment, oldest first, empty for a
+    deployment made before it was recorded
+    """
+    try:
+        with open(os.path.join(prod_deployment_path, ACTIVATIONS), 'r',
+                  encoding='utf8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return []
+
+
+def record_activation(prod_deployment_path: str, version_id: str,
+                      action: str) -> None:
+    """
+    Append an activation to the history, rewritten atomically so that a
+    crash never leaves half a file
+
+    Parameters
+    ---
+    prod_deployment_path: str
+        Path to the deployment directory
+    version_id: str
+        Id of the activated version
+    action: str
+        'deploy' for a new or explicitly chosen version, 'rollback' for a
+        step back along the history
+    """
+    activations = read_activations(prod_deployment_path)
+    activations.append({'version': version_id, 'action': action,
+                        'activated': time.time()})
+    path = os.path.join(prod_deployment_path, ACTIVATIONS)
+    with open(path + '.tmp', 'w', encoding='utf8') as file:
+        json.dump(activations, file, indent=4)
+    os.replace(path + '.tmp', path)
+
+
+def active_stack(prod_deployment_path: str) -> list:
+    """
+    Versions production went through to reach the current one, oldest
+    first: a deployment pushes its version, a rollback pops back to it.
+    Without a recorded history the versions are taken in id order.
+
+    Returns
+    ---
+    list
+        Version ids, the last one being the current version
+    """
+    activations = read_activations(prod_deployment_path)
+    if not activations:
+        versions = list_versions(prod_deployment_path)
+        current = current_version(prod_deployment_path)
+        return versions[:versions.index(current) + 1] \
+            if current in versions else []
+    stack = []
+    for activation in activations:
+        version = activation['version']
+        if activation['action'] == 'rollback' and version in stack:
+            del stack[stack.index(version) + 1:]
+        else:
+            stack.append(version)
+    current = current_version(prod_deployment_path)
+    if current is not None and (not stack or stack[-1] != current):
+        # activated outside of activate_version
+        stack.append(current)
+    return stack
+
+
+def register_version(
+    sources: dict,
+    prod_deployment_path: str,
+        ) -> str:
+    """
+    Write the artifacts into a new immutable version directory. Artifacts
+    identical to the ones of the current version are hardlinked instead of
+    copied. The directory is built under a temporary name and renamed, so a
+    version is either complete or absent.
+
+    Parameters
+    ---
+    sources: dict
+        Mapping of artifact name to the path of the file to store
+    prod_deployment_path: str
+        Path to the deployment directory
+
+    Returns
+    ---
+    str
+        Id of the new version
+    """
+    digests = {name: file_digest(path) for name, path in sources.items()}
+    version_id = '{}-{}'.format(time.strftime('%Y%m%dT%H%M%S'),
+                                digests['trainedmodel.pkl'][:8])
+    versions_path = os.path.join(prod_deployment_path, VERSIONS_DIR)
+    suffix = 1
+    while os.path.exists(os.path.join(versions_path, version_id)):
+        # zero padded, the ids sort in creation order
+        version_id = f'{version_id.split("_")[0]}_{suffix:03d}'
+        suffix += 1
+    tmp_path = os.path.join(versions_path, '.tmp-' + version_id)
+    os.makedirs(tmp_path)
+
+    previous = current_version(prod_deployment_path)
+    previous_digests = read_manifest(prod_deployment_path, previous).get(
+        'artifacts', {})
+    for name, path in sources.items():
+        destination = os.path.join(tmp_path, name)
+        if previous_digests.get(name) == digests[name]:
+            try:
+                os.link(os.path.join(versions_path, previous, name),
+                        destination)
+                continue
+            except OSError:
+                pass
+        shutil.copyfile(path, destination)
+
+    with open(os.path.join(tmp_path, MANIFEST), 'w', encoding='utf8') as file:
+        json.dump({'version': version_id, 'created': time.time(),
+                   'artifacts': digests}, file, indent=4)
+    os.rename(tmp_path, os.path.join(versions_path, version_id))
+    return version_id
+
+
+def activate_version(prod_deployment_path: str, version_id: str,
+                     action: str = 'deploy') -> None:
+    """
+    Switch production to a registered version with one atomic symlink swap
+    and record the activation
+
+    Parameters
+    ---
+    prod_deployment_path: str
+        Path to the deployment directory
+    version_id: str
+        Id of the version to activate
+    action: str
+        'deploy' or 'rollback', see record_activation
+    """
+    if version_id not in list_versions(prod_deployment_path):
+        raise ValueError(f"Unknown deployment version {version_id}")
+    atomic_symlink(os.path.join(VERSIONS_DIR, version_id),
+                   os.path.join(prod_deployment_path, CURRENT_LINK))
+    # the artifact links resolve through `current`, they only need to be
+    # created once (and replace the files of an unversioned deployment)
+    for name in ARTIFACTS:
+        link = os.path.join(prod_deployment_path, name)
+        if not os.path.islink(link):
+            atomic_symlink(os.path.join(CURRENT_LINK, name), link)
+    record_activation(prod_deployment_path, version_id, action)
+    logger.info("Activated deployment version %s", version_id)
+
+
+def rollback(prod_deployment_path: str, version_id: str = None) -> str:
+    """
+    Point production back to an earlier version, by default the one that
+    was active before the current version. Repeated rollbacks keep going
+    back along the activation history instead of alternating between two
+    versions.
+
+    Parameters
+    ---
+    prod_deployment_path: str
+        Path to the deployment directory
+    version_id: str
+        Id of the version to roll back to
+
+    Returns
+    ---
+    str
+        Id of the now active version
+    """
+    if version_id is None:
+        stack = active_stack(prod_deployment_path)
+        if len(stack) < 2:
+            raise ValueError("No earlier deployment version to roll back to")
+        version_id = stack[-2]
+    activate_version(prod_deployment_path, version_id, action='rollback')
+    return version_id
+
+
+def adopt_unversioned_deployment(prod_deployment_path: str) -> None:
+    """
+    Register the plain files of a deployment made before versioning as the
+    first version, so that it can still be rolled back to
+    """
+    if current_version(prod_deployment_path) is not None:
+        return
+    sources = {name: os.path.join(prod_deployment_path, name)
+               for name in ARTIFACTS}
+    if all(os.path.isfile(path) for path in sources.values()):
+        logger.info("Registering existing deployment as a version")
+        activate_version(prod_deployment_path,
+                         register_version(sources, prod_deployment_path))
+
 
 # Function for deployment
 def store_model_into_pickle(
     output_folder_path: str,
     output_model_path: str,
     prod_deployment_path: str
-        ) -> None:
+        ) -> str:
     """
     Copy the latest pickle file, the latestscore.txt value, and the
-    ingestfiles.txt file into the deployment directory
+    ingestfiles.txt file into a new deployment version and switch production
+    to it
 
     Parameters
     ---
@@ -35,19 +312,22 @@ def store_model_into_pickle(
 
     Returns
     ---
-    None
+    str
+        Id of the deployed version
     """
     logger.info("Storing model into pickle")
+    sources = {
+        'trainedmodel.pkl': os.path.join(output_model_path,
+                                         'trainedmodel.pkl'),
+        'latestscore.txt': os.path.join(output_folder_path,
+                                        'latestscore.txt'),
+        'ingestedfiles.json': os.path.join(output_folder_path,
+                                           'ingestedfiles.json'),
+    }
     try:
-        # Copy the latest pickle file
-        os.system("cp " + output_model_path + "/" + "trainedmodel.pkl "
-                  + prod_deployment_path + "/" + "trainedmodel.pkl")
-        # Copy the latestscore.txt value
-        os.system("cp " + output_folder_path + "/latestscore.txt "
-                  + prod_deployment_path + "/latestscore.txt")
-        # Copy the ingestfiles.txt file
-        os.system("cp " + output_folder_path + "/ingestedfiles.json "
-                  + prod_deployment_path + "/ingestedfiles.json")
+        adopt_unversioned_deployment(prod_deployment_path)
+        version_id = register_version(sources, prod_deployment_path)
+        activate_version(prod_deployment_path, version_id)
     except FileNotFoundError as fnf:
         logger.error(
             "File not found, check config.json: %s", fnf)
@@ -58,8 +338,8 @@ def store_model_into_pickle(
         raise e
     logger.info(
         "Model, latest score, and latest file list stored into \
-prod_deployment_path: %s", prod_deployment_path)
-    return None
+prod_deployment_path: %s, version %s", prod_deployment_path, version_id)
+    return version_id
 
 
 if __name__ == "__main__":
@@ -69,6 +349,14 @@ if __name__ == "__main__":
         filemode='w',
         format='%(name)s - %(levelname)s - %(message)s'
     )
+    parser = argparse.ArgumentParser(description='Deploy the latest model')
+    parser.add_argument('--list', action='store_true',
+                        help='List the deployment versions')
+    parser.add_argument('--rollback', nargs='?', const='', default=None,
+                        metavar='VERSION',
+                        help='Roll back to VERSION, the previous by default')
+    args = parser.parse_args()
+
     # Path variables are stored in config.json
     with open('config.json', 'r', encoding='utf8') as f:
         config = json.load(f)
@@ -77,4 +365,11 @@ if __name__ == "__main__":
     DEPLOYMENT = os.path.join(config['prod_deployment_path'])
     MODEL = os.path.join(config['output_model_path'])
 
-    store_model_into_pickle(OUTPUT, DEPLOYMENT, MODEL)
+    if args.list:
+        CURRENT = current_version(DEPLOYMENT)
+        for version in list_versions(DEPLOYMENT):
+            print(('* ' if version == CURRENT else '  ') + version)
+    elif args.rollback is not None:
+        print(rollback(DEPLOYMENT, args.rollback or None))
+    else:
+        print(store_model_into_pickle(OUTPUT, MODEL, DEPLOYMENT))
@@ -1,23 +1,34 @@
 """
 A collection of functions to check the health of the deployed model
 
+The summary statistics and missing data counts are computed column by
+column from a Parquet copy of finaldata.csv (see columnstats.py), in a
+process pool for wide datasets, with the same output as pandas.
+
 Author: Derrick Lewis
 Date: 2023-01-28
 """
+from __future__ import annotations
 import os
 import json
 import logging
 import timeit
 import subprocess
 import pickle
-import pandas as pd
+from lazy import lazy_import
+
+# imported on first use, so that importing diagnostics is cheap
+pd = lazy_import('pandas')
+features = lazy_import('features')
+columnstats = lazy_import('columnstats')
 
 logger = logging.getLogger(__name__)
 
 # Function to get model predictions
 def model_predictions(
     dff: pd.DataFrame,
-    prod_deployment_path: str
+    prod_deployment_path: str,
+    model=None
         ) -> list:
     """
     read the deployed model and a test dataset, calculate predictions
@@ -28,6 +39,8 @@ def model_predictions(
         A dataframe containing the test data
     prod_deployment_path: str
         Path to the directory containing the deployed model
+    model: sklearn estimator
+        An already loaded model, read from prod_deployment_path if None
 
     Returns
     ---
@@ -41,10 +54,10 @@ def model_predictions(
         logger.error("No data to make predictions on %s", assert_error)
         raise assert_error
     try:
-        model = pickle.load(
-            open(prod_deployment_path + '/trainedmodel.pkl', 'rb'))
-        predictions = model.predict(dff.drop(['corporation', 'exited'],
-                                    axis=1))
+        if model is None:
+            model = pickle.load(
+                open(prod_deployment_path + '/trainedmodel.pkl', 'rb'))
+        predictions = model.predict(dff[features.FEATURE_COLUMNS])
     except Exception as e:
         logger.error("Error getting predictions %s", e)
         raise e
@@ -69,14 +82,10 @@ def dataframe_summary(
         A dict containing all summary statistics
     """
     logger.info("Getting summary statistics")
-    try:
-        dff = pd.read_csv(output_folder_path + '/finaldata.csv')
-    except Exception as e:
-        logger.error("Error reading data %s", e)
-        raise e
     try:
         # Divert from instructions to use dict instead of list
-        summary_stats = dff.describe().to_dict()
+        summary_stats = columnstats.summary_statistics(
+            output_folder_path + '/finaldata.csv')
     except Exception as e:
         logger.error("Error getting summary statistics %s", e)
         raise e
@@ -101,14 +110,10 @@ def missing_data(
         A dict containing all summary statistics
     """
     logger.info("Getting missing data")
-    try:
-        dff = pd.read_csv(output_folder_path + '/finaldata.csv')
-    except Exception as e:
-        logger.error("Error reading data %s", e)
-        raise e
     try:
         # Divert from instructions to use dict instead of list
-        nan_counts = dff.isna().sum().to_dict()
+        nan_counts = columnstats.missing_counts(
+            output_folder_path + '/finaldata.csv')
     except Exception as e:
         logger.error("Error getting summary statistics %s", e)
         raise e
@@ -0,0 +1,177 @@
+"""
+Asynchronous diagnostics jobs for the /diagnostics endpoint of app.py
+
+A diagnostics run (ingestion and training timings, missing data, outdated
+packages) takes many seconds, so the API starts it in a background thread
+and returns a job id to poll. Jobs are kept as json files so that every
+gunicorn worker sees them, whichever worker started the run. There is one
+job per data and model version: a request while a run for the current
+version is queued or running joins it, and a finished result is returned
+until the version changes. The run itself rewrites the ingested data, so
+a finished job is also filed under the version it leaves behind. A queued
+or running job whose worker process is gone is reported as failed.
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import os
+import json
+import time
+import uuid
+import fcntl
+import hashlib
+import logging
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor
+
+logger = logging.getLogger(__name__)
+
+LOCK_FILE = 'jobs.lock'
+# finished jobs kept on disk, the latest ones
+MAX_JOBS = 50
+
+
+def pid_alive(pid: int) -> bool:
+    """
+    True if a process with this pid exists on this host
+    """
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class DiagnosticsJobs:
+    """
+    File backed registry of diagnostics runs
+
+    Parameters
+    ---
+    jobs_dir: str
+        Directory of the job files, shared by the workers
+    run: callable
+        Function without arguments returning the json serializable result
+    version: callable
+        Function returning the current data and model version
+    """
+
+    def __init__(self, jobs_dir: str, run, version):
+        self.jobs_dir = jobs_dir
+        self.run = run
+        self.version = version
+        self._executor = ThreadPoolExecutor(1, thread_name_prefix='diag')
+
+    @contextmanager
+    def _lock(self):
+        os.makedirs(self.jobs_dir, exist_ok=True)
+        with open(os.path.join(self.jobs_dir, LOCK_FILE), 'w',
+                  encoding='utf8') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _path(self, name: str) -> str:
+        return os.path.join(self.jobs_dir, name + '.json')
+
+    @staticmethod
+    def _index(version: str) -> str:
+        return 'version-' + hashlib.sha256(version.encode()).hexdigest()[:16]
+
+    def _read(self, name: str) -> dict:
+        try:
+            with open(self._path(name), 'r', encoding='utf8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, name: str, data: dict) -> None:
+        tmp_path = self._path(name) + f'.tmp-{os.getpid()}'
+        with open(tmp_path, 'w', encoding='utf8') as file:
+            json.dump(data, file)
+        os.replace(tmp_path, self._path(name))
+
+    def submit(self) -> dict:
+        """
+        Start a run for the current version, or return the queued, running
+        or finished job of that version
+
+        Returns
+        ---
+        dict
+            The job: id, status, version and timestamps, with the result
+            once done
+        """
+        version = self.version()
+        index = self._index(version)
+        with self._lock():
+            pointer = self._read(index)
+            job = self._read(pointer['job_id']) if pointer else None
+            if job is not None and (
+                    job['status'] == 'done' or (
+                        job['status'] in ('queued', 'running')
+                        and pid_alive(job['pid']))):
+                return job
+            job = {'id': uuid.uuid4().hex, 'status': 'queued',
+                   'version': version, 'pid': os.getpid(),
+                   'submitted': time.time()}
+            self._write(job['id'], job)
+            self._write(index, {'job_id': job['id']})
+            self._prune()
+        logger.info('Starting diagnostics job %s for version %s', job['id'],
+                    version)
+        self._executor.submit(self._execute, job)
+        return job
+
+    def get(self, job_id: str) -> dict:
+        """
+        The job with this id, None if it does not exist. A queued or
+        running job whose worker process died is marked as failed.
+        """
+        if not all(char in '0123456789abcdef' for char in job_id):
+            return None
+        job = self._read(job_id)
+        if job is None or job['status'] not in ('queued', 'running') \
+                or pid_alive(job['pid']):
+            return job
+        with self._lock():
+            job = self._read(job_id)
+            if job['status'] in ('queued', 'running') \
+                    and not pid_alive(job['pid']):
+                job = dict(job, status='failed', finished=time.time(),
+                           error=f"Worker process {job['pid']} exited")
+                self._write(job_id, job)
+        return job
+
+    def _execute(self, job: dict) -> None:
+        job = dict(job, status='running', started=time.time())
+        self._write(job['id'], job)
+        try:
+            job['result'] = self.run()
+            job['status'] = 'done'
+        except Exception as e:
+            logger.exception('Diagnostics job %s failed: %s', job['id'], e)
+            job['status'] = 'failed'
+            job['error'] = repr(e)
+        job['finished'] = time.time()
+        self._write(job['id'], job)
+        if job['status'] == 'done':
+            version = self.version()
+            if version != job['version']:
+                with self._lock():
+                    self._write(self._index(version), {'job_id': job['id']})
+
+    def _prune(self) -> None:
+        # called with the lock held, removes the oldest job files
+        names = [name for name in os.listdir(self.jobs_dir)
+                 if name.endswith('.json')]
+        if len(names) <= 2 * MAX_JOBS:
+            return
+        names.sort(key=lambda name: os.path.getmtime(
+            os.path.join(self.jobs_dir, name)))
+        for name in names[:-2 * MAX_JOBS]:
+            os.remove(os.path.join(self.jobs_dir, name))
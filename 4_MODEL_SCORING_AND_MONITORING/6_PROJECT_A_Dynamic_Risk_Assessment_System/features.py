@@ -0,0 +1,130 @@
+"""
+Feature preparation shared by training, scoring, diagnostics and reporting
+
+The features and target of a csv file are prepared once and cached as .npy
+files under `<cache_dir>/<file name>-<content digest>/`, X as float32 and y
+as int8 (float labels would make the classifiers predict 0.0/1.0). The rows
+are validated against schema.RISK_SCHEMA like at ingestion. Every consumer
+memory-maps the cached arrays, so in one fullprocess cycle each file is
+parsed once: ingestion primes the cache of finaldata.csv with the frame it
+has just written, training and reporting map it.
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import os
+import shutil
+import hashlib
+import logging
+import numpy as np
+import pandas as pd
+from schema import read_validated
+
+logger = logging.getLogger(__name__)
+
+FEATURE_COLUMNS = ['lastmonth_activity', 'lastyear_activity',
+                   'number_of_employees']
+TARGET = 'exited'
+FEATURES_DIR = 'features'
+
+
+def prepare(dff: pd.DataFrame) -> tuple:
+    """
+    Features and target of a risk dataset frame
+
+    Parameters
+    ---
+    dff: pd.DataFrame
+        Frame with the feature columns and the target
+
+    Returns
+    ---
+    tuple
+        (X float32 array, y int8 array)
+    """
+    X = dff[FEATURE_COLUMNS].to_numpy(dtype=np.float32)
+    y = dff[TARGET].to_numpy(dtype=np.int8)
+    return X, y
+
+
+def feature_frame(X: np.ndarray) -> pd.DataFrame:
+    """
+    Wrap a feature array with the column names the models were fitted with,
+    without copying it
+    """
+    return pd.DataFrame(X, columns=FEATURE_COLUMNS, copy=False)
+
+
+def data_version(csv_path: str) -> str:
+    """
+    Digest of the content of a csv file
+    """
+    digest = hashlib.sha256()
+    with open(csv_path, 'rb') as file:
+        for block in iter(lambda: file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()[:16]
+
+
+def _cache_path(csv_path: str, cache_dir: str, version: str) -> str:
+    return os.path.join(cache_dir,
+                        f'{os.path.basename(csv_path)}-{version}')
+
+
+def write_features(dff: pd.DataFrame, csv_path: str, cache_dir: str) -> str:
+    """
+    Cache the prepared arrays of a frame that was just read from or written
+    to csv_path, replacing older versions of the same file
+
+    Returns
+    ---
+    str
+        Path to the cache directory of this version
+    """
+    path = _cache_path(csv_path, cache_dir, data_version(csv_path))
+    if os.path.isdir(path):
+        return path
+    X, y = prepare(dff)
+    tmp_path = f'{path}.tmp-{os.getpid()}'
+    os.makedirs(tmp_path, exist_ok=True)
+    np.save(os.path.join(tmp_path, 'X.npy'), X)
+    np.save(os.path.join(tmp_path, 'y.npy'), y)
+    try:
+        os.rename(tmp_path, path)
+    except OSError:
+        # another process cached the same version first
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        return path
+    prefix = os.path.basename(csv_path) + '-'
+    for name in os.listdir(cache_dir):
+        if name.startswith(prefix) and name != os.path.basename(path) \
+                and '.tmp-' not in name:
+            shutil.rmtree(os.path.join(cache_dir, name), ignore_errors=True)
+    logger.info('Cached features of %s in %s', csv_path, path)
+    return path
+
+
+def load_features(csv_path: str, cache_dir: str) -> tuple:
+    """
+    Memory-mapped features and target of a csv file, parsed and cached on
+    the first call for each version of the file
+
+    Parameters
+    ---
+    csv_path: str
+        Path to the csv file
+    cache_dir: str
+        Directory of the cached arrays
+
+    Returns
+    ---
+    tuple
+        (X float32 array, y int8 array), read-only memory maps
+    """
+    path = _cache_path(csv_path, cache_dir, data_version(csv_path))
+    if not os.path.isdir(path):
+        # the same validated rows ingestion keeps
+        path = write_features(read_validated(csv_path)[0], csv_path,
+                              cache_dir)
+    return (np.load(os.path.join(path, 'X.npy'), mmap_mode='r'),
+            np.load(os.path.join(path, 'y.npy'), mmap_mode='r'))
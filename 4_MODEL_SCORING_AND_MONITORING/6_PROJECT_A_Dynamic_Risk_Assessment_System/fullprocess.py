@@ -1,97 +1,416 @@
 """
 This script is the main script that runs the entire process.
-It will be scheduled to run on a regular basis.
+It will be scheduled to run on a regular basis, either from cron or as a
+long-running daemon (`python fullprocess.py --daemon`) that watches the
+input folder for new files.
+
+The cycle is a graph of stages (see pipeline.py) with declared input and
+output files: ingestion and the drift check run concurrently, the new
+model is ranked against the deployed one and the previous versions (see
+champion.py) for the record only, since detected drift alone decides the
+deployment, and the API snapshot and the reports run concurrently after
+it. The timing of every stage is kept in logs/fullprocess_state.json and a
+failed cycle is resumed from the failed stage on the next run, at most
+`max_resume_attempts` times and only while no other new files arrived.
+The stage modules are imported lazily (see lazy.py), so a run without new
+files exits before pandas or sklearn are loaded.
 
 Author: Derrick Lewis
 Date: 2023-01-29
 """
-import sys
+from __future__ import annotations
 import os
+import fcntl
 import logging
 import json
 import glob
-from ingestion import merge_multiple_dataframe
-from training import train_model
-from scoring import score_model
+import argparse
+from contextlib import contextmanager
 from deployment import store_model_into_pickle
-from reporting import create_plots
-from apicalls import get_data
-
-# Set up working directory of this file so that cron can run it from anywhere
-path = os.path.dirname(os.path.abspath(__file__))
-os.chdir(path)
-
-logging.basicConfig(
-    filename=os.path.join(os.getcwd() + "/logs/fullprocess.log"),
-    level=logging.INFO,
-    filemode='a',
-    datefmt='%Y-%m-%d %H:%M:%S',
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-
-with open('config.json', 'r', encoding='utf8') as file:
-    config = json.load(file)
-
-DEPLOY_PATH = os.path.join(config['prod_deployment_path'])
-INPUT_PATH = os.path.join(config['input_folder_path'])
-OUTPUT_PATH = os.path.join(config['output_folder_path'])
-OUTPUT_MODEL_PATH = os.path.join(config['output_model_path'])
-TEST_DATA_PATH = os.path.join(config['test_data_path'])
-EXT = config['input_file_extension']
-URL = config['url']
-
-
-# First, read ingestedfiles.json
-with open(
-    os.path.join(DEPLOY_PATH, 'ingestedfiles.json'),
-    'r',
-    encoding="utf8"
-          ) as file:
-    ingestedfiles = json.load(file)
-
-# Second, determine whether the source data folder has new files
-newfiles = glob.glob(f'./{INPUT_PATH}/*.{EXT}')
-
-if len(newfiles) > 0:
+from scorestore import ScoreStore, SCORE_DB, detect_drift
+from pipeline import Stage, StageGraph, load_state, save_state
+from lazy import lazy_import
+
+# imported on first use, the cycle without new files needs none of them
+ingestion = lazy_import('ingestion')
+training = lazy_import('training')
+scoring = lazy_import('scoring')
+reporting = lazy_import('reporting')
+apicalls = lazy_import('apicalls')
+champion = lazy_import('champion')
+features = lazy_import('features')
+
+logger = logging.getLogger(__name__)
+
+LOCK_FILE = os.path.join('logs', 'fullprocess.lock')
+STATE_FILE = os.path.join('logs', 'fullprocess_state.json')
+# runs of a failing cycle, the first one included, before it is given up
+MAX_RESUME_ATTEMPTS = 3
+
+
+def load_config(config_path: str = 'config.json') -> dict:
+    """
+    Load config.json and resolve the path variables used by the process
+
+    Parameters
+    ---
+    config_path: str
+        Path to the config.json file
+
+    Returns
+    ---
+    dict
+        The config values with the folder paths joined for the current os
+    """
+    with open(config_path, 'r', encoding='utf8') as file:
+        config = json.load(file)
+    for key in ['prod_deployment_path', 'input_folder_path',
+                'output_folder_path', 'output_model_path', 'test_data_path']:
+        config[key] = os.path.join(config[key])
+    return config
+
+
+@contextmanager
+def process_lock(lock_path: str = LOCK_FILE, blocking: bool = True):
+    """
+    Hold an exclusive file lock for the duration of one process cycle so
+    that a cron run and the daemon (or two daemons) never overlap
+
+    Parameters
+    ---
+    lock_path: str
+        Path to the lock file, created if missing
+    blocking: bool
+        Wait for the lock if True, otherwise yield False when it is held
+
+    Yields
+    ---
+    bool
+        True if the lock was acquired
+    """
+    os.makedirs(os.path.dirname(lock_path) or '.', exist_ok=True)
+    with open(lock_path, 'w', encoding='utf8') as lock:
+        flags = fcntl.LOCK_EX if blocking else fcntl.LOCK_EX | fcntl.LOCK_NB
+        try:
+            fcntl.flock(lock, flags)
+        except BlockingIOError:
+            logger.info("Another process cycle holds %s, skipping", lock_path)
+            yield False
+            return
+        try:
+            yield True
+        finally:
+            fcntl.flock(lock, fcntl.LOCK_UN)
+
+
+def find_new_files(config: dict) -> list:
+    """
+    Compare the input folder against the deployed ingestedfiles.json
+
+    Parameters
+    ---
+    config: dict
+        Config values as returned by load_config
+
+    Returns
+    ---
+    list
+        Basenames of the input files that have not been ingested yet
+    """
+    with open(
+        os.path.join(config['prod_deployment_path'], 'ingestedfiles.json'),
+        'r',
+        encoding="utf8"
+              ) as file:
+        ingestedfiles = json.load(file)
+
+    ext = config['input_file_extension']
+    newfiles = glob.glob(f"./{config['input_folder_path']}/*.{ext}")
+    if len(newfiles) == 0:
+        logger.info("Zero files in the source data folder with extension %s",
+                    ext)
+        return []
     newfiles = [os.path.basename(file) for file in newfiles]
-    newfiles = [file for file in newfiles if file not in ingestedfiles]
-    if len(newfiles) > 0:
-        logging.info("Found new files: %s", newfiles)
-        df = merge_multiple_dataframe(INPUT_PATH, OUTPUT_PATH, EXT)
-        OUTPUT_DATA_PATH = os.path.join(
-            config['output_folder_path'],
-            'finaldata.csv')
+    return [file for file in newfiles if file not in ingestedfiles]
+
+
+def check_drift(config: dict, newfiles: list) -> bool:
+    """
+    Score the deployed model on the new files and test it for drift against
+    the score history
+
+    Parameters
+    ---
+    config: dict
+        Config values as returned by load_config
+    newfiles: list
+        Basenames of the new input files
+
+    Returns
+    ---
+    bool
+        True if model drift was detected
+    """
+    deploy_path = config['prod_deployment_path']
+    output_path = config['output_folder_path']
+
+    # Read in the score from the deployed model
+    with open(
+        os.path.join(deploy_path, 'latestscore.txt'),
+        'r',
+        encoding="utf8"
+              ) as f1:
+        og_f1_score = float(f1.read())
+
+    # score the deployed model on the rows of the new files only, the
+    # files already scored by this model are read from batchscores.json
+    scored = scoring.score_new_batches(
+        newfiles, config['input_folder_path'], output_path, deploy_path)
+    new_f1_score = scored['f1']
+
+    # the score history holds one score per batch set and model version,
+    # keyed like batchscores.json
+    store = ScoreStore(os.path.join(output_path, SCORE_DB))
+    drift_test = config.get('drift_test', 'latest')
+    if store.has(scored['model_version'], scored['key']):
+        # the history already holds this score, only the deployed score
+        # is an independent baseline
+        logger.info("Batch set %s already recorded, testing against the "
+                    "deployed score", scored['key'])
+        drift_test = 'latest'
+    # test the new score against the score history before recording it
+    drift = detect_drift(store, new_f1_score, og_f1_score, drift_test)
+    store.record(new_f1_score, scored['model_version'], scored['key'])
+
+    if not drift:
+        logger.info("No model drift detected")
+        return False
+    logger.info("Model drift detected")
+    return True
+
+
+def render_reports(
+    output_folder_path: str,
+    output_model_path: str,
+    prod_deployment_path: str,
+    report_worker: reporting.ReportWorker = None
+        ) -> None:
+    """
+    Render the reports of the deployed model on finaldata.csv, on the
+    report worker if given so that its renderer stays warm between cycles
+    """
+    X, y = features.load_features(
+        os.path.join(output_folder_path, 'finaldata.csv'),
+        os.path.join(output_folder_path, features.FEATURES_DIR))
+    dff = features.feature_frame(X).assign(**{features.TARGET: y})
+    if report_worker is None:
+        reporting.create_plots(dff, output_model_path, prod_deployment_path)
     else:
-        logging.info("No new files found")
-        sys.exit()
-else:
-    logging.info("Zero files in the source data folder with extension %s",
-                 EXT)
-    sys.exit()
-
-# Read in the score from the deployed model
-with open(
-    os.path.join(DEPLOY_PATH, 'latestscore.txt'),
-    'r',
-    encoding="utf8"
-          ) as f1:
-    og_f1_score = float(f1.read())
-
-# train the model on the new data and get the f1 score
-new_f1_score = score_model(OUTPUT_PATH, OUTPUT_DATA_PATH, DEPLOY_PATH)
-
-if new_f1_score < og_f1_score:
-    logging.info("Model drift detected")
-    model_drift = True
-
-else:
-    logging.info("No model drift detected")
-    model_drift = False
-    sys.exit()
-
-# Re-deployment
-if model_drift is True:
-    train_model(OUTPUT_PATH, OUTPUT_MODEL_PATH)
-    store_model_into_pickle(OUTPUT_PATH, OUTPUT_MODEL_PATH, DEPLOY_PATH)
-    get_data(OUTPUT_MODEL_PATH, URL)
-    create_plots(df, OUTPUT_MODEL_PATH, DEPLOY_PATH)
+        report_worker.submit(
+            dff, output_model_path, prod_deployment_path).result()
+
+
+def compare_candidates(config: dict) -> int:
+    """
+    Rank the candidate models (see champion.py), logging instead of raising
+    on errors: the ranking is informational and a bad candidate pickle or
+    test file must not stop the deployment of a model that trained fine
+
+    Returns
+    ---
+    int
+        Number of ranked candidates, None if the ranking failed
+    """
+    try:
+        return len(champion.compare_candidates(config))
+    except Exception as e:
+        logger.exception("Could not rank the candidate models: %s", e)
+        return None
+
+
+def build_stages(
+    config: dict,
+    newfiles: list,
+    report_worker: reporting.ReportWorker = None
+        ) -> list:
+    """
+    The stages of one ingest -> score -> retrain -> deploy -> report cycle
+    with the files they read and write
+
+    Parameters
+    ---
+    config: dict
+        Config values as returned by load_config
+    newfiles: list
+        Basenames of the new input files
+    report_worker: ReportWorker
+        Worker the reports are rendered on, in a new process if None
+
+    Returns
+    ---
+    list
+        pipeline.Stage objects
+    """
+    input_path = config['input_folder_path']
+    deploy_path = config['prod_deployment_path']
+    output_path = config['output_folder_path']
+    output_model_path = config['output_model_path']
+    finaldata = os.path.join(output_path, 'finaldata.csv')
+    trained_model = os.path.join(output_model_path, 'trainedmodel.pkl')
+    deployed_model = os.path.join(deploy_path, 'trainedmodel.pkl')
+    testdata = os.path.join(config['test_data_path'], 'testdata.csv')
+    return [
+        Stage('ingest', ingestion.merge_multiple_dataframe,
+              (input_path, output_path, config['input_file_extension']),
+              inputs=[os.path.join(input_path, file) for file in newfiles],
+              outputs=[finaldata,
+                       os.path.join(output_path, 'ingestedfiles.json')]),
+        Stage('check_drift', check_drift, (config, newfiles),
+              inputs=[os.path.join(input_path, file) for file in newfiles],
+              outputs=[os.path.join(output_path, 'latestscore.txt')],
+              gate=True),
+        Stage('train', training.train_model, (output_path, output_model_path),
+              {'out_of_core': config.get('out_of_core_training', False)},
+              inputs=[finaldata], outputs=[trained_model],
+              after=['check_drift']),
+        # ranks the new model against the champion before it is replaced,
+        # for the record only: it never fails and does not gate the deploy
+        Stage('compare', compare_candidates, (config,),
+              inputs=[trained_model, testdata],
+              outputs=[os.path.join(output_path, champion.CANDIDATE_SCORES)]),
+        Stage('deploy', store_model_into_pickle,
+              (output_path, output_model_path, deploy_path),
+              inputs=[trained_model,
+                      os.path.join(output_path, 'latestscore.txt'),
+                      os.path.join(output_path, 'ingestedfiles.json')],
+              outputs=[deployed_model], after=['compare']),
+        Stage('api_snapshot', apicalls.get_data,
+              (output_model_path, config['url']),
+              inputs=[deployed_model],
+              outputs=[os.path.join(output_model_path, 'apireturns.json')]),
+        Stage('report', render_reports,
+              (output_path, output_model_path, deploy_path, report_worker),
+              inputs=[finaldata, deployed_model],
+              outputs=[os.path.join(output_model_path, 'confusionmatrix.png'),
+                       os.path.join(output_model_path, 'auc.png')],
+              in_process=report_worker is not None),
+    ]
+
+
+def run_full_process(
+    config: dict,
+    report_worker: reporting.ReportWorker = None,
+    state_path: str = STATE_FILE
+        ) -> bool:
+    """
+    Run one ingest -> score -> retrain -> deploy -> report cycle, or resume
+    the last one if it failed. A failed cycle is given up after
+    config['max_resume_attempts'] runs, or as soon as the new files differ
+    from its own, and a fresh cycle starts from the current input folder.
+
+    Parameters
+    ---
+    config: dict
+        Config values as returned by load_config
+    report_worker: ReportWorker
+        Worker the reports are rendered on, in a new process if None
+    state_path: str
+        Json file with the state and stage timings of the last cycle
+
+    Returns
+    ---
+    bool
+        True if model drift was detected and the model was re-deployed
+    """
+    previous = load_state(state_path)
+    if previous is not None and previous.get('status') in ('done',
+                                                           'abandoned'):
+        previous = None
+    # First, determine whether the source data folder has new files
+    newfiles = find_new_files(config)
+    attempts = 1
+    if previous is not None:
+        # the new files of a failed cycle may already be deployed as
+        # ingested, so they are taken from the state rather than found again
+        context = previous['context']
+        max_attempts = config.get('max_resume_attempts', MAX_RESUME_ATTEMPTS)
+        if not set(newfiles).issubset(context['newfiles']):
+            reason = f"new input files {sorted(newfiles)}"
+        elif context.get('attempts', 1) >= max_attempts:
+            reason = f"{max_attempts} failed attempts"
+        else:
+            reason = None
+        if reason is None:
+            newfiles = context['newfiles']
+            attempts = context.get('attempts', 1) + 1
+            logger.info("Resuming the failed cycle for files: %s "
+                        "(attempt %d)", newfiles, attempts)
+        else:
+            logger.error("Giving up the failed cycle for files %s after "
+                         "%s", context['newfiles'], reason)
+            save_state(dict(previous, status='abandoned', reason=reason),
+                       state_path)
+            previous = None
+    if previous is None:
+        if len(newfiles) == 0:
+            logger.info("No new files found")
+            return False
+        logger.info("Found new files: %s", newfiles)
+
+    graph = StageGraph(build_stages(config, newfiles, report_worker),
+                       state_path)
+    state = graph.run({'newfiles': newfiles, 'attempts': attempts}, previous)
+    logger.info("Stage timings: %s", {
+        name: round(stage['seconds'], 3)
+        for name, stage in state['stages'].items() if 'seconds' in stage})
+    return state['stages']['deploy']['status'] == 'done'
+
+
+def main() -> None:
+    """
+    Entry point for cron (single cycle) and daemon mode
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument(
+        '--daemon', action='store_true',
+        help='Stay resident and run a cycle whenever new input files arrive')
+    parser.add_argument(
+        '--debounce', type=float, default=2.0,
+        help='Seconds without new file events before a cycle is triggered')
+    parser.add_argument(
+        '--poll-interval', type=float, default=5.0,
+        help='Seconds between scans when inotify is not available')
+    args = parser.parse_args()
+
+    # Set up working directory of this file so that cron can run it from
+    # anywhere
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    os.makedirs('logs', exist_ok=True)
+    logging.basicConfig(
+        filename=os.path.join(os.getcwd(), "logs", "fullprocess.log"),
+        level=logging.INFO,
+        filemode='a',
+        datefmt='%Y-%m-%d %H:%M:%S',
+        format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
+    )
+    config = load_config()
+
+    if args.daemon:
+        # imported here so that the cron path does not pay for it
+        from watcher import run_daemon
+        run_daemon(config, debounce=args.debounce,
+                   poll_interval=args.poll_interval)
+        return
+
+    report_worker = reporting.ReportWorker()
+    try:
+        with process_lock(blocking=False) as acquired:
+            if acquired:
+                run_full_process(config, report_worker)
+    finally:
+        # wait for the queued reports before the interpreter exits
+        report_worker.close()
+
+
+if __name__ == '__main__':
+    main()
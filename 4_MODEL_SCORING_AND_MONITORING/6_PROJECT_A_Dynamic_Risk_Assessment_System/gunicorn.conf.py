@@ -0,0 +1,82 @@
+"""
+Production serving profile for app.py
+
+    gunicorn                      # uses this file from the working directory
+    WORKERS=8 THREADS=2 gunicorn
+
+The app, the deployed model and the data profile are loaded once in the
+master (preload_app) and the workers are forked from it, so their memory is
+shared copy-on-write. gc.freeze() moves the preloaded objects out of the
+garbage collector's reach so that collections in the workers do not touch,
+and therefore copy, those pages. A thread in the master polls the deployment
+(current_version and the deployed pickle) and sends SIGHUP when a new model
+is deployed: gunicorn then reloads the model in the master (on_reload),
+forks fresh workers and gracefully stops the old ones. Ingestion and
+scoring runs only rewrite the score and the training data, which each
+worker refreshes in place (ModelStore.refresh_data).
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import gc
+import os
+import time
+import signal
+import threading
+
+wsgi_app = 'app:server'
+bind = os.environ.get('BIND', '0.0.0.0:8000')
+workers = int(os.environ.get('WORKERS', 4))
+threads = int(os.environ.get('THREADS', 4))
+worker_class = 'gthread'
+preload_app = True
+graceful_timeout = 30
+accesslog = None
+
+# seconds between checks of the deployed model version in the master
+MODEL_POLL_INTERVAL = float(os.environ.get('MODEL_POLL_INTERVAL', 5))
+
+
+def watch_deployment(server, model_store):
+    """
+    Send SIGHUP to the master when the deployed model version changes, not
+    when only the score or the training data changed
+    """
+    while True:
+        time.sleep(MODEL_POLL_INTERVAL)
+        try:
+            changed = model_store.version() != model_store.loaded_version()
+        except Exception as e:
+            server.log.warning('Could not check the model version: %s', e)
+            continue
+        if changed:
+            server.log.info('New model deployed, reloading workers')
+            os.kill(server.pid, signal.SIGHUP)
+
+
+def when_ready(server):
+    """
+    Preload the model in the master and start the deployment watcher
+    """
+    from app import model_store
+    model_store.auto_reload = False
+    model_store.load()
+    gc.freeze()
+    threading.Thread(target=watch_deployment, args=(server, model_store),
+                     name='deployment-watcher', daemon=True).start()
+
+
+def on_reload(server):
+    """
+    Reload the model in the master before the new workers are forked
+    """
+    from app import model_store
+    model_store.load()
+    gc.freeze()
+
+
+def pre_fork(server, worker):
+    """
+    Keep objects created in the master since the last freeze shared
+    """
+    gc.freeze()
@@ -4,6 +4,10 @@ and writes it to a csv file
 
 Data is read from the input folder and written to the output folder
 
+Each file is validated against schema.RISK_SCHEMA as it is read. Rows that
+break the schema are written to <output folder>/quarantine/<file name> with
+the reason, the rest of the file is ingested with its final dtypes.
+
 Authort: Derrick Lewis
 Date: 2023-01-28
 """
@@ -12,9 +16,14 @@ import glob
 import json
 import logging
 import pandas as pd
+from schema import read_validated, empty_frame, REASON_COLUMN
+from features import write_features, FEATURES_DIR
+from columnstats import write_parquet
 
 logger = logging.getLogger(__name__)
 
+QUARANTINE_DIR = 'quarantine'
+
 
 # Function for data ingestion
 def merge_multiple_dataframe(
@@ -42,13 +51,10 @@ def merge_multiple_dataframe(
 
     """
 
-    final_dataframe = pd.DataFrame(
-        columns=["corporation", "lastmonth_activity", "lastyear_activity",
-                 "number_of_employees", "exited"])
-
     # check for datasets, compile them together, and write to an output file
     # check if the input folder is empty
-    result = glob.glob(f'./{input_folder_path}/*.{ext}')
+    # sorted, so that the same files always give the same finaldata.csv
+    result = sorted(glob.glob(f'./{input_folder_path}/*.{ext}'))
     try:
         assert len(result) > 0
     except AssertionError as e:
@@ -56,15 +62,18 @@ def merge_multiple_dataframe(
                      input_folder_path)
         raise e
     logger.info("Found (%i) files in the input folder", len(result))
+    dataframes = [empty_frame()]
     for filename in result:
         logger.info("Reading file: %s", filename)
         try:
-            df = pd.read_csv(filename)
+            df, quarantined = read_validated(filename)
         except Exception as e:
             logger.error("Could not read file: %s due to %s", filename, e)
             raise e
         logger.info("Successfully read file: %s", filename)
-        final_dataframe = pd.concat([final_dataframe, df], axis=0)
+        quarantine_file(quarantined, filename, output_folder_path)
+        dataframes.append(df)
+    final_dataframe = pd.concat(dataframes, axis=0, ignore_index=True)
     try:
         start_len = len(final_dataframe)
         final_dataframe = final_dataframe.drop_duplicates()
@@ -76,6 +85,13 @@ def merge_multiple_dataframe(
     final_dataframe.to_csv("./" + output_folder_path + '/finaldata.csv',
                            index=False)
     logger.info("Successfully wrote output file to %s", output_folder_path)
+    # training and reporting memory-map these instead of parsing the csv
+    write_features(final_dataframe, "./" + output_folder_path +
+                   '/finaldata.csv',
+                   os.path.join(output_folder_path, FEATURES_DIR))
+    # and the diagnostics read the columns they need from this copy
+    write_parquet(final_dataframe, "./" + output_folder_path +
+                  '/finaldata.csv')
 
     # Save ingested file names as a python json file
     logger.info('Saving ingested file names as json file')
@@ -85,6 +101,37 @@ def merge_multiple_dataframe(
     return final_dataframe
 
 
+def quarantine_file(
+    quarantined: pd.DataFrame,
+    filename: str,
+    output_folder_path: str
+        ) -> None:
+    """
+    Write the rows of an input file that failed validation to the
+    quarantine folder, or remove a stale quarantine file of a fixed input
+
+    Parameters
+    ---
+    quarantined: pd.DataFrame
+        Rows as written in the input file, with a quarantine_reason column
+    filename: str
+        Path to the input file
+    output_folder_path: str
+        Path to the folder containing the quarantine folder
+    """
+    path = os.path.join(output_folder_path, QUARANTINE_DIR,
+                        os.path.basename(filename))
+    if len(quarantined) == 0:
+        if os.path.exists(path):
+            os.remove(path)
+        return
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    quarantined.to_csv(path, index=False)
+    logger.warning("Quarantined %i rows of %s to %s, first reason: %s",
+                   len(quarantined), filename, path,
+                   quarantined[REASON_COLUMN].iloc[0])
+
+
 if __name__ == '__main__':
     logging.basicConfig(
         filename="./logs/data_ingestion.log",
@@ -0,0 +1,52 @@
+"""
+Lazy module imports for the entry points
+
+pandas, sklearn, plotly and pyarrow take seconds to import together, while
+the common run of fullprocess.py (no new files) needs none of them.
+lazy_import returns a stand-in that imports the module on the first
+attribute access, so the import cost is paid by the code paths that use
+the module. test_importtime.py checks the import cost of the entry
+points with `python -X importtime`.
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import sys
+import types
+import importlib
+
+
+class LazyModule(types.ModuleType):
+    """
+    Stand-in for a module that imports it on the first attribute access
+
+    The stand-in is not registered in sys.modules, so pickle and later
+    imports resolve the names to the real module.
+    """
+
+    def __getattr__(self, attr: str):
+        module = self.__dict__.get('_module')
+        if module is None:
+            module = self.__dict__['_module'] = importlib.import_module(
+                self.__name__)
+        return getattr(module, attr)
+
+
+def lazy_import(name: str):
+    """
+    Import a module on first use
+
+    Parameters
+    ---
+    name: str
+        Absolute module name, ie. 'pandas' or 'plotly.graph_objects'
+
+    Returns
+    ---
+    module
+        A LazyModule importing the module on the first attribute access,
+        or the module itself when it is already imported
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    return LazyModule(name)
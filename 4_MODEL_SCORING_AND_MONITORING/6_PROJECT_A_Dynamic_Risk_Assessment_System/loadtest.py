@@ -0,0 +1,313 @@
+"""
+Open-loop load test of the API and dashboard served by app.py
+
+Requests are sent at scheduled arrival times (a Poisson process at the
+target rate, or the offsets of a recorded mix) whether or not earlier
+requests have completed, and latency is measured from the scheduled time.
+A closed-loop client only sends when a response came back, so a slow
+server slows the client down and the queueing delay never shows up in the
+percentiles (coordinated omission); here it does.
+
+    python loadtest.py                              # gunicorn on a free port
+    python loadtest.py --rates 20 50 100 --duration 30
+    python loadtest.py --url http://127.0.0.1:8000/ --replay requests.jsonl
+    python loadtest.py --baseline logs/loadtest_baseline.json \\
+        --max-p99-regression 0.25                   # CI, exits 1 on regression
+
+A replay file has one json request per line: {"path": "scoring"} with
+optional "method", "params", "json" and "offset" (seconds from the start;
+without offsets the requests are replayed in order at the target rate).
+The results per rate and endpoint (throughput, error rate, latency
+percentiles) are written as json and as an html summary.
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from html import escape
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import requests
+from benchmark_serving import free_port, start_server
+
+# synthetic mix: endpoint name, method, path, params and weight
+DEFAULT_MIX = [
+    {'name': 'prediction', 'path': 'prediction',
+     'params': {'filepath': 'testdata/testdata.csv'}, 'weight': 4},
+    {'name': 'scoring', 'path': 'scoring', 'weight': 3},
+    {'name': 'summarystats', 'path': 'summarystats', 'weight': 2},
+    {'name': 'dashboard', 'path': 'dashboard/', 'weight': 1},
+]
+PERCENTILES = [50, 90, 99]
+
+
+def load_replay(path: str) -> list:
+    """
+    Read a recorded request mix, one json request per line
+    """
+    mix = []
+    with open(path, 'r', encoding='utf8') as file:
+        for line in file:
+            if line.strip():
+                request = json.loads(line)
+                request.setdefault('name', request['path'].split('?')[0]
+                                   .strip('/') or 'root')
+                mix.append(request)
+    return mix
+
+
+def schedule(mix: list, rate: float, duration: float, seed: int = 0,
+             replay: bool = False) -> list:
+    """
+    Arrival times and requests of one run
+
+    Parameters
+    ---
+    mix: list
+        Request dicts, with a weight for a synthetic mix
+    rate: float
+        Target requests per second
+    duration: float
+        Length of the run in seconds
+    seed: int
+        Seed of the arrivals and of the request choice
+    replay: bool
+        Send the requests of the mix in order, at their offsets if they
+        have one
+
+    Returns
+    ---
+    list
+        (seconds from the start, request) sorted by time
+    """
+    rng = np.random.default_rng(seed)
+    if replay and all('offset' in request for request in mix):
+        # a recorded mix is not always written in arrival order
+        return sorted([(request['offset'], request) for request in mix
+                       if request['offset'] < duration],
+                      key=lambda arrival: arrival[0])
+    # exponential inter-arrival times make a Poisson process
+    count = int(rate * duration * 1.2) + 10
+    times = np.cumsum(rng.exponential(1 / rate, count))
+    times = times[times < duration]
+    if replay:
+        return [(t, mix[i % len(mix)]) for i, t in enumerate(times)]
+    weights = np.array([request.get('weight', 1) for request in mix], float)
+    choices = rng.choice(len(mix), len(times), p=weights / weights.sum())
+    return [(t, mix[i]) for t, i in zip(times, choices)]
+
+
+def run_open_loop(url: str, arrivals: list, max_in_flight: int) -> tuple:
+    """
+    Send the requests at their arrival times from a thread pool
+
+    Returns
+    ---
+    tuple
+        ([(endpoint name, latency in seconds from the scheduled time, ok)],
+        seconds from the start of the run to the last response)
+    """
+    local = threading.local()
+    results = []
+
+    def send(scheduled: float, request: dict):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = requests.Session()
+        try:
+            ok = session.request(
+                request.get('method', 'GET'), url + request['path'],
+                params=request.get('params'), json=request.get('json'),
+                timeout=30).ok
+        except requests.exceptions.RequestException:
+            ok = False
+        results.append((request['name'], time.perf_counter() - scheduled,
+                        ok))
+
+    with ThreadPoolExecutor(max_in_flight) as pool:
+        start = time.perf_counter()
+        for offset, request in arrivals:
+            scheduled = start + offset
+            delay = scheduled - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            # submitted even if every worker is busy: the wait counts
+            pool.submit(send, scheduled, request)
+    # the pool waited for the last response, the server may lag behind
+    return results, time.perf_counter() - start
+
+
+def summarize(results: list, seconds: float) -> dict:
+    """
+    Throughput, error rate and latency percentiles per endpoint and for all
+    requests together
+
+    Parameters
+    ---
+    results: list
+        As returned by run_open_loop
+    seconds: float
+        Measured wall time of the run, longer than the target duration when
+        the server falls behind, so that the throughput is what it served
+    """
+    summary = {}
+    names = sorted({name for name, _, _ in results})
+    for name in names + ['all']:
+        rows = [(lat, ok) for n, lat, ok in results
+                if name == 'all' or n == name]
+        ok_latencies = np.array([lat for lat, ok in rows if ok])
+        stats = {
+            'requests': len(rows),
+            'errors': len(rows) - len(ok_latencies),
+            'error_rate': (len(rows) - len(ok_latencies)) / len(rows),
+            'throughput_rps': len(ok_latencies) / seconds,
+        }
+        for p in PERCENTILES:
+            stats[f'p{p}_ms'] = float(np.percentile(ok_latencies, p) * 1000) \
+                if len(ok_latencies) else None
+        stats['max_ms'] = float(ok_latencies.max() * 1000) \
+            if len(ok_latencies) else None
+        summary[name] = stats
+    return summary
+
+
+def write_html(report: dict, path: str) -> None:
+    """
+    Html summary of the report, one table per target rate
+    """
+    columns = ['requests', 'errors', 'error_rate', 'throughput_rps'] + [
+        f'p{p}_ms' for p in PERCENTILES] + ['max_ms']
+    parts = ['<!DOCTYPE html><html><head><meta charset="utf-8">',
+             '<title>Load test</title><style>body{font-family:sans-serif}',
+             'table{border-collapse:collapse;margin-bottom:2em}',
+             'td,th{border:1px solid #ccc;padding:4px 8px;text-align:right}',
+             '.fail{background:#f8d7da}</style></head><body>',
+             f"<h1>Load test of {escape(report['url'])}</h1>",
+             f"<p>{escape(report['started'])}, open-loop Poisson arrivals,"
+             f" {report['duration']} s per rate</p>"]
+    for run in report['runs']:
+        parts.append(f"<h2>{run['rate']} requests/s target, "
+                     f"{run['seconds']:.1f} s</h2><table><tr>"
+                     '<th>endpoint</th>' + ''.join(
+                         f'<th>{column}</th>' for column in columns)
+                     + '</tr>')
+        for name, stats in run['endpoints'].items():
+            failed = (run['rate'], name) in {
+                (item['rate'], item['endpoint'])
+                for item in report.get('regressions', [])}
+            cells = ''.join(
+                '<td>{}</td>'.format('' if stats[column] is None else
+                                     f'{stats[column]:.4g}')
+                for column in columns)
+            parts.append(f"<tr{' class=fail' if failed else ''}>"
+                         f'<td>{escape(name)}</td>{cells}</tr>')
+        parts.append('</table>')
+    if report.get('regressions'):
+        parts.append('<h2>p99 regressions</h2><ul>' + ''.join(
+            '<li>{endpoint} at {rate}/s: {p99_ms:.1f} ms against '
+            '{baseline_p99_ms:.1f} ms</li>'.format(**item)
+            for item in report['regressions']) + '</ul>')
+    parts.append('</body></html>')
+    with open(path, 'w', encoding='utf8') as file:
+        file.write('\n'.join(parts))
+
+
+def find_regressions(report: dict, baseline: dict, tolerance: float) -> list:
+    """
+    Endpoints whose p99 grew by more than `tolerance` (0.2 is 20%) over the
+    baseline report at the same rate
+    """
+    baseline_runs = {run['rate']: run['endpoints']
+                     for run in baseline['runs']}
+    regressions = []
+    for run in report['runs']:
+        for name, stats in run['endpoints'].items():
+            reference = baseline_runs.get(run['rate'], {}).get(name)
+            if not reference or reference['p99_ms'] is None:
+                continue
+            if stats['p99_ms'] is None \
+                    or stats['p99_ms'] > reference['p99_ms'] * (1 + tolerance):
+                regressions.append({
+                    'rate': run['rate'], 'endpoint': name,
+                    'p99_ms': stats['p99_ms'] or float('inf'),
+                    'baseline_p99_ms': reference['p99_ms']})
+    return regressions
+
+
+def main() -> int:
+    """
+    Run the load test at every rate, write the reports and return the exit
+    code, 1 if a p99 regression was found
+    """
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--url', default=None,
+                        help='Base url of a running server, gunicorn is '
+                        'started on a free port if not given')
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--rates', type=float, nargs='+',
+                        default=[10, 50, 100])
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--replay', default=None,
+                        help='Recorded request mix, one json per line')
+    parser.add_argument('--max-in-flight', type=int, default=256)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', default='logs/loadtest')
+    parser.add_argument('--baseline', default=None,
+                        help='Report to compare the p99 latencies with')
+    parser.add_argument('--max-p99-regression', type=float, default=0.2)
+    args = parser.parse_args()
+
+    os.chdir(os.path.dirname(os.path.abspath(__file__)))
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    mix = load_replay(args.replay) if args.replay else DEFAULT_MIX
+    server = None
+    url = args.url
+    if url is None:
+        port = free_port()
+        server = start_server(port, args.workers, threads=4)
+        url = f'http://127.0.0.1:{port}/'
+    report = {'url': url, 'duration': args.duration,
+              'started': time.strftime('%Y-%m-%d %H:%M:%S'), 'runs': []}
+    try:
+        for rate in args.rates:
+            arrivals = schedule(mix, rate, args.duration, args.seed,
+                                replay=args.replay is not None)
+            results, seconds = run_open_loop(url, arrivals,
+                                             args.max_in_flight)
+            endpoints = summarize(results, seconds)
+            report['runs'].append({'rate': rate, 'seconds': seconds,
+                                   'endpoints': endpoints})
+            stats = endpoints['all']
+            print(f"{rate:>7.1f}/s  {stats['throughput_rps']:7.1f} rps  "
+                  f"errors {stats['error_rate']:6.2%}  "
+                  f"p50 {stats['p50_ms'] or float('nan'):8.2f} ms  "
+                  f"p99 {stats['p99_ms'] or float('nan'):8.2f} ms")
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    exit_code = 0
+    if args.baseline:
+        with open(args.baseline, 'r', encoding='utf8') as file:
+            baseline = json.load(file)
+        report['regressions'] = find_regressions(
+            report, baseline, args.max_p99_regression)
+        for item in report['regressions']:
+            print('p99 regression: {endpoint} at {rate}/s {p99_ms:.1f} ms '
+                  'against {baseline_p99_ms:.1f} ms'.format(**item))
+        exit_code = 1 if report['regressions'] else 0
+
+    with open(args.output + '.json', 'w', encoding='utf8') as file:
+        json.dump(report, file, indent=4)
+    write_html(report, args.output + '.html')
+    return exit_code
+
+
+if __name__ == '__main__':
+    sys.exit(main())
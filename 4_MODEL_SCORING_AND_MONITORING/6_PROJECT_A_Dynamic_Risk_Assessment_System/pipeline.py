@@ -0,0 +1,305 @@
+"""
+Small stage graph executor used by fullprocess.py
+
+Each stage declares the files it reads and writes. A stage depends on the
+stages that write its inputs (and on the stages listed in `after`), stages
+whose dependencies are done run concurrently, in a process pool when more
+than one of them can run at a time. The state of the run, with the timing
+of every stage, is written to a json file after each stage so that a failed
+run can be resumed: stages that finished, whose outputs still exist and
+whose dependencies were not re-run, are not run again.
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import os
+import json
+import time
+import logging
+from concurrent.futures import (ProcessPoolExecutor, ThreadPoolExecutor,
+                                FIRST_COMPLETED, wait)
+
+logger = logging.getLogger(__name__)
+
+
+class Stage:
+    """
+    One step of a stage graph
+
+    Parameters
+    ---
+    name: str
+        Unique name of the stage
+    func: callable
+        Module level function, so that it can run in a process pool
+    args: tuple
+        Positional arguments of func
+    kwargs: dict
+        Keyword arguments of func
+    inputs: list
+        Files read by the stage
+    outputs: list
+        Files written by the stage
+    after: list
+        Names of stages that must finish first without sharing a file
+    gate: bool
+        If the stage returns False the stages depending on it are skipped
+    in_process: bool
+        Run in a thread of this process, for arguments that cannot be
+        pickled such as a ReportWorker
+    """
+
+    def __init__(
+        self,
+        name: str,
+        func,
+        args: tuple = (),
+        kwargs: dict = None,
+        inputs: list = (),
+        outputs: list = (),
+        after: list = (),
+        gate: bool = False,
+        in_process: bool = False
+            ):
+        self.name = name
+        self.func = func
+        self.args = args
+        self.kwargs = kwargs or {}
+        self.inputs = list(inputs)
+        self.outputs = list(outputs)
+        self.after = list(after)
+        self.gate = gate
+        self.in_process = in_process
+
+
+def run_timed(func, args: tuple, kwargs: dict) -> tuple:
+    """
+    Call func and measure it where it runs, so that time spent waiting for
+    a pool worker is not counted
+
+    Returns
+    ---
+    tuple
+        (result, seconds)
+    """
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+
+def load_state(state_path: str) -> dict:
+    """
+    State of the last run, None if there is none
+    """
+    try:
+        with open(state_path, 'r', encoding='utf8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return None
+
+
+def save_state(state: dict, state_path: str) -> None:
+    """
+    Write the state atomically so that a crash never leaves half a file
+    """
+    tmp_path = state_path + '.tmp'
+    with open(tmp_path, 'w', encoding='utf8') as file:
+        json.dump(state, file, indent=4)
+    os.replace(tmp_path, state_path)
+
+
+class StageGraph:
+    """
+    Stages with their dependencies, run in topological order
+
+    Parameters
+    ---
+    stages: list
+        Stage objects
+    state_path: str
+        Json file the run state and timings are written to
+    max_workers: int
+        Size of the process pool
+    """
+
+    def __init__(self, stages: list, state_path: str, max_workers: int = None):
+        self.stages = {stage.name: stage for stage in stages}
+        if len(self.stages) != len(stages):
+            raise ValueError('Stage names must be unique')
+        self.state_path = state_path
+        self.max_workers = max_workers
+        self.dependencies = self._dependencies()
+        self.order = self._topological_order()
+
+    def _dependencies(self) -> dict:
+        writers = {}
+        for stage in self.stages.values():
+            for output in stage.outputs:
+                if output in writers:
+                    raise ValueError(f'{output} is written by both '
+                                     f'{writers[output]} and {stage.name}')
+                writers[output] = stage.name
+        dependencies = {}
+        for stage in self.stages.values():
+            unknown = set(stage.after) - set(self.stages)
+            if unknown:
+                raise ValueError(f'{stage.name} runs after unknown stages '
+                                 f'{sorted(unknown)}')
+            dependencies[stage.name] = {
+                writers[path] for path in stage.inputs if path in writers
+            } | set(stage.after)
+        return dependencies
+
+    def _topological_order(self) -> list:
+        order = []
+        remaining = dict(self.dependencies)
+        while remaining:
+            ready = [name for name, deps in remaining.items()
+                     if deps.issubset(order)]
+            if not ready:
+                raise ValueError(f'Cycle between stages {sorted(remaining)}')
+            order += sorted(ready)
+            for name in ready:
+                del remaining[name]
+        return order
+
+    def descendants(self, name: str) -> set:
+        """
+        Names of all stages that depend on `name`, directly or not
+        """
+        found = set()
+        for other in self.order:
+            if self.dependencies[other] & (found | {name}):
+                found.add(other)
+        return found
+
+    def reusable(self, previous: dict) -> dict:
+        """
+        Stages of a failed run that do not need to run again
+
+        Parameters
+        ---
+        previous: dict
+            State of the failed run
+
+        Returns
+        ---
+        dict
+            Name to the stage state of the previous run
+        """
+        reused = {}
+        stages = (previous or {}).get('stages', {})
+        for name in self.order:
+            stage_state = stages.get(name, {})
+            if stage_state.get('status') in ('done', 'skipped') \
+                    and self.dependencies[name].issubset(reused) \
+                    and all(os.path.exists(path)
+                            for path in self.stages[name].outputs):
+                reused[name] = stage_state
+        return reused
+
+    def run(self, context: dict = None, previous: dict = None) -> dict:
+        """
+        Run the stages, resuming from `previous` if given
+
+        Parameters
+        ---
+        context: dict
+            Json serializable values stored with the state, ie. the input
+            files, to resume with the same ones
+        previous: dict
+            State of a failed run as returned by load_state
+
+        Returns
+        ---
+        dict
+            The state of the run: status and per stage status, result and
+            seconds
+
+        Raises
+        ---
+        Exception
+            The error of the first failed stage, after the state is saved
+        """
+        reused = self.reusable(previous)
+        for name in reused:
+            logger.info('Resuming: stage %s already done', name)
+        state = {'status': 'running', 'context': context or {},
+                 'started': time.time(), 'stages': dict(reused)}
+        save_state(state, self.state_path)
+
+        finished = set(reused)
+        for name, stage_state in reused.items():
+            if stage_state.get('status') == 'skipped' or (
+                    self.stages[name].gate and stage_state.get('result')
+                    is False):
+                finished |= self._skip(state, name)
+        pending = [name for name in self.order if name not in finished]
+        running = {}
+        error = None
+        threads = ThreadPoolExecutor()
+        processes = None
+        try:
+            while pending or running:
+                ready = [name for name in pending
+                         if self.dependencies[name].issubset(finished)]
+                if error is not None:
+                    ready = []
+                for name in ready:
+                    pending.remove(name)
+                    stage = self.stages[name]
+                    # a process is only worth starting when stages overlap
+                    if stage.in_process or len(ready) + len(running) == 1:
+                        pool = threads
+                    else:
+                        if processes is None:
+                            processes = ProcessPoolExecutor(self.max_workers)
+                        pool = processes
+                    logger.info('Starting stage %s', name)
+                    running[pool.submit(run_timed, stage.func, stage.args,
+                                        stage.kwargs)] = name
+                if not running:
+                    break
+                done, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in done:
+                    name = running.pop(future)
+                    try:
+                        result, seconds = future.result()
+                    except Exception as e:
+                        logger.exception('Stage %s failed: %s', name, e)
+                        state['stages'][name] = {'status': 'failed',
+                                                 'error': repr(e)}
+                        error = error or e
+                    else:
+                        logger.info('Stage %s done in %.2fs', name, seconds)
+                        state['stages'][name] = {
+                            'status': 'done', 'seconds': seconds,
+                            'result': result if isinstance(
+                                result, (bool, int, float, str)) else None}
+                        finished.add(name)
+                        if self.stages[name].gate and result is False:
+                            skipped = self._skip(state, name)
+                            finished |= skipped
+                            pending = [n for n in pending
+                                       if n not in skipped]
+                    save_state(state, self.state_path)
+        finally:
+            threads.shutdown()
+            if processes is not None:
+                processes.shutdown()
+
+        state['status'] = 'failed' if error is not None else 'done'
+        state['seconds'] = time.time() - state['started']
+        save_state(state, self.state_path)
+        if error is not None:
+            raise error
+        return state
+
+    def _skip(self, state: dict, name: str) -> set:
+        skipped = self.descendants(name)
+        for other in skipped:
+            state['stages'][other] = {'status': 'skipped'}
+        if skipped:
+            logger.info('Stage %s stopped the run, skipping %s', name,
+                        sorted(skipped))
+        return skipped
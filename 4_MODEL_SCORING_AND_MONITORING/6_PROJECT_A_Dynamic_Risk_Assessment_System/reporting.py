@@ -2,29 +2,117 @@
 This script is used to generate a confusion matrix using the test data
 and the deployed model. The confusion matrix is saved to the workspace
 
+Figures are cached under `<output_folder_path>/reports/<key>/` where the key
+is the deployed model digest plus a hash of the test data, so nothing is
+re-rendered when neither has changed. ReportWorker renders in a background
+thread that keeps the kaleido renderer alive between renders, so the deploy
+path in fullprocess.py does not block on image rendering. The thread, and
+the renderer, start with the first report, and pandas and plotly are
+imported on first use.
+
+The confusion matrix and the ROC curve come from one streaming pass of
+predict_proba over the test data (see evaluation.py), so the ROC is built
+from the scores rather than from the hard 0/1 predictions.
+
 Author: Derrick Lewis
 Date: 2023-01-29
 """
+from __future__ import annotations
 import json
 import os
+import queue
+import pickle
+import shutil
+import hashlib
 import logging
-import pandas as pd
-from sklearn.metrics import confusion_matrix, roc_curve, auc
-import plotly.graph_objects as go
-import plotly.express as px
-from diagnostics import model_predictions
+import threading
+from concurrent.futures import Future
+from deployment import file_digest, read_manifest
+from lazy import lazy_import
+
+# imported on first use, so that importing ReportWorker is cheap
+pd = lazy_import('pandas')
+go = lazy_import('plotly.graph_objects')
+px = lazy_import('plotly.express')
+pio = lazy_import('plotly.io')
+evaluation = lazy_import('evaluation')
 
 logger = logging.getLogger(__name__)
 
+REPORTS_DIR = 'reports'
+# file name -> (figure index, image width, image height)
+REPORT_FILES = {'confusionmatrix': (0, 800, 600), 'auc': (1, 800, 600)}
+# resolution of the score histograms the ROC curve is built from
+ROC_BINS = 1000
+
+
+def report_key(dff: pd.DataFrame, prod_deployment_path: str) -> str:
+    """
+    Cache key of a report: the deployed model digest and the test data hash
+
+    Parameters
+    ---
+    dff: pd.DataFrame
+        A dataframe containing the test data
+    prod_deployment_path: str
+        Path to the directory containing the deployed model
+
+    Returns
+    ---
+    str
+    """
+    model_digest = read_manifest(prod_deployment_path).get(
+        'artifacts', {}).get('trainedmodel.pkl')
+    if model_digest is None:
+        model_digest = file_digest(
+            os.path.join(prod_deployment_path, 'trainedmodel.pkl'))
+    data_digest = hashlib.sha256(
+        pd.util.hash_pandas_object(dff, index=False).values.tobytes()
+        ).hexdigest()
+    return f'{model_digest[:16]}-{data_digest[:16]}-roc{ROC_BINS}'
+
+
+def start_renderer() -> None:
+    """
+    Keep a kaleido renderer running for the process so that every
+    write_image call does not start a new headless browser. kaleido<1.0
+    already keeps its subprocess alive inside plotly.io once started.
+    """
+    try:
+        import kaleido
+    except ImportError:
+        return
+    if hasattr(kaleido, 'start_sync_server'):
+        # a one-off render raises if no browser is available, whereas the
+        # server thread would die silently and block every later render
+        pio.to_image(go.Figure(), format='png', width=10, height=10)
+        kaleido.start_sync_server(silence_warnings=True)
+
+
+def stop_renderer() -> None:
+    """
+    Stop the renderer started by start_renderer
+    """
+    try:
+        import kaleido
+    except ImportError:
+        return
+    if hasattr(kaleido, 'stop_sync_server'):
+        kaleido.stop_sync_server(silence_warnings=True)
+
 
 def create_plots(
     dff: pd.DataFrame,
     output_folder_path: str,
     prod_deployment_path: str
-        ) -> None:
+        ) -> tuple:
     """calculate a confusion matrix using the test data and the deployed model
     #write the confusion matrix to the workspace
 
+    Reuses the cached figures when the deployed model and test data are
+    unchanged, otherwise builds and renders them into the cache. The figures
+    are then copied to output_folder_path.
+
     Parameters
     ---
     dff: pd.DataFrame
@@ -38,29 +126,82 @@ def create_plots(
     ---
     fig: plotly.graph_objects.Figure
         A plotly figure containing the confusion matrix
+    fig: plotly.graph_objects.Figure
+        A plotly figure containing the ROC curve
+
+    """
+    key = report_key(dff, prod_deployment_path)
+    cache_path = os.path.join(output_folder_path, REPORTS_DIR, key)
+    if os.path.isdir(cache_path):
+        logging.info('Reusing cached report %s', key)
+        figures = []
+        for name in REPORT_FILES:
+            with open(os.path.join(cache_path, name + '.json'), 'r') as file:
+                figures.append(pio.from_json(json.load(file)))
+    else:
+        figures = build_figures(dff, prod_deployment_path)
+        tmp_path = cache_path + '.tmp'
+        shutil.rmtree(tmp_path, ignore_errors=True)
+        os.makedirs(tmp_path)
+        for name, (index, width, height) in REPORT_FILES.items():
+            logging.info('Rendering %s', name)
+            figures[index].write_image(
+                os.path.join(tmp_path, name + '.png'),
+                format='png', width=width, height=height)
+            with open(os.path.join(tmp_path, name + '.json'), 'w') as outfile:
+                json.dump(figures[index].to_json(), outfile)
+        os.rename(tmp_path, cache_path)
+
+    for name in REPORT_FILES:
+        for ext in ['.png', '.json']:
+            shutil.copyfile(os.path.join(cache_path, name + ext),
+                            os.path.join(output_folder_path, name + ext))
+    logging.info('Saved confusion matrix and ROC/AUC to %s',
+                 output_folder_path)
+    return figures[0], figures[1]
 
+
+def build_figures(
+    dff: pd.DataFrame,
+    prod_deployment_path: str
+        ) -> list:
+    """
+    Build the confusion matrix and ROC curve figures for the test data and
+    the deployed model
+
+    Parameters
+    ---
+    dff: pd.DataFrame
+        A dataframe containing the test data
+    prod_deployment_path: str
+        Path to the directory containing the deployed model
+
+    Returns
+    ---
+    list
+        The confusion matrix and ROC curve plotly figures
     """
     logging.info('Generating confusion matrix')
     try:
-        preds = model_predictions(
-            dff, prod_deployment_path)
+        with open(os.path.join(prod_deployment_path, 'trainedmodel.pkl'),
+                  'rb') as file:
+            model = pickle.load(file)
+        evaluator = evaluation.evaluate(model, evaluation.iter_chunks(dff),
+                                        ROC_BINS)
     except Exception as e:
         logging.error('Error loading model predictions: %s', e)
         raise e
     logging.info('loaded model predictions')
 
     logging.info('Generating confusion matrix in Plotly')
-    print('dff exited type: ', dff['exited'].dtype)
-    print('preds type: ', preds.dtype)
-
-    y_test = dff['exited'].astype(int)
+    matrix = evaluator.confusion_matrix()
 
     fig_cm = go.Figure()
     fig_cm.add_trace(go.Heatmap(
-        z=confusion_matrix(y_test, preds),
+        z=matrix,
         x=['Predicted Not Exited', 'Predicted Exited'],
         y=['Actual Not Exited', 'Actual Exited'],
-        text=confusion_matrix(y_test, preds),
+        text=matrix,
         texttemplate="%{text}",
         textfont={"size": 20},
         colorscale='YlGnBu')
@@ -71,23 +212,14 @@ def create_plots(
         yaxis_title='Actual'
         )
 
-    logging.info('Saving confusion matrix to %s', output_folder_path)
-    fig_cm.write_image(
-        os.path.join(output_folder_path, 'confusionmatrix.png'),
-        format='png',
-        width=800, height=600)
-
-    with open(f'{output_folder_path}/confusionmatrix.json', 'w') as outfile:
-        json.dump(fig_cm.to_json(), outfile)
-
     logging.info('Finished generating confusion matrix')
     logging.info('Generating ROC Curve')
-    fpr, tpr, thresholds = roc_curve(y_test, preds, pos_label=1)
+    fpr, tpr, thresholds = evaluator.roc_curve()
     fig_auc = px.area(
             x=fpr,
             y=tpr,
             title=f'Logistic Regression<br>\
-                <sub>ROC Curve (AUC={auc(fpr, tpr):.4f})',
+                <sub>ROC Curve (AUC={evaluator.auc():.4f})',
             labels=dict(x='False Positive Rate',
                         y='True Positive Rate'),
             width=600,
@@ -105,17 +237,80 @@ def create_plots(
     fig_auc.update_yaxes(scaleanchor="x", scaleratio=1)
     fig_auc.update_xaxes(constrain='domain')
     logging.info('Created ROC Curve')
+    return [fig_cm, fig_auc]
+
+
+class ReportWorker:
+    """
+    Background thread that renders reports from a queue, one at a time, with
+    the kaleido renderer kept alive between renders
+
+    Usage
+    ---
+    worker = ReportWorker()
+    future = worker.submit(dff, output_folder_path, prod_deployment_path)
+    fig_cm, fig_auc = future.result()
+    worker.close()
+    """
+
+    def __init__(self):
+        self._jobs = queue.Queue()
+        self._thread = None
+        self._thread_lock = threading.Lock()
+
+    def submit(
+        self,
+        dff: pd.DataFrame,
+        output_folder_path: str,
+        prod_deployment_path: str
+            ) -> Future:
+        """
+        Queue a create_plots call and return a Future of its figures
+        """
+        future = Future()
+        with self._thread_lock:
+            if self._thread is None:
+                # started with the first report, a cycle without new files
+                # does not pay for the renderer
+                self._thread = threading.Thread(
+                    target=self._run, name='report-worker', daemon=True)
+                self._thread.start()
+        self._jobs.put(
+            (future, (dff.copy(), output_folder_path, prod_deployment_path)))
+        return future
 
-    # TODO: write json format for dashboard
-    fig_auc.write_image(
-        os.path.join(output_folder_path, 'auc.png'),
-        format='png',
-        width=800, height=600)
+    def close(self, wait: bool = True) -> None:
+        """
+        Stop the worker after the queued reports are rendered
+        """
+        with self._thread_lock:
+            if self._thread is None:
+                return
+        self._jobs.put(None)
+        if wait:
+            self._thread.join()
 
-    with open(f'{output_folder_path}/auc.json', 'w') as outfile:
-        json.dump(fig_auc.to_json(), outfile)
-    logging.info('Saved ROC/AUC to %s', output_folder_path)
-    return fig_cm, fig_auc
+    def _run(self) -> None:
+        try:
+            start_renderer()
+        except Exception as e:
+            logger.warning('Could not start a persistent renderer: %s', e)
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            future, args = job
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                future.set_result(create_plots(*args))
+            except Exception as e:
+                logger.exception('Report rendering failed: %s', e)
+                future.set_exception(e)
+        try:
+            stop_renderer()
+        except Exception as e:
+            logger.warning('Could not stop the renderer: %s', e)
 
 
 if __name__ == '__main__':
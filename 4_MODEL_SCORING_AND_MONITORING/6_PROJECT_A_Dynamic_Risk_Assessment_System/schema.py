@@ -0,0 +1,275 @@
+"""
+Declarative schema of the risk dataset, enforced as each file is read
+
+Files are parsed by pyarrow's csv reader straight into the schema types.
+When a value does not parse, the file is read again with every column as
+text and the integer format is checked with a vectorized regex. Nulls and
+ranges are then checked with Arrow compute kernels. The checks produce one
+boolean mask per rule, so a file is validated in a handful of passes over
+its columns, never row by row. Rows failing any rule are returned apart
+with the reasons and their text as written in the file, to be quarantined
+instead of failing the whole batch, and the valid rows come back with
+their final dtypes so nothing is upcast to object downstream.
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import logging
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+from pyarrow import csv
+
+logger = logging.getLogger(__name__)
+
+# column name -> dtype ('string' or 'int64'), nullable and optional bounds
+RISK_SCHEMA = {
+    'corporation': {'dtype': 'string', 'nullable': False},
+    'lastmonth_activity': {'dtype': 'int64', 'nullable': False, 'min': 0},
+    'lastyear_activity': {'dtype': 'int64', 'nullable': False, 'min': 0},
+    'number_of_employees': {'dtype': 'int64', 'nullable': False, 'min': 0},
+    'exited': {'dtype': 'int64', 'nullable': False, 'min': 0, 'max': 1},
+}
+
+INTEGER_PATTERN = r'^[+-]?[0-9]+$'
+REASON_COLUMN = 'quarantine_reason'
+
+
+def empty_frame(schema: dict = None) -> pd.DataFrame:
+    """
+    An empty dataframe with the columns and dtypes of the schema
+    """
+    schema = schema or RISK_SCHEMA
+    return pd.DataFrame({
+        name: pd.Series(dtype=object if spec['dtype'] == 'string'
+                        else spec['dtype'])
+        for name, spec in schema.items()})
+
+
+def raw_rows(filename: str, column_names: list,
+             rows: np.ndarray) -> pd.DataFrame:
+    """
+    Rows of a csv file with every value as the text in the file
+
+    Parameters
+    ---
+    filename: str
+        Path to the csv file
+    column_names: list
+        Columns of the file, as read by read_validated
+    rows: np.ndarray
+        Boolean mask of the rows to return, over the well formed rows
+
+    Returns
+    ---
+    pd.DataFrame
+        The rows as strings, without null markers such as n/a or NA turned
+        into nulls and without integers turned into floats
+    """
+    table = csv.read_csv(
+        filename,
+        # the malformed rows are skipped as in read_validated
+        parse_options=csv.ParseOptions(
+            invalid_row_handler=lambda row: 'skip'),
+        convert_options=csv.ConvertOptions(
+            column_types={name: pa.string() for name in column_names},
+            null_values=[], strings_can_be_null=False,
+            quoted_strings_can_be_null=False))
+    return table.filter(pa.array(rows)).to_pandas()
+
+
+def check_table(table: pa.Table, schema: dict) -> tuple:
+    """
+    Apply the rules of the schema to the columns of a table
+
+    Parameters
+    ---
+    table: pa.Table
+        Rows as parsed, with the schema types or as strings
+    schema: dict
+        Column name to its rules
+
+    Returns
+    ---
+    tuple
+        (reason of each rule, boolean array rows x rules of the broken
+        rules, column name to its values with the schema type)
+    """
+    reasons = []
+    masks = []
+    columns = {}
+    for name, spec in schema.items():
+        if name not in table.column_names:
+            reasons.append(f'missing column {name}')
+            masks.append(np.ones(table.num_rows, dtype=bool))
+            columns[name] = pa.nulls(table.num_rows, pa.string())
+            continue
+        column = table[name]
+        if pa.types.is_string(column.type):
+            column = pc.utf8_trim_whitespace(column)
+        is_null = pc.is_null(column)
+        if not spec.get('nullable', True):
+            reasons.append(f'{name} is null')
+            masks.append(is_null)
+        if spec['dtype'] == 'int64' and pa.types.is_string(column.type):
+            is_integer = pc.fill_null(
+                pc.match_substring_regex(column, INTEGER_PATTERN), False)
+            reasons.append(f'{name} is not an integer')
+            masks.append(pc.and_(pc.invert(is_null), pc.invert(is_integer)))
+            # only well formed values are cast, the others become null
+            column = pc.cast(pc.if_else(is_integer, column, None), pa.int64())
+        if spec['dtype'] == 'int64':
+            for bound, compare in [('min', pc.less), ('max', pc.greater)]:
+                if bound in spec:
+                    reasons.append(f'{name} out of range')
+                    masks.append(pc.fill_null(
+                        compare(column, spec[bound]), False))
+        columns[name] = column
+
+    masks = np.column_stack([
+        np.asarray(mask.to_numpy(zero_copy_only=False)
+                   if isinstance(mask, (pa.Array, pa.ChunkedArray))
+                   else mask, dtype=bool)
+        for mask in masks]) if masks else np.zeros((table.num_rows, 0), bool)
+    return reasons, masks, columns
+
+
+def valid_rows(columns: dict, bad: np.ndarray, schema: dict) -> pd.DataFrame:
+    """
+    The rows not marked `bad`, with the schema dtypes
+    """
+    dff = pa.table(columns).to_pandas()
+    valid = dff.loc[~bad].reset_index(drop=True)
+    for name, spec in schema.items():
+        if spec['dtype'] != 'string':
+            valid[name] = valid[name].astype(spec['dtype'])
+    return valid
+
+
+def iter_validated(filename: str, chunksize: int, schema: dict = None):
+    """
+    Valid rows of a csv file in chunks, checked with the rules of
+    read_validated, for files that do not fit in memory. The file is
+    streamed as text, since a value that does not parse could only be found
+    after the first chunks were used. Bad rows are counted and logged but
+    not returned, ingestion quarantines them.
+
+    Parameters
+    ---
+    filename: str
+        Path to the csv file
+    chunksize: int
+        Rows read and validated at a time, the valid rows of a chunk are
+        yielded together
+    schema: dict
+        Column name to its rules, RISK_SCHEMA by default
+
+    Yields
+    ---
+    pd.DataFrame
+        Valid rows of a chunk with the schema dtypes
+    """
+    schema = schema or RISK_SCHEMA
+    malformed = 0
+    rejected = 0
+
+    def skip_malformed(row):
+        nonlocal malformed
+        malformed += 1
+        return 'skip'
+
+    reader = csv.open_csv(
+        filename,
+        parse_options=csv.ParseOptions(invalid_row_handler=skip_malformed),
+        convert_options=csv.ConvertOptions(
+            column_types={name: pa.string() for name in schema},
+            strings_can_be_null=True))
+
+    def validate(table):
+        nonlocal rejected
+        _, masks, columns = check_table(table, schema)
+        bad = masks.any(axis=1)
+        rejected += int(bad.sum())
+        return valid_rows(columns, bad, schema)
+
+    pending = None
+    for batch in reader:
+        table = pa.Table.from_batches([batch])
+        if pending is not None:
+            table = pa.concat_tables([pending, table])
+        while table.num_rows >= chunksize:
+            yield validate(table.slice(0, chunksize))
+            table = table.slice(chunksize)
+        pending = table
+    if pending is not None and pending.num_rows:
+        yield validate(pending)
+    if rejected or malformed:
+        logger.warning('Skipped %i invalid and %i malformed rows of %s',
+                       rejected, malformed, filename)
+
+
+def read_validated(filename: str, schema: dict = None) -> tuple:
+    """
+    Read a csv file and split its rows into valid and quarantined ones
+
+    Parameters
+    ---
+    filename: str
+        Path to the csv file
+    schema: dict
+        Column name to its rules, RISK_SCHEMA by default
+
+    Returns
+    ---
+    tuple
+        (valid rows with the schema dtypes, bad rows as raw text with a
+        quarantine_reason column)
+    """
+    schema = schema or RISK_SCHEMA
+    malformed = []
+
+    def skip_malformed(row):
+        # rows with the wrong number of fields, kept for the quarantine
+        malformed.append(row.text)
+        return 'skip'
+
+    parse_options = csv.ParseOptions(invalid_row_handler=skip_malformed)
+    try:
+        # fast path, the usual clean file parses directly into integers
+        table = csv.read_csv(filename, parse_options=parse_options,
+                             convert_options=csv.ConvertOptions(
+                                 column_types={
+                                     name: getattr(pa, spec['dtype'])()
+                                     for name, spec in schema.items()},
+                                 strings_can_be_null=True))
+    except pa.ArrowInvalid:
+        malformed.clear()
+        table = csv.read_csv(filename, parse_options=parse_options,
+                             convert_options=csv.ConvertOptions(
+                                 column_types={name: pa.string()
+                                               for name in schema},
+                                 strings_can_be_null=True))
+
+    extra = [name for name in table.column_names if name not in schema]
+    if extra:
+        logger.warning('Dropping columns %s of %s, not in the schema', extra,
+                       filename)
+    reasons, masks, columns = check_table(table, schema)
+    bad = masks.any(axis=1)
+    valid = valid_rows(columns, bad, schema)
+
+    # the rows as in the file, a clean file is not read again
+    quarantined = raw_rows(filename, table.column_names, bad) if bad.any() \
+        else table.slice(0, 0).to_pandas()
+    quarantined[REASON_COLUMN] = [
+        '; '.join(reason for reason, hit in zip(reasons, row) if hit)
+        for row in masks[bad]]
+    if malformed:
+        quarantined = pd.concat([quarantined, pd.DataFrame({
+            REASON_COLUMN: 'malformed row: ' + pd.Series(malformed)})],
+            ignore_index=True)
+    if len(quarantined):
+        logger.warning('Quarantined %i of %i rows of %s', len(quarantined),
+                       table.num_rows + len(malformed), filename)
+    return valid, quarantined
@@ -0,0 +1,376 @@
+"""
+Append-only history of model scores for drift detection
+
+Scores are stored in SQLite with indexes on model version, dataset batch
+and timestamp. Aggregates per metric (count, mean, variance, min and the
+25th/75th percentiles) are updated incrementally in the same transaction as
+each insert, with Welford's algorithm for the variance and P² estimators
+for the quantiles, so the drift tests of the course's modeldrift.py
+
+    raw:            new score < min(history)
+    parametric:     new score < mean - 2 * std
+    non-parametric: new score < Q1 - 1.5 * IQR
+
+are O(1) lookups instead of scans of the history. A score is recorded
+once per (metric, model version, batch): the batch is the key of the batch
+set in scoring.py's batchscores.json, so a rerun over the same files does
+not weigh the same observation twice.
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import json
+import math
+import time
+import sqlite3
+import logging
+
+logger = logging.getLogger(__name__)
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS scores (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    metric TEXT NOT NULL,
+    score REAL NOT NULL,
+    model_version TEXT NOT NULL,
+    batch TEXT NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_scores_model_version
+    ON scores (model_version);
+CREATE INDEX IF NOT EXISTS idx_scores_batch ON scores (batch);
+CREATE INDEX IF NOT EXISTS idx_scores_recorded_at
+    ON scores (metric, recorded_at);
+CREATE TABLE IF NOT EXISTS aggregates (
+    metric TEXT PRIMARY KEY,
+    n INTEGER NOT NULL,
+    mean REAL NOT NULL,
+    m2 REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    q25 TEXT NOT NULL,
+    q75 TEXT NOT NULL
+);
+"""
+
+SCORE_DB = 'scores.db'
+DRIFT_TESTS = ['raw', 'parametric', 'nonparametric']
+
+
+class P2Quantile:
+    """
+    P² estimator of a quantile in O(1) memory (Jain and Chlamtac, 1985).
+    The first five observations are kept exactly, after that five markers
+    track the minimum, the p/2, p, (1+p)/2 quantiles and the maximum.
+
+    Parameters
+    ---
+    p: float
+        Quantile to estimate, between 0 and 1
+    state: dict
+        State as returned by to_dict, to resume an estimator
+    """
+
+    def __init__(self, p: float, state: dict = None):
+        self.p = p
+        if state is None:
+            self.heights = []
+            self.positions = [0, 1, 2, 3, 4]
+            self.desired = [0, 2 * p, 4 * p, 2 + 2 * p, 4]
+        else:
+            self.heights = state['heights']
+            self.positions = state['positions']
+            self.desired = state['desired']
+        self.increments = [0, p / 2, p, (1 + p) / 2, 1]
+
+    def to_dict(self) -> dict:
+        """
+        JSON serializable state
+        """
+        return {'p': self.p, 'heights': self.heights,
+                'positions': self.positions, 'desired': self.desired}
+
+    def add(self, x: float) -> None:
+        """
+        Update the estimate with one observation
+        """
+        q = self.heights
+        if len(q) < 5:
+            q.append(x)
+            q.sort()
+            return
+        n = self.positions
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = next(i for i in range(4) if q[i] <= x < q[i + 1])
+        for i in range(k + 1, 5):
+            n[i] += 1
+        for i in range(5):
+            self.desired[i] += self.increments[i]
+
+        for i in range(1, 4):
+            d = self.desired[i] - n[i]
+            if (d >= 1 and n[i + 1] - n[i] > 1) \
+                    or (d <= -1 and n[i - 1] - n[i] < -1):
+                d = 1 if d > 0 else -1
+                # piecewise parabolic prediction, linear if not monotone
+                height = q[i] + d / (n[i + 1] - n[i - 1]) * (
+                    (n[i] - n[i - 1] + d) * (q[i + 1] - q[i])
+                    / (n[i + 1] - n[i])
+                    + (n[i + 1] - n[i] - d) * (q[i] - q[i - 1])
+                    / (n[i] - n[i - 1]))
+                if not q[i - 1] < height < q[i + 1]:
+                    height = q[i] + d * (q[i + d] - q[i]) / (n[i + d] - n[i])
+                q[i] = height
+                n[i] += d
+
+    def value(self) -> float:
+        """
+        Current estimate, exact (linear interpolation) for up to five
+        observations
+        """
+        q = self.heights
+        if len(q) == 0:
+            return math.nan
+        if len(q) < 5 or self.positions[4] == 4:
+            rank = self.p * (len(q) - 1)
+            low = math.floor(rank)
+            high = min(low + 1, len(q) - 1)
+            return q[low] + (rank - low) * (q[high] - q[low])
+        return q[2]
+
+
+class ScoreStore:
+    """
+    SQLite backed, append-only score history with incremental aggregates
+
+    Parameters
+    ---
+    db_path: str
+        Path to the SQLite database, created if missing
+    """
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.executescript(SCHEMA)
+
+    def _connect(self) -> sqlite3.Connection:
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        conn.row_factory = sqlite3.Row
+        return conn
+
+    def record(
+        self,
+        score: float,
+        model_version: str,
+        batch: str,
+        metric: str = 'f1',
+        recorded_at: float = None
+            ) -> bool:
+        """
+        Append a score and update the aggregates of its metric, unless the
+        metric is already recorded for this model version and batch
+
+        Parameters
+        ---
+        score: float
+            The score of the model on the batch
+        model_version: str
+            Version of the scored model
+        batch: str
+            Name of the scored dataset batch
+        metric: str
+            Name of the metric, ie. f1
+        recorded_at: float
+            Unix timestamp, now if None
+
+        Returns
+        ---
+        bool
+            False if the score was already recorded
+        """
+        recorded_at = time.time() if recorded_at is None else recorded_at
+        conn = self._connect()
+        try:
+            # take the write lock up front so concurrent writers serialize
+            conn.execute('BEGIN IMMEDIATE')
+            if conn.execute(
+                    'SELECT 1 FROM scores WHERE batch = ? AND metric = ? '
+                    'AND model_version = ?',
+                    (batch, metric, model_version)).fetchone() is not None:
+                conn.rollback()
+                logger.info('%s of model %s on batch %s already recorded',
+                            metric, model_version, batch)
+                return False
+            conn.execute(
+                'INSERT INTO scores (metric, score, model_version, batch, '
+                'recorded_at) VALUES (?, ?, ?, ?, ?)',
+                (metric, score, model_version, batch, recorded_at))
+            row = conn.execute('SELECT * FROM aggregates WHERE metric = ?',
+                               (metric,)).fetchone()
+            if row is None:
+                n, mean, m2, low, high = 0, 0.0, 0.0, score, score
+                q25, q75 = P2Quantile(0.25), P2Quantile(0.75)
+            else:
+                n, mean, m2 = row['n'], row['mean'], row['m2']
+                low, high = min(row['min'], score), max(row['max'], score)
+                q25 = P2Quantile(0.25, json.loads(row['q25']))
+                q75 = P2Quantile(0.75, json.loads(row['q75']))
+            # Welford's online mean and variance
+            n += 1
+            delta = score - mean
+            mean += delta / n
+            m2 += delta * (score - mean)
+            q25.add(score)
+            q75.add(score)
+            conn.execute(
+                'INSERT OR REPLACE INTO aggregates '
+                '(metric, n, mean, m2, min, max, q25, q75) '
+                'VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (metric, n, mean, m2, low, high,
+                 json.dumps(q25.to_dict()), json.dumps(q75.to_dict())))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        finally:
+            conn.close()
+        logger.info('Recorded %s=%s for model %s, batch %s', metric, score,
+                    model_version, batch)
+        return True
+
+    def has(self, model_version: str, batch: str,
+            metric: str = 'f1') -> bool:
+        """
+        True if the metric is recorded for this model version and batch
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute(
+                'SELECT 1 FROM scores WHERE batch = ? AND metric = ? '
+                'AND model_version = ?',
+                (batch, metric, model_version)).fetchone()
+        finally:
+            conn.close()
+        return row is not None
+
+    def aggregates(self, metric: str = 'f1') -> dict:
+        """
+        Aggregates of a metric, empty if nothing was recorded
+
+        Returns
+        ---
+        dict
+            n, mean, std (population, like np.std), min, max, q25, q75, iqr
+        """
+        conn = self._connect()
+        try:
+            row = conn.execute('SELECT * FROM aggregates WHERE metric = ?',
+                               (metric,)).fetchone()
+        finally:
+            conn.close()
+        if row is None:
+            return {}
+        q25 = P2Quantile(0.25, json.loads(row['q25'])).value()
+        q75 = P2Quantile(0.75, json.loads(row['q75'])).value()
+        return {'n': row['n'], 'mean': row['mean'],
+                'std': math.sqrt(row['m2'] / row['n']),
+                'min': row['min'], 'max': row['max'],
+                'q25': q25, 'q75': q75, 'iqr': q75 - q25}
+
+    def drift_tests(self, score: float, metric: str = 'f1') -> dict:
+        """
+        Run the raw, parametric and non-parametric drift tests of a new score
+        against the history. Lower scores are worse.
+
+        Returns
+        ---
+        dict
+            Test name to True if drift is detected, empty without history
+        """
+        stats = self.aggregates(metric)
+        if not stats:
+            return {}
+        return {
+            'raw': score < stats['min'],
+            'parametric': score < stats['mean'] - 2 * stats['std'],
+            'nonparametric': score < stats['q25'] - 1.5 * stats['iqr'],
+        }
+
+    def history(
+        self,
+        metric: str = 'f1',
+        model_version: str = None,
+        batch: str = None,
+        since: float = None
+            ) -> list:
+        """
+        Recorded scores, oldest first, optionally filtered on the indexed
+        model version, batch and timestamp columns
+
+        Returns
+        ---
+        list
+            One dict per recorded score
+        """
+        query = 'SELECT * FROM scores WHERE metric = ?'
+        params = [metric]
+        for column, value, operator in [('model_version', model_version, '='),
+                                        ('batch', batch, '='),
+                                        ('recorded_at', since, '>=')]:
+            if value is not None:
+                query += f' AND {column} {operator} ?'
+                params.append(value)
+        conn = self._connect()
+        try:
+            rows = conn.execute(query + ' ORDER BY recorded_at, id',
+                                params).fetchall()
+        finally:
+            conn.close()
+        return [dict(row) for row in rows]
+
+
+def detect_drift(
+    store: ScoreStore,
+    new_score: float,
+    latest_score: float,
+    drift_test: str = 'latest',
+    metric: str = 'f1'
+        ) -> bool:
+    """
+    Decide whether the model has drifted
+
+    Parameters
+    ---
+    store: ScoreStore
+        The score history
+    new_score: float
+        Score of the deployed model on the new data
+    latest_score: float
+        Score stored with the deployed model
+    drift_test: str
+        'latest' compares with latest_score only, 'raw', 'parametric' or
+        'nonparametric' test against the history and fall back to 'latest'
+        while there is no history
+    metric: str
+        Name of the metric
+
+    Returns
+    ---
+    bool
+        True if drift is detected
+    """
+    if drift_test != 'latest' and drift_test not in DRIFT_TESTS:
+        raise ValueError(f'Unknown drift test {drift_test}')
+    tests = store.drift_tests(new_score, metric) \
+        if drift_test != 'latest' else {}
+    if not tests:
+        return new_score < latest_score
+    logger.info('Drift tests for %s=%s: %s', metric, new_score, tests)
+    return tests[drift_test]
@@ -3,18 +3,30 @@ This script should load a trained model, load test data, and calculate an
 F1 score for the model relative to the test data it should write the result
 to the latestscore.txt file
 
+The drift check in fullprocess.py uses the incremental path
+(score_new_batches) which only scores the rows of newly ingested files and
+keeps running confusion-matrix counts per batch in batchscores.json, so the
+F1 for any window of batches comes from summed counts without re-predicting.
+A batch is recorded once per file content and model version, and the
+running counts start over with each model version.
+
 Author: Derrick Lewis
 Date: 2023-01-28
 """
 import json
 import os
 import pickle
+import hashlib
 import logging
-import pandas as pd
+import numpy as np
 from sklearn import metrics
+from features import load_features, feature_frame, FEATURES_DIR
 
 logger = logging.getLogger(__name__)
 
+BATCH_SCORES_FILE = 'batchscores.json'
+COUNT_KEYS = ['tn', 'fp', 'fn', 'tp']
+
 # Function for model scoring
 def score_model(
     output_folder_path: str,
@@ -43,10 +55,8 @@ def score_model(
     """
     logger.info("Scoring model")
     try:
-        dff = pd.read_csv(test_data_path)
-
-        y = dff.pop('exited')
-        X = dff.drop('corporation', axis=1)
+        X, y = load_features(
+            test_data_path, os.path.join(output_folder_path, FEATURES_DIR))
     except FileNotFoundError as fnf:
         logger.error("File %s/testdata.csv not found, check config.json: %s",
                       test_data_path, fnf)
@@ -56,7 +66,7 @@ def score_model(
         raise e
     model = pickle.load(open(output_model_path + '/trainedmodel.pkl', 'rb'))
 
-    preds = model.predict(X)
+    preds = model.predict(feature_frame(X))
 
     f1 = metrics.f1_score(y, preds)
 
@@ -66,6 +76,254 @@ def score_model(
     return f1
 
 
+def confusion_counts(y: np.ndarray, preds: np.ndarray) -> dict:
+    """
+    Count true/false negatives and positives for binary labels in one pass
+
+    Parameters
+    ---
+    y: np.ndarray
+        True labels, 0 or 1
+    preds: np.ndarray
+        Predicted labels, 0 or 1
+
+    Returns
+    ---
+    dict
+        Counts keyed by 'tn', 'fp', 'fn' and 'tp'
+    """
+    cells = 2 * np.asarray(y, dtype=np.int64) + np.asarray(preds,
+                                                           dtype=np.int64)
+    counts = np.bincount(cells, minlength=4)
+    return dict(zip(COUNT_KEYS, (int(count) for count in counts)))
+
+
+def f1_from_counts(counts: dict) -> float:
+    """
+    F1 score from summed confusion-matrix counts, 0.0 when there are no
+    positives, matching sklearn's zero_division behaviour
+
+    Parameters
+    ---
+    counts: dict
+        Counts keyed by 'tn', 'fp', 'fn' and 'tp'
+
+    Returns
+    ---
+    F1 score: float
+    """
+    denominator = 2 * counts['tp'] + counts['fp'] + counts['fn']
+    if denominator == 0:
+        return 0.0
+    return 2 * counts['tp'] / denominator
+
+
+def file_digest(path: str) -> str:
+    """
+    Short sha256 digest of a file, read in chunks
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def accumulate(batches: list) -> list:
+    """
+    Recompute the cumulative counts of the batch records in place, summed
+    over the earlier records of the same model version only
+
+    Parameters
+    ---
+    batches: list
+        Batch records, oldest first
+
+    Returns
+    ---
+    list
+        The same records
+    """
+    running = {}
+    for batch in batches:
+        total = running.get(batch['model_version'],
+                            dict.fromkeys(COUNT_KEYS, 0))
+        total = {key: total[key] + batch['counts'][key]
+                 for key in COUNT_KEYS}
+        running[batch['model_version']] = batch['cumulative'] = total
+    return batches
+
+
+def batch_set(batches: list, filenames: list, model_version: str) -> dict:
+    """
+    The records of a set of batches scored by one model version, with a
+    key that is the same for the same file contents
+
+    Parameters
+    ---
+    batches: list
+        Batch records as returned by load_batch_scores
+    filenames: list
+        Names of the batches
+    model_version: str
+        Version of the model that scored them
+
+    Returns
+    ---
+    dict
+        'key' (digest of the batch names and contents), 'model_version'
+        and the summed 'counts'
+    """
+    records = {(batch['batch'], batch['model_version']): batch
+               for batch in batches}
+    selected = [records[(name, model_version)] for name in sorted(filenames)]
+    key = hashlib.sha256(','.join(
+        f"{batch['batch']}:{batch['digest']}" for batch in selected
+    ).encode('utf8')).hexdigest()[:12]
+    counts = {key_: sum(batch['counts'][key_] for batch in selected)
+              for key_ in COUNT_KEYS}
+    return {'key': key, 'model_version': model_version, 'counts': counts}
+
+
+def load_batch_scores(output_folder_path: str) -> list:
+    """
+    Read the per batch confusion-matrix counts, oldest batch first
+
+    Parameters
+    ---
+    output_folder_path: str
+        Path to the directory containing batchscores.json
+
+    Returns
+    ---
+    list
+        One dict per batch with the batch counts and the cumulative counts
+    """
+    try:
+        with open(os.path.join(output_folder_path, BATCH_SCORES_FILE), 'r',
+                  encoding='utf8') as file:
+            return json.load(file)
+    except FileNotFoundError:
+        return []
+
+
+def window_f1(
+    batches: list,
+    last_n: int = None,
+    model_version: str = None
+        ) -> float:
+    """
+    F1 score of one model version over its last `last_n` batches (all its
+    batches if None) from the cumulative counts, without re-predicting
+
+    Parameters
+    ---
+    batches: list
+        Batch records as returned by load_batch_scores
+    last_n: int
+        Number of most recent batches in the window, all time if None
+    model_version: str
+        Model version of the window, the one of the last record if None
+
+    Returns
+    ---
+    F1 score: float
+    """
+    if len(batches) == 0:
+        raise ValueError("No scored batches")
+    if model_version is None:
+        model_version = batches[-1]['model_version']
+    batches = [batch for batch in batches
+               if batch['model_version'] == model_version]
+    if len(batches) == 0:
+        raise ValueError(f"No scored batches for model {model_version}")
+    end = batches[-1]['cumulative']
+    if last_n is None or last_n >= len(batches):
+        return f1_from_counts(end)
+    start = batches[-last_n - 1]['cumulative']
+    return f1_from_counts({key: end[key] - start[key] for key in COUNT_KEYS})
+
+
+def score_new_batches(
+    filenames: list,
+    input_folder_path: str,
+    output_folder_path: str,
+    output_model_path: str
+        ) -> dict:
+    """
+    Score the deployed model on the rows of newly ingested files only and
+    keep one confusion-matrix record per file in batchscores.json. A file
+    already recorded with the same content and model version is not scored
+    again, and the record of a file whose content changed is replaced. The
+    F1 over the new batches is written to latestscore.txt like score_model.
+
+    Parameters
+    ---
+    filenames: list
+        Names of the newly ingested files in the input folder
+    input_folder_path: str
+        Path to the folder containing the new files
+    output_folder_path: str
+        Path to the directory for batchscores.json and latestscore.txt
+    output_model_path: str
+        Path to the model pickle file
+
+    Returns
+    ---
+    dict
+        The batch_set of the new files, with their F1 under 'f1'
+    """
+    logger.info("Scoring new batches %s", filenames)
+    with open(output_model_path + '/trainedmodel.pkl', 'rb') as file:
+        model_bytes = file.read()
+    model = pickle.loads(model_bytes)
+    model_version = hashlib.sha256(model_bytes).hexdigest()[:12]
+
+    batches = load_batch_scores(output_folder_path)
+    recorded = {(batch['batch'], batch['model_version']): index
+                for index, batch in enumerate(batches)}
+    changed = False
+    for filename in filenames:
+        path = os.path.join(input_folder_path, filename)
+        digest = file_digest(path)
+        index = recorded.get((filename, model_version))
+        if index is not None and batches[index].get('digest') == digest:
+            # scored by an earlier run that found no drift
+            logger.info("Batch %s already scored by model %s", filename,
+                        model_version)
+        else:
+            try:
+                X, y = load_features(
+                    path, os.path.join(output_folder_path, FEATURES_DIR))
+            except Exception as e:
+                logger.error("Error reading data %s", e)
+                raise e
+            counts = confusion_counts(y, model.predict(feature_frame(X)))
+            record = {'batch': filename, 'digest': digest,
+                      'model_version': model_version, 'rows': len(y),
+                      'counts': counts}
+            if index is None:
+                recorded[(filename, model_version)] = len(batches)
+                batches.append(record)
+            else:
+                batches[index] = record
+            changed = True
+            logger.info("Batch %s: %s", filename, counts)
+
+    if changed:
+        accumulate(batches)
+        with open(os.path.join(output_folder_path, BATCH_SCORES_FILE), 'w',
+                  encoding='utf8') as file:
+            json.dump(batches, file, indent=4)
+
+    scored = batch_set(batches, filenames, model_version)
+    scored['f1'] = f1_from_counts(scored['counts'])
+    with open(output_folder_path + '/latestscore.txt', 'w', encoding='utf8'
+              ) as file:
+        file.write(str(scored['f1']))
+    return scored
+
+
 if __name__ == '__main__':
     logging.basicConfig(
         filename="./logs/scoring.log",
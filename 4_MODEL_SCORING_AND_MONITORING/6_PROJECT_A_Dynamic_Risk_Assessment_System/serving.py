@@ -0,0 +1,270 @@
+"""
+Holder of the deployed model and data profile served by app.py
+
+Under gunicorn (see gunicorn.conf.py) the store is loaded once in the master
+process before the workers are forked, so the model pages are shared
+copy-on-write between workers. The master watches the deployment and
+triggers a graceful reload (SIGHUP) when a new model is deployed. Without
+gunicorn the store loads lazily and reloads itself when the version changes.
+The latest score and the data profile change with every ingestion or
+scoring run, they are refreshed in place by each process without reloading
+the model.
+
+PredictionCache keeps the /prediction responses per input file content and
+model version, so the repeated calls of apicalls.py and the dashboard with
+the same test file do not read and predict again.
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import os
+import time
+import pickle
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from deployment import current_version
+from diagnostics import dataframe_summary
+
+logger = logging.getLogger(__name__)
+
+
+class ModelStore:
+    """
+    Deployed model, latest score and summary statistics of the training data
+
+    Parameters
+    ---
+    prod_deployment_path: str
+        Path to the directory containing the deployed model
+    output_folder_path: str
+        Path to the directory containing finaldata.csv and latestscore.txt
+    auto_reload: bool
+        Reload on the first request after the version changes. Disabled in
+        the gunicorn master, which reloads the workers instead.
+    """
+
+    def __init__(
+        self,
+        prod_deployment_path: str,
+        output_folder_path: str,
+        auto_reload: bool = True
+            ):
+        self.prod_deployment_path = prod_deployment_path
+        self.output_folder_path = output_folder_path
+        self.auto_reload = auto_reload
+        self._lock = threading.Lock()
+        self._state = None
+        self.loads = 0
+        self.load_seconds = None
+
+    @staticmethod
+    def _stamps(paths: list) -> list:
+        parts = []
+        for path in paths:
+            try:
+                parts.append(str(os.stat(path).st_mtime_ns))
+            except FileNotFoundError:
+                parts.append('')
+        return parts
+
+    def version(self) -> str:
+        """
+        Version token of the deployed model
+        """
+        return ':'.join([current_version(self.prod_deployment_path) or '']
+                        + self._stamps([os.path.join(
+                            self.prod_deployment_path, 'trainedmodel.pkl')]))
+
+    def data_version(self) -> str:
+        """
+        Version token of the latest score and the training data
+        """
+        return ':'.join(self._stamps([
+            os.path.join(self.output_folder_path, 'finaldata.csv'),
+            os.path.join(self.output_folder_path, 'latestscore.txt')]))
+
+    def _read_data(self) -> dict:
+        data_version = self.data_version()
+        with open(os.path.join(self.output_folder_path, 'latestscore.txt'),
+                  'r', encoding='utf8') as file:
+            latestscore = file.read()
+        return {
+            'data_version': data_version,
+            'latestscore': latestscore,
+            'summary': dataframe_summary(self.output_folder_path),
+        }
+
+    def load(self) -> dict:
+        """
+        Load the model, score and data profile and swap them in atomically
+
+        Returns
+        ---
+        dict
+            The loaded state
+        """
+        with self._lock:
+            start = time.perf_counter()
+            version = self.version()
+            with open(os.path.join(self.prod_deployment_path,
+                                   'trainedmodel.pkl'), 'rb') as file:
+                model = pickle.load(file)
+            self._state = {
+                'version': version,
+                'model': model,
+                **self._read_data(),
+            }
+            self.loads += 1
+            self.load_seconds = time.perf_counter() - start
+            logger.info('Loaded model version %s in %.3fs', version,
+                        self.load_seconds)
+            return self._state
+
+    def refresh_data(self) -> dict:
+        """
+        Re-read the latest score and the data profile, keeping the model
+
+        Returns
+        ---
+        dict
+            The new state
+        """
+        with self._lock:
+            state = self._state
+            if state['data_version'] != self.data_version():
+                state = self._state = {**state, **self._read_data()}
+                logger.info('Refreshed the score and data profile %s',
+                            state['data_version'])
+            return state
+
+    def loaded_version(self) -> str:
+        """
+        Version of the loaded state, None if nothing is loaded yet
+        """
+        return None if self._state is None else self._state['version']
+
+    def get(self) -> dict:
+        """
+        The loaded state, loading it first if needed
+
+        Returns
+        ---
+        dict
+            version, model, data_version, latestscore and summary
+        """
+        state = self._state
+        if state is None or (self.auto_reload
+                             and state['version'] != self.version()):
+            state = self.load()
+        elif state['data_version'] != self.data_version():
+            state = self.refresh_data()
+        return state
+
+
+class PredictionCache:
+    """
+    LRU cache of prediction responses keyed on the sha256 of the input file
+    and the model version, bounded in entries and in bytes
+
+    The digest of a file is remembered per (path, inode, size, mtime) so a
+    hit costs a stat call and two dict lookups. All entries are dropped as
+    soon as a request sees a new model version.
+
+    Parameters
+    ---
+    max_entries: int
+        Maximum number of cached responses
+    max_bytes: int
+        Maximum total size of the cached responses
+    """
+
+    def __init__(self, max_entries: int = 256, max_bytes: int = 16 * 2**20):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self.nbytes = 0
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._digests = OrderedDict()
+        self._model_version = None
+
+    @staticmethod
+    def _stat_key(filepath: str) -> tuple:
+        stat = os.stat(filepath)
+        return (os.path.abspath(filepath), stat.st_ino, stat.st_size,
+                stat.st_mtime_ns)
+
+    def read(self, filepath: str) -> tuple:
+        """
+        Read a file and remember its digest
+
+        Returns
+        ---
+        tuple
+            (sha256 hex digest, content bytes)
+        """
+        stat_key = self._stat_key(filepath)
+        with open(filepath, 'rb') as file:
+            data = file.read()
+        digest = hashlib.sha256(data).hexdigest()
+        with self._lock:
+            self._digests[stat_key] = digest
+            while len(self._digests) > self.max_entries:
+                self._digests.popitem(last=False)
+        return digest, data
+
+    def get(self, filepath: str, model_version: str):
+        """
+        The cached response for the file and model version, None on a miss
+        """
+        stat_key = self._stat_key(filepath)
+        with self._lock:
+            self._check_version(model_version)
+            digest = self._digests.get(stat_key)
+            value = None if digest is None else self._entries.get(digest)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(digest)
+            self.hits += 1
+            return value
+
+    def put(self, digest: str, model_version: str, value: str) -> None:
+        """
+        Cache a response, evicting the least recently used ones over the
+        bounds. Responses larger than max_bytes are not cached.
+        """
+        size = len(value)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            self._check_version(model_version)
+            old = self._entries.pop(digest, None)
+            if old is not None:
+                self.nbytes -= len(old)
+            self._entries[digest] = value
+            self.nbytes += size
+            while len(self._entries) > self.max_entries \
+                    or self.nbytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= len(evicted)
+
+    def _check_version(self, model_version: str) -> None:
+        # called with the lock held
+        if model_version != self._model_version:
+            if self._entries:
+                logger.info('Model version changed, dropping %s cached '
+                            'predictions', len(self._entries))
+            self._entries.clear()
+            self.nbytes = 0
+            self._model_version = model_version
+
+    def stats(self) -> dict:
+        """
+        hits, misses, entries and bytes of the cache
+        """
+        return {'hits': self.hits, 'misses': self.misses,
+                'entries': len(self._entries), 'bytes': self.nbytes}
@@ -0,0 +1,209 @@
+"""
+Shadow scoring of a candidate model on the live /prediction traffic
+
+A sample of the requests that app.py predicts with the deployed model is
+sent to a background worker process, where the candidate model (by default
+the last trained one in output_model_path) predicts the same rows. The
+agreement with the deployed model's predictions and the candidate's latency
+are recorded and exposed on /shadow and /metrics.
+
+The response never waits for the candidate: sample() only draws the sample
+and submit() queues the feature array, and requests beyond `max_pending`
+queued ones are dropped rather than queued without bound. The candidate
+runs in its own process at the lowest cpu priority (nice 19), so it
+neither holds the GIL of the serving threads nor takes cpu time they need;
+a thread pool in the serving process measurably slowed the primary
+responses. The sample is drawn before the prediction cache is looked up
+and a sampled request is predicted instead of served from the cache, so
+repeated inputs are scored in proportion to the traffic like new ones.
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import os
+import time
+import pickle
+import random
+import logging
+import threading
+import multiprocessing
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+from features import FEATURE_COLUMNS, feature_frame
+
+logger = logging.getLogger(__name__)
+
+# candidate latencies kept for the percentiles, the latest ones
+LATENCY_WINDOW = 10_000
+SHADOW_NICENESS = 19
+
+# candidate model of a shadow worker process, by pickle path
+_candidates = {}
+
+
+def _lower_priority() -> None:
+    # initializer of the shadow worker processes
+    os.nice(SHADOW_NICENESS)
+
+
+def score_candidate(
+    candidate_path: str,
+    X: np.ndarray,
+    primary_preds: np.ndarray
+        ) -> tuple:
+    """
+    Predict rows with the candidate model, loaded once per worker process
+    and again when the pickle changes
+
+    Returns
+    ---
+    tuple
+        (rows, rows where the candidate agrees, seconds to predict)
+    """
+    stat = os.stat(candidate_path)
+    key = (stat.st_ino, stat.st_mtime_ns)
+    cached = _candidates.get(candidate_path)
+    if cached is None or cached[0] != key:
+        with open(candidate_path, 'rb') as file:
+            cached = _candidates[candidate_path] = (key, pickle.load(file))
+    start = time.perf_counter()
+    preds = cached[1].predict(feature_frame(X))
+    seconds = time.perf_counter() - start
+    return len(preds), int(np.sum(np.asarray(preds) == primary_preds)), \
+        seconds
+
+
+class ShadowScorer:
+    """
+    Candidate model scored off the response path
+
+    Parameters
+    ---
+    candidate_path: str
+        Path to the candidate model pickle, reloaded when the file changes
+    sample_rate: float
+        Fraction of the predicted requests scored by the candidate, 0
+        disables the shadow mode
+    max_workers: int
+        Background processes scoring the candidate
+    max_pending: int
+        Requests queued or being scored above which new samples are dropped
+    """
+
+    def __init__(
+        self,
+        candidate_path: str,
+        sample_rate: float = 0.0,
+        max_workers: int = 1,
+        max_pending: int = 32
+            ):
+        self.candidate_path = candidate_path
+        self.sample_rate = sample_rate
+        self.max_workers = max_workers
+        self.max_pending = max_pending
+        self.sampled = 0
+        self.dropped = 0
+        self.errors = 0
+        self.rows = 0
+        self.agreements = 0
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+        self._pending = 0
+        self._lock = threading.Lock()
+        self._executor = None
+        self._pid = None
+
+    def sample(self) -> bool:
+        """
+        Draw whether a request is scored by the candidate, before the
+        prediction cache is looked up
+        """
+        return self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def submit(self, dff, primary_preds) -> bool:
+        """
+        Queue a sampled request for the candidate
+
+        Parameters
+        ---
+        dff: pd.DataFrame
+            The rows the deployed model predicted
+        primary_preds: array-like
+            The predictions of the deployed model
+
+        Returns
+        ---
+        bool
+            True if the request was queued
+        """
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.dropped += 1
+                return False
+            self._pending += 1
+            self.sampled += 1
+            # the pool is created in the process serving requests, it does
+            # not survive the fork of the gunicorn workers
+            if self._executor is None or self._pid != os.getpid():
+                self._executor = ProcessPoolExecutor(
+                    self.max_workers,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    initializer=_lower_priority)
+                self._pid = os.getpid()
+            executor = self._executor
+        try:
+            future = executor.submit(
+                score_candidate, self.candidate_path,
+                dff[FEATURE_COLUMNS].to_numpy(), np.asarray(primary_preds))
+        except Exception as e:
+            # ie. a broken pool after a worker crash, replaced on the next
+            # sample instead of holding a pending slot forever
+            logger.error('Shadow scoring not queued: %s', e)
+            with self._lock:
+                self._pending -= 1
+                self.errors += 1
+                if self._executor is executor:
+                    self._executor = None
+            return False
+        future.add_done_callback(self._record)
+        return True
+
+    def _record(self, future) -> None:
+        with self._lock:
+            self._pending -= 1
+            try:
+                rows, agreements, seconds = future.result()
+            except Exception as e:
+                logger.error('Shadow scoring failed: %s', e)
+                self.errors += 1
+                return
+            self.rows += rows
+            self.agreements += agreements
+            self.latencies.append(seconds)
+
+    def stats(self) -> dict:
+        """
+        Sampled, dropped and failed requests, rows scored, agreement rate
+        with the deployed model and candidate latency percentiles in seconds
+        """
+        with self._lock:
+            latencies = np.array(self.latencies)
+            stats = {'sample_rate': self.sample_rate,
+                     'candidate': self.candidate_path,
+                     'sampled': self.sampled, 'dropped': self.dropped,
+                     'errors': self.errors, 'pending': self._pending,
+                     'rows': self.rows,
+                     'agreement_rate': (self.agreements / self.rows
+                                        if self.rows else None)}
+        for p in [50, 90, 99]:
+            stats[f'latency_p{p}'] = (float(np.percentile(latencies, p))
+                                      if len(latencies) else None)
+        return stats
+
+    def join(self, timeout: float = 10.0) -> None:
+        """
+        Wait until the queued requests are scored, for tests and benchmarks
+        """
+        deadline = time.monotonic() + timeout
+        while self._pending and time.monotonic() < deadline:
+            time.sleep(0.01)
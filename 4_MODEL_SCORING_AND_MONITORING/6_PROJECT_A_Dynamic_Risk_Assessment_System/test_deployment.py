@@ -0,0 +1,64 @@
+"""
+Test of the rollbacks along the activation history of the deployment
+"""
+import os
+import pytest
+import deployment
+
+
+@pytest.fixture
+def deploy(tmp_path):
+    """
+    Deploy a model with the given content, returning its version id
+    """
+    output = tmp_path / 'output'
+    output.mkdir()
+    (output / 'latestscore.txt').write_text('0.5', encoding='utf8')
+    (output / 'ingestedfiles.json').write_text('[]', encoding='utf8')
+    prod = tmp_path / 'prod'
+    prod.mkdir()
+
+    def deploy_model(content):
+        (output / 'trainedmodel.pkl').write_bytes(content)
+        return deployment.store_model_into_pickle(
+            str(output), str(output), str(prod))
+    deploy_model.prod = str(prod)
+    return deploy_model
+
+
+def test_rollback_follows_the_activations(deploy):
+    first = deploy(b'first')
+    second = deploy(b'second')
+    assert deployment.rollback(deploy.prod) == first
+    third = deploy(b'third')
+    # back to the version active before the third, not the previous id
+    assert deployment.rollback(deploy.prod) == first
+    assert deployment.current_version(deploy.prod) == first
+    with pytest.raises(ValueError):
+        deployment.rollback(deploy.prod)
+    assert [activation['version'] for activation in
+            deployment.read_activations(deploy.prod)] == [
+        first, second, first, third, first]
+
+
+def test_repeated_rollbacks_keep_going_back(deploy):
+    versions = [deploy(content) for content in [b'a', b'b', b'c']]
+    assert deployment.rollback(deploy.prod) == versions[1]
+    assert deployment.rollback(deploy.prod) == versions[0]
+
+
+def test_rollback_without_history(deploy):
+    for content in [b'a', b'b', b'c']:
+        deploy(content)
+    # a deployment made before the history falls back to the id order
+    versions = deployment.list_versions(deploy.prod)
+    deployment.activate_version(deploy.prod, versions[-1])
+    os.remove(os.path.join(deploy.prod, deployment.ACTIVATIONS))
+    assert deployment.rollback(deploy.prod) == versions[-2]
+
+
+def test_versions_of_the_same_second_sort_in_order(deploy, monkeypatch):
+    monkeypatch.setattr(deployment.time, 'strftime',
+                        lambda *args: '20230212T120000')
+    versions = [deploy(b'same') for _ in range(12)]
+    assert deployment.list_versions(deploy.prod) == versions
@@ -0,0 +1,60 @@
+"""
+Test of the job registry behind the /diagnostics endpoint
+"""
+import os
+import subprocess
+import sys
+import time
+import pytest
+from diagnostics_jobs import DiagnosticsJobs
+
+
+def wait(jobs, job_id, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while jobs.get(job_id)['status'] in ('queued', 'running'):
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+    return jobs.get(job_id)
+
+
+@pytest.fixture
+def dead_pid():
+    """
+    Pid of a process that has exited
+    """
+    process = subprocess.Popen([sys.executable, '-c', 'pass'])
+    process.wait()
+    return process.pid
+
+
+def test_job_of_a_dead_worker_is_failed(tmp_path, dead_pid):
+    jobs = DiagnosticsJobs(str(tmp_path), dict, lambda: 'v1')
+    jobs._write('0a1b', {'id': '0a1b', 'status': 'running', 'version': 'v1',
+                         'pid': dead_pid, 'submitted': time.time()})
+    job = jobs.get('0a1b')
+    assert job['status'] == 'failed'
+    assert str(dead_pid) in job['error']
+    # persisted, not only reported
+    assert jobs._read('0a1b')['status'] == 'failed'
+
+
+def test_job_of_a_live_worker_is_kept(tmp_path):
+    jobs = DiagnosticsJobs(str(tmp_path), dict, lambda: 'v1')
+    jobs._write('0a1b', {'id': '0a1b', 'status': 'running', 'version': 'v1',
+                         'pid': os.getpid(), 'submitted': time.time()})
+    assert jobs.get('0a1b')['status'] == 'running'
+
+
+def test_run_that_rewrites_its_inputs_is_reused(tmp_path):
+    state = {'version': 'v1'}
+
+    def run():
+        # like ingestion.py rewriting finaldata.csv during the run
+        state['version'] = 'v2'
+        return {'ok': True}
+    jobs = DiagnosticsJobs(str(tmp_path), run, lambda: state['version'])
+    first = jobs.submit()
+    assert wait(jobs, first['id'])['status'] == 'done'
+    assert jobs.submit()['id'] == first['id']
+    state['version'] = 'v3'
+    assert jobs.submit()['id'] != first['id']
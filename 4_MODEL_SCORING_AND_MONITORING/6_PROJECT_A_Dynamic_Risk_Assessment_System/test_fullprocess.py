@@ -0,0 +1,69 @@
+"""
+Test of the resume and give up rules of the full process
+"""
+import json
+import pytest
+import fullprocess
+from pipeline import Stage, StageGraph, load_state
+
+
+def fail():
+    raise RuntimeError('API down')
+
+
+@pytest.fixture
+def config(tmp_path, monkeypatch):
+    """
+    Config with one new input file and a cycle whose only stage fails
+    """
+    for folder in ['sourcedata', 'production_deployment']:
+        (tmp_path / folder).mkdir()
+    (tmp_path / 'sourcedata' / 'dataset1.csv').write_text('a\n')
+    (tmp_path / 'production_deployment' / 'ingestedfiles.json').write_text(
+        json.dumps([]))
+    monkeypatch.setattr(fullprocess, 'build_stages', lambda *args: [
+        Stage('deploy', fail)])
+    # find_new_files globs relative to the working directory
+    monkeypatch.chdir(tmp_path)
+    return {'input_folder_path': 'sourcedata',
+            'prod_deployment_path': 'production_deployment',
+            'input_file_extension': 'csv', 'max_resume_attempts': 2}
+
+
+def run(config, state_path):
+    with pytest.raises(RuntimeError):
+        fullprocess.run_full_process(config, state_path=state_path)
+    return load_state(state_path)['context']
+
+
+def test_resume_is_capped(config, tmp_path):
+    state_path = str(tmp_path / 'state.json')
+    assert run(config, state_path)['attempts'] == 1
+    assert run(config, state_path)['attempts'] == 2
+    # given up, the files are still new so a fresh cycle starts
+    assert run(config, state_path)['attempts'] == 1
+
+
+def test_new_files_start_a_fresh_cycle(config, tmp_path):
+    state_path = str(tmp_path / 'state.json')
+    assert run(config, state_path)['newfiles'] == ['dataset1.csv']
+    (tmp_path / 'sourcedata' / 'dataset2.csv').write_text('a\n')
+    context = run(config, state_path)
+    assert sorted(context['newfiles']) == ['dataset1.csv', 'dataset2.csv']
+    assert context['attempts'] == 1
+
+
+def test_failed_ranking_does_not_block_the_deploy(tmp_path, monkeypatch):
+    def broken(config):
+        raise ValueError('bad candidate pickle')
+    monkeypatch.setattr(fullprocess.champion, 'compare_candidates', broken)
+    deployed = tmp_path / 'deployed'
+    graph = StageGraph([
+        Stage('compare', fullprocess.compare_candidates, ({},),
+              in_process=True),
+        Stage('deploy', deployed.touch, after=['compare'], in_process=True)],
+        str(tmp_path / 'state.json'))
+    stages = graph.run()['stages']
+    assert stages['compare']['status'] == 'done'
+    assert stages['compare']['result'] is None
+    assert deployed.exists()
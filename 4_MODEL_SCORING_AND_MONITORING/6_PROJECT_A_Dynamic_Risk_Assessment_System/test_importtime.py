@@ -0,0 +1,92 @@
+"""
+Import cost regression test of the entry points, with python -X importtime
+"""
+import os
+import sys
+import json
+import time
+import subprocess
+import pytest
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+# cumulative import time of each module, with a wide margin for slow hosts
+BUDGETS_MS = {'fullprocess': 400, 'diagnostics': 200, 'reporting': 300}
+HEAVY_MODULES = ['pandas', 'sklearn', 'plotly', 'kaleido', 'pyarrow',
+                 'scipy']
+NOOP_SECONDS = 1.0
+
+
+def import_times(module):
+    """
+    Cumulative import time in milliseconds of every module imported by
+    `import module` in a fresh interpreter
+    """
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        cwd=PROJECT_DIR, capture_output=True, text=True, check=True)
+    times = {}
+    for line in result.stderr.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, name = line[len('import time:'):].split('|')
+        times[name.strip()] = int(cumulative) / 1000
+    return times
+
+
+@pytest.mark.parametrize('module', sorted(BUDGETS_MS))
+def test_import_budget(module):
+    """
+    The entry point imports within its budget and without the heavy
+    libraries, which are imported on first use
+    """
+    times = import_times(module)
+    heavy = [name for name in times if name.split('.')[0] in HEAVY_MODULES]
+    assert not heavy, f'{module} imports {heavy[:5]} eagerly'
+    assert times[module] < BUDGETS_MS[module], \
+        f'import {module} took {times[module]:.0f} ms'
+
+
+def test_noop_cycle(tmp_path):
+    """
+    A cycle without new files finishes in well under a second, interpreter
+    start included, without loading the heavy libraries
+    """
+    for folder in ['sourcedata', 'ingesteddata', 'models',
+                   'production_deployment', 'testdata']:
+        (tmp_path / folder).mkdir()
+    (tmp_path / 'sourcedata' / 'dataset1.csv').write_text(
+        'corporation,lastmonth_activity,lastyear_activity,'
+        'number_of_employees,exited\nabcd,1,2,3,0\n', encoding='utf8')
+    (tmp_path / 'production_deployment' / 'ingestedfiles.json').write_text(
+        json.dumps(['dataset1.csv']), encoding='utf8')
+    # relative folders, as in config.json: the input folder is globbed
+    # relative to the working directory
+    config = {
+        'input_folder_path': 'sourcedata',
+        'output_folder_path': 'ingesteddata',
+        'test_data_path': 'testdata',
+        'output_model_path': 'models',
+        'prod_deployment_path': 'production_deployment',
+        'input_file_extension': 'csv',
+        'url': 'http://127.0.0.1:8000/',
+    }
+    script = (
+        'import sys, json, logging\n'
+        'sys.path.insert(0, sys.argv[1])\n'
+        'import fullprocess\n'
+        'logging.basicConfig(level=logging.INFO, format="%(message)s")\n'
+        f'config = json.loads({json.dumps(config)!r})\n'
+        'assert fullprocess.run_full_process(config, '
+        'state_path="state.json") is False\n'
+        f'heavy = [name for name in {HEAVY_MODULES!r} '
+        'if name in sys.modules]\n'
+        'assert not heavy, heavy\n')
+    start = time.perf_counter()
+    result = subprocess.run(
+        [sys.executable, '-c', script, PROJECT_DIR],
+        cwd=tmp_path, check=True, capture_output=True, text=True)
+    seconds = time.perf_counter() - start
+    assert seconds < NOOP_SECONDS, f'no-op cycle took {seconds:.2f}s'
+    # dataset1.csv was found in the input folder and skipped as ingested
+    assert 'No new files found' in result.stderr, result.stderr
+    assert 'Zero files' not in result.stderr, result.stderr
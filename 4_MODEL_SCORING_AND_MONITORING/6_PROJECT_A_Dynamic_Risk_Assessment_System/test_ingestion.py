@@ -0,0 +1,40 @@
+"""
+Test of the quarantine of the rows breaking the schema
+"""
+import os
+from schema import read_validated
+from ingestion import quarantine_file, QUARANTINE_DIR
+
+HEADER = ('corporation,lastmonth_activity,lastyear_activity,'
+          'number_of_employees,exited\n')
+
+
+def test_quarantine_keeps_the_raw_text(tmp_path):
+    source = tmp_path / 'dataset.csv'
+    source.write_text(HEADER + 'abcd,1,2,3,0\n'
+                      'efgh,n/a,2,3,0\n'
+                      'ijkl,-5,007,3,1\n'
+                      'mnop,1,2,3\n', encoding='utf8')
+    valid, quarantined = read_validated(str(source))
+    assert valid['corporation'].tolist() == ['abcd']
+
+    quarantine_file(quarantined, str(source), str(tmp_path))
+    with open(os.path.join(tmp_path, QUARANTINE_DIR, 'dataset.csv'), 'r',
+              encoding='utf8') as file:
+        lines = file.read().splitlines()
+    assert lines[1:] == [
+        'efgh,n/a,2,3,0,lastmonth_activity is null',
+        'ijkl,-5,007,3,1,lastmonth_activity out of range',
+        ',,,,,"malformed row: mnop,1,2,3"']
+
+
+def test_clean_file_removes_the_quarantine(tmp_path):
+    source = tmp_path / 'dataset.csv'
+    source.write_text(HEADER + 'abcd,1,2,3,0\n', encoding='utf8')
+    stale = tmp_path / QUARANTINE_DIR / 'dataset.csv'
+    stale.parent.mkdir()
+    stale.write_text('stale', encoding='utf8')
+    _, quarantined = read_validated(str(source))
+    assert len(quarantined) == 0
+    quarantine_file(quarantined, str(source), str(tmp_path))
+    assert not stale.exists()
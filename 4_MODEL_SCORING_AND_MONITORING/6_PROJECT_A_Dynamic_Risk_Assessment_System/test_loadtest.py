@@ -0,0 +1,55 @@
+"""
+Test of the load test schedule and of its throughput against a slow server
+"""
+import time
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import pytest
+from loadtest import schedule, run_open_loop, summarize
+
+# seconds the test server takes per request, one request at a time
+SERVICE_SECONDS = 0.05
+
+
+class SlowHandler(BaseHTTPRequestHandler):
+    """
+    Answers one request at a time after SERVICE_SECONDS
+    """
+    lock = threading.Lock()
+
+    def do_GET(self):
+        with self.lock:
+            time.sleep(SERVICE_SECONDS)
+        self.send_response(200)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def url():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), SlowHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    yield f'http://127.0.0.1:{server.server_port}/'
+    server.shutdown()
+    server.server_close()
+
+
+def test_replay_offsets_are_sorted():
+    mix = [{'name': 'b', 'path': 'b', 'offset': 2.0},
+           {'name': 'a', 'path': 'a', 'offset': 0.5},
+           {'name': 'c', 'path': 'c', 'offset': 9.0}]
+    arrivals = schedule(mix, rate=1, duration=5, replay=True)
+    assert [(offset, request['name']) for offset, request in arrivals] == [
+        (0.5, 'a'), (2.0, 'b')]
+
+
+def test_throughput_of_a_saturated_server(url):
+    # 20 requests at once, served in 20 * SERVICE_SECONDS
+    arrivals = [(0.0, {'name': 'slow', 'path': ''})] * 20
+    results, seconds = run_open_loop(url, arrivals, max_in_flight=20)
+    assert seconds >= 20 * SERVICE_SECONDS
+    throughput = summarize(results, seconds)['all']['throughput_rps']
+    assert throughput <= 1 / SERVICE_SECONDS
@@ -0,0 +1,116 @@
+"""
+Test of the /metrics endpoint after a local load run
+"""
+import os
+import shutil
+import importlib
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from apimetrics import Metrics
+
+ROUTES = ['/scoring', '/summarystats',
+          '/prediction?filepath=testdata/testdata.csv']
+THREADS = 4
+REQUESTS_PER_THREAD = 10
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+# read by the app through the relative paths of config.json
+APP_FOLDERS = ['ingesteddata', 'production_deployment', 'testdata', 'models']
+
+
+@pytest.fixture(scope='module')
+def app(tmp_path_factory):
+    """
+    Import the app in a copy of config.json and of the folders it reads, so
+    that the requests leave the project directory untouched
+    """
+    workdir = tmp_path_factory.mktemp('app')
+    shutil.copy(os.path.join(PROJECT_DIR, 'config.json'), workdir)
+    for folder in APP_FOLDERS:
+        shutil.copytree(os.path.join(PROJECT_DIR, folder), workdir / folder,
+                        symlinks=True)
+    (workdir / 'logs').mkdir()
+    with pytest.MonkeyPatch.context() as monkeypatch:
+        monkeypatch.chdir(workdir)
+        yield importlib.import_module('app')
+
+
+def parse_metrics(text):
+    """
+    Prometheus text format to {'name{labels}': value}
+    """
+    samples = {}
+    for line in text.splitlines():
+        if line and not line.startswith('#'):
+            name, value = line.rsplit(' ', 1)
+            samples[name] = float(value)
+    return samples
+
+
+def load_run(server):
+    """
+    Send every route REQUESTS_PER_THREAD times from THREADS threads
+    """
+    def worker(_):
+        client = server.test_client()
+        for _ in range(REQUESTS_PER_THREAD):
+            for route in ROUTES:
+                assert client.get(route).status_code == 200
+
+    with ThreadPoolExecutor(THREADS) as pool:
+        list(pool.map(worker, range(THREADS)))
+
+
+def test_metrics_after_load(app):
+    before = parse_metrics(
+        app.server.test_client().get('/metrics').get_data(as_text=True))
+    load_run(app.server)
+    r = app.server.test_client().get('/metrics')
+    assert r.status_code == 200
+    assert r.mimetype == 'text/plain'
+    samples = parse_metrics(r.get_data(as_text=True))
+
+    expected = THREADS * REQUESTS_PER_THREAD
+    for route in ['/scoring', '/summarystats', '/prediction']:
+        key = (f'api_requests_total{{route="{route}",method="GET",'
+               f'status="200"}}')
+        assert samples[key] - before.get(key, 0) == expected
+        count = f'api_request_duration_seconds_count{{route="{route}"}}'
+        assert samples[count] - before.get(count, 0) == expected
+        inf = (f'api_request_duration_seconds_bucket{{route="{route}",'
+               f'le="+Inf"}}')
+        assert samples[inf] == samples[count]
+        total = f'api_request_duration_seconds_sum{{route="{route}"}}'
+        assert samples[total] > 0
+        assert samples[f'api_response_size_bytes_count{{route="{route}"}}'] \
+            == samples[count]
+        # every request of the load run has finished
+        assert samples[f'api_requests_in_flight{{route="{route}"}}'] == 0
+    # the scrape itself is being served
+    assert samples['api_requests_in_flight{route="/metrics"}'] == 1
+    assert samples['model_load_count'] >= 1
+    assert samples['model_load_seconds'] > 0
+
+
+def test_metrics_unmatched_route(app):
+    client = app.server.test_client()
+    assert client.get('/wrong_url').status_code == 404
+    samples = parse_metrics(client.get('/metrics').get_data(as_text=True))
+    assert samples[
+        'api_requests_total{route="unmatched",method="GET",status="404"}'] >= 1
+
+
+def test_finished_thread_shards_are_folded():
+    metrics = Metrics()
+    labels = (('route', '/scoring'),)
+    # one thread per request, like the threaded werkzeug server
+    for _ in range(200):
+        thread = threading.Thread(
+            target=metrics.observe,
+            args=('api_request_duration_seconds', labels, 0.01))
+        thread.start()
+        thread.join()
+    totals = metrics.collect()
+    assert len(metrics._shards) <= 1
+    state = totals[('api_request_duration_seconds', labels)]
+    assert sum(state[:-1]) == 200
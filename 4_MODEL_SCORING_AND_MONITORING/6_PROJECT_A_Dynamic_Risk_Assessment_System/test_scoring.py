@@ -0,0 +1,83 @@
+"""
+Test of the batch records of the incremental scoring
+"""
+import os
+import shutil
+import pickle
+import pytest
+import scoring
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def folders(tmp_path):
+    """
+    Input, output and model folders with two source files and a model
+    """
+    for folder in ['input', 'output', 'model']:
+        (tmp_path / folder).mkdir()
+    for name in ['dataset3.csv', 'dataset4.csv']:
+        shutil.copy(os.path.join(PROJECT_DIR, 'sourcedata', name),
+                    tmp_path / 'input' / name)
+    shutil.copy(os.path.join(PROJECT_DIR, 'practicemodels',
+                             'trainedmodel.pkl'),
+                tmp_path / 'model' / 'trainedmodel.pkl')
+    return [str(tmp_path / folder) for folder in ['input', 'output', 'model']]
+
+
+def test_rescoring_is_idempotent(folders):
+    files = ['dataset3.csv', 'dataset4.csv']
+    scored = scoring.score_new_batches(files, *folders)
+    batches = scoring.load_batch_scores(folders[1])
+    assert scoring.score_new_batches(files, *folders) == scored
+    assert scoring.load_batch_scores(folders[1]) == batches
+    assert len(batches) == 2
+    assert batches[-1]['cumulative'] == {
+        key: batches[0]['counts'][key] + batches[1]['counts'][key]
+        for key in scoring.COUNT_KEYS}
+
+
+def test_changed_file_is_replaced(folders):
+    scoring.score_new_batches(['dataset3.csv'], *folders)
+    path = os.path.join(folders[0], 'dataset3.csv')
+    with open(path, 'r', encoding='utf8') as file:
+        lines = file.read().splitlines()
+    with open(path, 'w', encoding='utf8') as file:
+        file.write('\n'.join(lines[:-1]) + '\n')
+    scoring.score_new_batches(['dataset3.csv'], *folders)
+    batches = scoring.load_batch_scores(folders[1])
+    assert len(batches) == 1
+    assert batches[0]['rows'] == len(lines) - 2
+
+
+def test_cumulative_restarts_per_model_version(folders):
+    input_path, output_path, model_path = folders
+    scoring.score_new_batches(['dataset3.csv'], *folders)
+    # an equivalent model with other bytes is a new version
+    with open(os.path.join(model_path, 'trainedmodel.pkl'), 'rb') as file:
+        model = pickle.load(file)
+    model.tol = model.tol * 2
+    with open(os.path.join(model_path, 'trainedmodel.pkl'), 'wb') as file:
+        pickle.dump(model, file)
+    scoring.score_new_batches(['dataset3.csv', 'dataset4.csv'], *folders)
+    batches = scoring.load_batch_scores(output_path)
+    assert len(batches) == 3
+    assert batches[1]['model_version'] != batches[0]['model_version']
+    assert batches[1]['cumulative'] == batches[1]['counts']
+    assert scoring.window_f1(batches, 1) == scoring.f1_from_counts(
+        batches[2]['counts'])
+    assert scoring.window_f1(
+        batches, model_version=batches[0]['model_version']) == \
+        scoring.f1_from_counts(batches[0]['counts'])
+
+
+def test_score_history_records_a_batch_set_once(folders):
+    from scorestore import ScoreStore
+    store = ScoreStore(os.path.join(folders[1], 'scores.db'))
+    for _ in range(3):
+        scored = scoring.score_new_batches(['dataset3.csv'], *folders)
+        store.record(scored['f1'], scored['model_version'], scored['key'])
+    assert len(store.history()) == 1
+    assert store.aggregates()['n'] == 1
+    assert store.has(scored['model_version'], scored['key'])
@@ -0,0 +1,45 @@
+"""
+Test of the model and data versions of the ModelStore
+"""
+import os
+import shutil
+import pytest
+from serving import ModelStore
+
+PROJECT_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+@pytest.fixture
+def store(tmp_path):
+    """
+    Store over a deployment folder and an output folder
+    """
+    for folder in ['deploy', 'output']:
+        (tmp_path / folder).mkdir()
+    shutil.copy(os.path.join(PROJECT_DIR, 'practicemodels',
+                             'trainedmodel.pkl'), tmp_path / 'deploy')
+    shutil.copy(os.path.join(PROJECT_DIR, 'ingesteddata', 'finaldata.csv'),
+                tmp_path / 'output')
+    (tmp_path / 'output' / 'latestscore.txt').write_text('0.5')
+    return ModelStore(str(tmp_path / 'deploy'), str(tmp_path / 'output'),
+                      auto_reload=False)
+
+
+def test_score_change_keeps_the_model(store, tmp_path):
+    state = store.get()
+    version = store.version()
+    path = tmp_path / 'output' / 'latestscore.txt'
+    path.write_text('0.75')
+    os.utime(path, ns=(1, 1))
+    # the deployment watcher sees no new model
+    assert store.version() == version == store.loaded_version()
+    refreshed = store.get()
+    assert refreshed['latestscore'] == '0.75'
+    assert refreshed['model'] is state['model']
+    assert store.loads == 1
+
+
+def test_deploy_changes_the_version(store, tmp_path):
+    store.get()
+    os.utime(tmp_path / 'deploy' / 'trainedmodel.pkl', ns=(1, 1))
+    assert store.version() != store.loaded_version()
@@ -0,0 +1,36 @@
+"""
+Test of the pending count of the shadow scorer when queueing fails
+"""
+from concurrent.futures.process import BrokenProcessPool
+import pandas as pd
+from features import FEATURE_COLUMNS
+from shadow import ShadowScorer
+
+
+class BrokenExecutor:
+    """
+    Stands in for a process pool whose worker crashed
+    """
+
+    def submit(self, *args, **kwargs):
+        raise BrokenProcessPool('A child process terminated abruptly')
+
+
+def test_failed_submit_frees_the_pending_slot(monkeypatch):
+    scorer = ShadowScorer('candidate.pkl', sample_rate=1.0, max_pending=1)
+    monkeypatch.setattr('shadow.ProcessPoolExecutor',
+                        lambda *args, **kwargs: BrokenExecutor())
+    dff = pd.DataFrame({name: [1] for name in FEATURE_COLUMNS})
+    for _ in range(3):
+        assert scorer.sample()
+        assert scorer.submit(dff, [0]) is False
+    stats = scorer.stats()
+    assert stats['pending'] == 0
+    assert stats['errors'] == 3
+    # the slot was freed each time, nothing was dropped as over the limit
+    assert stats['dropped'] == 0
+
+
+def test_sample_rate_zero_never_samples():
+    scorer = ShadowScorer('candidate.pkl', sample_rate=0.0)
+    assert not any(scorer.sample() for _ in range(100))
@@ -0,0 +1,31 @@
+"""
+Test that out-of-core training sees the rows the liblinear path keeps
+"""
+import numpy as np
+from features import load_features
+from training import read_chunks
+
+ROWS = '''corporation,lastmonth_activity,lastyear_activity,\
+number_of_employees,exited
+abcd,10,100,5,0
+efgh,-3,100,5,1
+ijkl,20,200,,1
+mnop,30,300,7,1
+qrst,x,300,7,0
+uvwx,40,400,8,2
+yzab,50,500,9,0
+cdef,60,600,10,1
+'''
+
+
+def test_chunks_match_the_validated_features(tmp_path):
+    data_file = tmp_path / 'finaldata.csv'
+    data_file.write_text(ROWS, encoding='utf8')
+    X, y = load_features(str(data_file), str(tmp_path / 'features'))
+    chunks = list(read_chunks(str(data_file), chunksize=2))
+    assert all(len(chunk_y) <= 2 for _, chunk_y in chunks)
+    np.testing.assert_array_equal(
+        np.concatenate([chunk_X.to_numpy() for chunk_X, _ in chunks]), X)
+    np.testing.assert_array_equal(
+        np.concatenate([chunk_y for _, chunk_y in chunks]), y)
+    assert len(y) == 4
@@ -2,6 +2,14 @@
 This script trains a logistic regression model on the data in finaldata.csv
 and saves the trained model in a file called trainedmodel.pkl
 
+With out_of_core=True (`python training.py --out-of-core`) finaldata.csv is
+streamed in chunks instead of being loaded whole, validated against
+schema.RISK_SCHEMA and prepared like the features of the liblinear model
+(see features.py): a first pass fits the feature scaler, then an
+SGDClassifier with the logistic loss is fitted with partial_fit for one or
+more epochs. Memory use is bounded by the chunk size, so the dataset can be
+larger than RAM.
+
 Author: Derrick Lewis
 Date: 2023-01-28
 """
@@ -9,13 +17,101 @@ import os
 import pickle
 import json
 import logging
-import pandas as pd
-from sklearn.linear_model import LogisticRegression
+import argparse
+import numpy as np
+from sklearn.linear_model import LogisticRegression, SGDClassifier
+from sklearn.pipeline import Pipeline
+from sklearn.preprocessing import StandardScaler
+from features import load_features, feature_frame, prepare, FEATURES_DIR
+from schema import iter_validated
 
 logger = logging.getLogger(__name__)
 
+CHUNKSIZE = 100_000
+
+
+def read_chunks(data_file: str, chunksize: int = CHUNKSIZE):
+    """
+    Stream the features and target of the valid rows of finaldata.csv in
+    chunks, the rows load_features would keep
+
+    Parameters
+    ---
+    data_file: str
+        Path to finaldata.csv
+    chunksize: int
+        Number of rows read per chunk
+
+    Yields
+    ---
+    tuple
+        (X float32 frame, y int8 array) of one chunk
+    """
+    for dff in iter_validated(data_file, chunksize):
+        if len(dff):
+            X, y = prepare(dff)
+            # named columns, like the frames the pipeline predicts
+            yield feature_frame(X), y
+
+
+def fit_out_of_core(
+    data_file: str,
+    chunksize: int = CHUNKSIZE,
+    epochs: int = 1,
+    shuffle: bool = True,
+    random_state: int = 0
+        ) -> Pipeline:
+    """
+    Fit a scaled logistic regression with SGD on finaldata.csv one chunk at
+    a time
+
+    Parameters
+    ---
+    data_file: str
+        Path to finaldata.csv
+    chunksize: int
+        Number of rows held in memory at a time
+    epochs: int
+        Number of passes over the data
+    shuffle: bool
+        Shuffle the rows of every chunk, differently in every epoch. Rows
+        are never mixed across chunks, which would need the whole file.
+    random_state: int
+        Seed of the shuffling and of the SGD
+
+    Returns
+    ---
+    Pipeline
+        StandardScaler and SGDClassifier, usable like the liblinear model
+    """
+    scaler = StandardScaler()
+    for X, _ in read_chunks(data_file, chunksize):
+        scaler.partial_fit(X)
+
+    classifier = SGDClassifier(loss='log_loss', penalty='l2', alpha=0.0001,
+                               random_state=random_state)
+    rng = np.random.default_rng(random_state)
+    for epoch in range(epochs):
+        logger.info('Out-of-core epoch %s of %s', epoch + 1, epochs)
+        for X, y in read_chunks(data_file, chunksize):
+            X = scaler.transform(X)
+            if shuffle:
+                order = rng.permutation(len(y))
+                X, y = X[order], y[order]
+            classifier.partial_fit(X, y, classes=[0, 1])
+    # the fitted scaler is reused as is, fitting the pipeline again would
+    # load the whole dataset
+    return Pipeline([('scaler', scaler), ('classifier', classifier)])
+
 
-def train_model(data_pth: str, model_pth: str) -> None:
+def train_model(
+    data_pth: str,
+    model_pth: str,
+    out_of_core: bool = False,
+    chunksize: int = CHUNKSIZE,
+    epochs: int = 1,
+    shuffle: bool = True
+        ) -> None:
     """
     Trains a logistic regression model on the data in finaldata.csv
 
@@ -25,16 +121,31 @@ def train_model(data_pth: str, model_pth: str) -> None:
         Path to the directory containing finaldata.csv
     model_path: str
         Path to the directory where the trained model will be saved
+    out_of_core: bool
+        Stream the data in chunks into an SGD logistic regression instead of
+        fitting liblinear on the full dataset
+    chunksize: int
+        Rows per chunk in out-of-core mode
+    epochs: int
+        Passes over the data in out-of-core mode
+    shuffle: bool
+        Shuffle the rows within each chunk in out-of-core mode
 
     Returns
     ---
     None
     """
     logger.info("Training model")
+    if out_of_core:
+        logger.info('Fitting model out-of-core in chunks of %s rows',
+                    chunksize)
+        model = fit_out_of_core(data_pth + '/finaldata.csv', chunksize,
+                                epochs, shuffle)
+        write_model(model, model_pth)
+        return None
     try:
-        dff = pd.read_csv(data_pth + '/finaldata.csv')
-        y = dff.pop('exited')
-        X = dff.drop('corporation', axis=1)
+        X, y = load_features(data_pth + '/finaldata.csv',
+                             os.path.join(data_pth, FEATURES_DIR))
     except Exception as e:
         logger.error("Error reading data %s", e)
         raise e
@@ -57,9 +168,23 @@ def train_model(data_pth: str, model_pth: str) -> None:
 
     # fit the logistic regression to your data
     logger.info('Fitting model')
-    model = model.fit(X, y)
+    model = model.fit(feature_frame(X), y)
 
-    # write the trained model in a file called trainedmodel.pkl
+    write_model(model, model_pth)
+    return None
+
+
+def write_model(model, model_pth: str) -> None:
+    """
+    Write the trained model in a file called trainedmodel.pkl
+
+    Parameters
+    ---
+    model: sklearn estimator
+        The fitted model
+    model_path: str
+        Path to the directory where the trained model will be saved
+    """
     logger.info('Writing model to file')
     try:
         with open(model_pth + '/trainedmodel.pkl', 'wb') as mod:
@@ -73,10 +198,16 @@ def train_model(data_pth: str, model_pth: str) -> None:
         logger.error("Error writing model to file %s", e)
         raise e
     logger.info('Model training complete')
-    return None
 
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--out-of-core', action='store_true',
+                        help='Stream finaldata.csv into an SGD classifier')
+    parser.add_argument('--chunksize', type=int, default=CHUNKSIZE)
+    parser.add_argument('--epochs', type=int, default=1)
+    args = parser.parse_args()
+
     logging.basicConfig(
         filename="./logs/training.log",
         level=logging.INFO,
@@ -90,4 +221,5 @@ if __name__ == "__main__":
     dataset_csv_path = os.path.join(config['output_folder_path'])
     model_path = os.path.join(config['output_model_path'])
 
-    train_model(dataset_csv_path, model_path)
+    train_model(dataset_csv_path, model_path, out_of_core=args.out_of_core,
+                chunksize=args.chunksize, epochs=args.epochs)
@@ -0,0 +1,228 @@
+"""
+Long-running watcher that replaces the 10 minute cron launch of
+fullprocess.py. The process stays resident so the imports (pandas, sklearn,
+plotly) and config are loaded once, and new files in the input folder
+trigger a full process cycle within seconds.
+
+The input folder is watched with inotify when the optional `inotify_simple`
+package is installed (Linux only), otherwise it is polled.
+
+Author: Derrick Lewis
+Date: 2023-02-12
+"""
+import os
+import glob
+import time
+import logging
+import threading
+from fullprocess import run_full_process, process_lock
+from reporting import ReportWorker
+
+try:
+    from inotify_simple import INotify, flags
+except ImportError:
+    INotify = None
+
+logger = logging.getLogger(__name__)
+
+# Upper bound on how long a steady stream of arrivals can delay a cycle
+MAX_DEBOUNCE_WAIT = 30.0
+
+
+def snapshot_folder(input_folder_path: str, ext: str) -> dict:
+    """
+    Take a snapshot of the input files used to detect changes when polling
+
+    Parameters
+    ---
+    input_folder_path: str
+        Path to the folder watched for new files
+    ext: str
+        Extension of the files to be read ie. csv, txt, etc.
+
+    Returns
+    ---
+    dict
+        Mapping of file name to (size, modification time)
+    """
+    snapshot = {}
+    for filename in glob.glob(os.path.join(input_folder_path, f'*.{ext}')):
+        try:
+            stat = os.stat(filename)
+        except FileNotFoundError:
+            continue
+        snapshot[os.path.basename(filename)] = (stat.st_size, stat.st_mtime)
+    return snapshot
+
+
+def wait_for_files_polling(
+    input_folder_path: str,
+    ext: str,
+    last: dict,
+    debounce: float,
+    poll_interval: float,
+    stop_event: threading.Event
+        ) -> bool:
+    """
+    Block until the input folder differs from `last` and then stays
+    unchanged for `debounce` seconds
+
+    Parameters
+    ---
+    input_folder_path: str
+        Path to the folder watched for new files
+    ext: str
+        Extension of the files to be read ie. csv, txt, etc.
+    last: dict
+        Snapshot taken before the previous cycle, so that files arriving
+        while it ran are not missed
+    debounce: float
+        Seconds the folder has to stay unchanged before returning
+    poll_interval: float
+        Seconds between scans of the folder
+    stop_event: threading.Event
+        Set to stop waiting
+
+    Returns
+    ---
+    bool
+        True if a change was detected, False if stop_event was set
+    """
+    while not stop_event.wait(poll_interval):
+        current = snapshot_folder(input_folder_path, ext)
+        if current == last:
+            continue
+        # debounce: wait until the folder stops changing
+        started = time.monotonic()
+        while time.monotonic() - started < MAX_DEBOUNCE_WAIT:
+            if stop_event.wait(debounce):
+                return False
+            last, current = current, snapshot_folder(input_folder_path, ext)
+            if current == last:
+                break
+        return True
+    return False
+
+
+def wait_for_files_inotify(
+    inotify,
+    ext: str,
+    debounce: float,
+    poll_interval: float,
+    stop_event: threading.Event
+        ) -> bool:
+    """
+    Block until a matching file is written or moved into the watched folder
+    and no further events arrive for `debounce` seconds
+
+    Parameters
+    ---
+    inotify: inotify_simple.INotify
+        INotify instance already watching the input folder
+    ext: str
+        Extension of the files to be read ie. csv, txt, etc.
+    debounce: float
+        Seconds without events before returning
+    poll_interval: float
+        Seconds between checks of stop_event
+    stop_event: threading.Event
+        Set to stop waiting
+
+    Returns
+    ---
+    bool
+        True if a change was detected, False if stop_event was set
+    """
+    def matching(events):
+        return any(event.name.endswith('.' + ext) for event in events)
+
+    while not stop_event.is_set():
+        if not matching(inotify.read(timeout=int(poll_interval * 1000))):
+            continue
+        started = time.monotonic()
+        while time.monotonic() - started < MAX_DEBOUNCE_WAIT:
+            if not inotify.read(timeout=int(debounce * 1000)):
+                break
+        return True
+    return False
+
+
+def run_cycle(config: dict, report_worker: ReportWorker = None) -> None:
+    """
+    Run one full process cycle under the process lock, logging rather than
+    raising errors so that the daemon keeps running
+
+    Parameters
+    ---
+    config: dict
+        Config values as returned by fullprocess.load_config
+    report_worker: ReportWorker
+        Worker the reports are rendered on in the background
+    """
+    start = time.monotonic()
+    try:
+        with process_lock(blocking=True):
+            redeployed = run_full_process(config, report_worker)
+    except Exception as e:
+        logger.exception("Full process cycle failed: %s", e)
+        return
+    logger.info("Full process cycle finished in %.2fs, redeployed: %s",
+                time.monotonic() - start, redeployed)
+
+
+def run_daemon(
+    config: dict,
+    debounce: float = 2.0,
+    poll_interval: float = 5.0,
+    stop_event: threading.Event = None
+        ) -> None:
+    """
+    Watch the input folder and run a full process cycle whenever new files
+    arrive. A cycle is also run on startup to pick up files that arrived
+    while the daemon was down.
+
+    Parameters
+    ---
+    config: dict
+        Config values as returned by fullprocess.load_config
+    debounce: float
+        Seconds without new file events before a cycle is triggered
+    poll_interval: float
+        Seconds between scans when inotify is not available
+    stop_event: threading.Event
+        Set to stop the daemon, runs forever if None
+    """
+    stop_event = stop_event or threading.Event()
+    input_path = config['input_folder_path']
+    ext = config['input_file_extension']
+
+    inotify = None
+    if INotify is not None:
+        inotify = INotify()
+        inotify.add_watch(input_path, flags.CLOSE_WRITE | flags.MOVED_TO)
+        logger.info("Watching %s with inotify", input_path)
+    else:
+        logger.info("inotify not available, polling %s every %.1fs",
+                    input_path, poll_interval)
+
+    report_worker = ReportWorker()
+    try:
+        snapshot = snapshot_folder(input_path, ext)
+        run_cycle(config, report_worker)
+        while not stop_event.is_set():
+            if inotify is not None:
+                changed = wait_for_files_inotify(
+                    inotify, ext, debounce, poll_interval, stop_event)
+            else:
+                changed = wait_for_files_polling(
+                    input_path, ext, snapshot, debounce, poll_interval,
+                    stop_event)
+                snapshot = snapshot_folder(input_path, ext)
+            if changed:
+                logger.info("New files detected in %s", input_path)
+                run_cycle(config, report_worker)
+    finally:
+        if inotify is not None:
+            inotify.close()
+        report_worker.close()
+    logger.info("Watcher stopped")
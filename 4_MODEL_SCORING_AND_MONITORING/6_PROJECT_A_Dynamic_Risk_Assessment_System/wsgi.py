@@ -1,4 +1,4 @@
-from app import app
+from app import app, server  # noqa: F401, served as wsgi:server
 
 
 if __name__ == "__main__":